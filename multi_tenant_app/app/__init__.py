@@ -1,50 +1,75 @@
 from flask import Flask
 from flask_sqlalchemy import SQLAlchemy
 from app.config import Config
+from app.queues import configure_queues
 from celery import Celery
-from flask_jwt_extended import JWTManager
-from flask_migrate import Migrate
-from flask_limiter import Limiter
-from flask_limiter.util import get_remote_address
-from flask_cors import CORS
+from celery.signals import worker_init, worker_process_init
 
 db = SQLAlchemy()
+# Configured by create_app(); tasks and blueprints import it before an app exists.
+celery = Celery(__name__)
 
 def make_celery(app):
-    celery = Celery(
-        app.import_name,
-        broker=app.config['CELERY_BROKER_URL'],
-        backend=app.config['CELERY_RESULT_BACKEND']
-    )
+    celery.conf.broker_url = app.config['CELERY_BROKER_URL']
+    celery.conf.result_backend = app.config['CELERY_RESULT_BACKEND']
     celery.conf.update(app.config)
+    celery.conf.result_expires = app.config['CELERY_RESULT_EXPIRES']
+    configure_queues(celery)
     TaskBase = celery.Task
     class ContextTask(TaskBase):
         def __call__(self, *args, **kwargs):
             with app.app_context():
                 return TaskBase.__call__(self, *args, **kwargs)
     celery.Task = ContextTask
+
+    @worker_process_init.connect(weak=False)
+    def dispose_engine(**kwargs):
+        # Pooled connections inherited from the parent must not be shared by forked children.
+        with app.app_context():
+            db.engine.dispose()
+
+    @worker_init.connect(weak=False)
+    def start_metrics_exporter(**kwargs):
+        if app.config['METRICS_WORKER_PORT']:
+            from app.metrics import start_exporter  # Avoid circular import
+            start_exporter(app.config['METRICS_WORKER_PORT'])
+
     return celery
 
-def create_app(config_class=Config):
+def create_app(config_class=Config, web=True):
+    """
+    Builds the Flask app and configures the shared Celery app for it. Celery
+    workers pass web=False: they get the database, tracing and tasks but none of
+    the blueprints and the modules those pull in. The schema is not created
+    here; run `flask db upgrade` (or `flask init-db` for a scratch database).
+    """
     app = Flask(__name__)
     app.config.from_object(config_class)
     
     # Initialize extensions
     db.init_app(app)
-    JWTManager(app)
-    Migrate(app, db)
-    Limiter(app, key_func=get_remote_address)
-    CORS(app)
+    make_celery(app)
 
     with app.app_context():
-        from app import models, routes, admin, auth, chain
-        db.create_all()
-        app.register_blueprint(routes.bp, url_prefix="/api/v1")
-        app.register_blueprint(admin.admin_bp, url_prefix="/api/v1/admin")
-        app.register_blueprint(auth.auth_bp, url_prefix="/api/v1/auth")
-        app.register_blueprint(chain.chain_bp, url_prefix="/api/v1/chain")
+        from app import models, tasks, tracing
+        if web:
+            # Web-only extensions are imported here so workers do not load them.
+            from flask_jwt_extended import JWTManager
+            from flask_migrate import Migrate
+            from flask_cors import CORS
+            from app import routes, admin, auth, chains, cli, metrics, rate_limit
+            JWTManager(app)
+            Migrate(app, db)
+            CORS(app)
+            tracing.init_app(app)
+            rate_limit.init_app(app)
+            app.register_blueprint(routes.bp, url_prefix="/api/v1")
+            app.register_blueprint(admin.admin_bp, url_prefix="/api/v1/admin")
+            app.register_blueprint(auth.auth_bp, url_prefix="/api/v1/auth")
+            app.register_blueprint(chains.chain_bp, url_prefix="/api/v1/chain")
+            app.register_blueprint(metrics.metrics_bp)
+            app.cli.add_command(cli.init_db)
+            app.cli.add_command(cli.chroma_cli)
+            app.cli.add_command(cli.fair_share_cli)
     
     return app
-
-app = create_app()
-celery = make_celery(app)
@@ -2,7 +2,12 @@ from flask import Blueprint, request, jsonify
 from app.models import Tenant, EmailAgentConfig, DocumentSummarizerConfig, SFDCConfig
 from app import db
 from app.schemas import TenantSetup
+from app.config_cache import invalidate_tenant_config
+from app.chroma import drop_tenant_collection
+from app.chain_definitions import invalidate_chain_definitions
+from app import circuit_breaker, fair_share, idempotency, rate_limit
 from pydantic import ValidationError
+from sqlalchemy.exc import IntegrityError
 from flask_jwt_extended import jwt_required
 
 admin_bp = Blueprint('admin', __name__)
@@ -18,7 +23,8 @@ def setup_tenant():
         "tenant_name": "TenantName",
         "email_config": { ... },
         "doc_sum_config": { ... },
-        "sfdc_config": { ... }
+        "sfdc_config": { ... },
+        "chain_run_ttl_seconds": 604800   // optional retention of chain run results
     }
     """
     try:
@@ -26,47 +32,150 @@ def setup_tenant():
     except ValidationError as err:
         return jsonify({"error": err.errors()}), 400
 
-    tenant_name = validated_data.tenant_name
-    
-    # Check for an existing tenant
-    existing_tenant = Tenant.query.filter_by(name=tenant_name).first()
-    if existing_tenant:
-        return jsonify({"error": "Tenant already exists"}), 400
+    # The tenant and its configs are inserted in one transaction; a duplicate
+    # name is reported by the unique constraint on tenants.name.
+    tenant = Tenant(name=validated_data.tenant_name, chain_run_ttl_seconds=validated_data.chain_run_ttl_seconds)
+    if validated_data.email_config:
+        tenant.email_configs.append(EmailAgentConfig(
+            smtp_server=validated_data.email_config.smtp_server,
+            smtp_port=validated_data.email_config.smtp_port,
+            smtp_username=validated_data.email_config.smtp_username,
+            smtp_password=validated_data.email_config.smtp_password
+        ))
+    if validated_data.doc_sum_config:
+        tenant.doc_sum_configs.append(DocumentSummarizerConfig(
+            summarizer_setting=validated_data.doc_sum_config.summarizer_setting
+        ))
+    if validated_data.sfdc_config:
+        tenant.sfdc_configs.append(SFDCConfig(
+            sfdc_instance_url=validated_data.sfdc_config.sfdc_instance_url,
+            sfdc_access_token=validated_data.sfdc_config.sfdc_access_token
+        ))
 
     try:
-        tenant = Tenant(name=tenant_name)
         db.session.add(tenant)
+        db.session.flush()
+        tenant_id = tenant.id
         db.session.commit()
+    except IntegrityError:
+        db.session.rollback()
+        return jsonify({"error": "Tenant already exists"}), 400
+    except Exception as e:
+        db.session.rollback()
+        return jsonify({"error": str(e)}), 500
 
-        if validated_data.email_config:
-            email_config = EmailAgentConfig(
-                tenant_id=tenant.id,
-                smtp_server=validated_data.email_config.smtp_server,
-                smtp_port=validated_data.email_config.smtp_port,
-                smtp_username=validated_data.email_config.smtp_username,
-                smtp_password=validated_data.email_config.smtp_password
-            )
-            db.session.add(email_config)
-            
-        if validated_data.doc_sum_config:
-            doc_config = DocumentSummarizerConfig(
-                tenant_id=tenant.id,
-                summarizer_setting=validated_data.doc_sum_config.summarizer_setting
-            )
-            db.session.add(doc_config)
-            
-        if validated_data.sfdc_config:
-            sfdc_config = SFDCConfig(
-                tenant_id=tenant.id,
-                sfdc_instance_url=validated_data.sfdc_config.sfdc_instance_url,
-                sfdc_access_token=validated_data.sfdc_config.sfdc_access_token
-            )
-            db.session.add(sfdc_config)
-            
-        db.session.commit()
-        
-        return jsonify({"message": "Tenant setup successfully", "tenant_id": tenant.id}), 201
+    invalidate_tenant_config(tenant_id)
+    return jsonify({"message": "Tenant setup successfully", "tenant_id": tenant_id}), 201
+
+@admin_bp.route('/tenants/<int:tenant_id>', methods=['DELETE'])
+@jwt_required()
+def delete_tenant(tenant_id):
+    """
+    Admin endpoint to delete a tenant with its configurations, agent chains,
+    vector collection and the state kept for it in Redis (rate limits,
+    fair-share backlog and weight, circuit breakers, idempotency records), so a
+    tenant created later with the same id starts afresh.
+    """
+    tenant = Tenant.get_with_children(tenant_id)
+    if not tenant:
+        return jsonify({"error": "Tenant not found"}), 404
 
+    try:
+        db.session.delete(tenant)
+        db.session.commit()
     except Exception as e:
         db.session.rollback()
         return jsonify({"error": str(e)}), 500
+
+    invalidate_tenant_config(tenant_id)
+    invalidate_chain_definitions(tenant_id)
+    drop_tenant_collection(tenant_id)
+    rate_limit.clear_tenant(tenant_id)
+    fair_share.clear_tenant(tenant_id)
+    circuit_breaker.clear_tenant(tenant_id)
+    idempotency.clear_tenant(tenant_id)
+    return jsonify({"message": "Tenant deleted successfully", "tenant_id": tenant_id}), 200
+
+@admin_bp.route('/tenants/<int:tenant_id>/queue_weight', methods=['PUT'])
+@jwt_required()
+def set_tenant_queue_weight(tenant_id):
+    """
+    Sets the tenant's share of the task queues relative to other tenants
+    (default 1) for the fair-share dispatcher.
+    Expected JSON:
+    {
+        "weight": 2
+    }
+    """
+    weight = (request.get_json() or {}).get('weight')
+    if isinstance(weight, bool) or not isinstance(weight, (int, float)) or weight <= 0:
+        return jsonify({"error": "weight must be a positive number"}), 400
+    fair_share.set_weight(tenant_id, weight)
+    return jsonify({"tenant_id": tenant_id, "weight": weight}), 200
+
+@admin_bp.route('/tenants/<int:tenant_id>/rate_limits', methods=['PUT'])
+@jwt_required()
+def set_tenant_rate_limits(tenant_id):
+    """
+    Overrides the tenant's quotas (see app/rate_limit.py) as "count/seconds";
+    null restores the default. Quotas not named are left unchanged.
+    Expected JSON:
+    {
+        "requests": "3000/60",
+        "llm_tokens": "500000/3600",
+        "search_document": null
+    }
+    """
+    limits = request.get_json()
+    if not isinstance(limits, dict) or not limits:
+        return jsonify({"error": "Expected an object of quota limits"}), 400
+    try:
+        rate_limit.set_overrides(tenant_id, limits)
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+    return jsonify({"tenant_id": tenant_id, "overrides": rate_limit.get_overrides(tenant_id)}), 200
+
+@admin_bp.route('/tenants/<int:tenant_id>/rate_limits', methods=['GET'])
+@jwt_required()
+def get_tenant_rate_limits(tenant_id):
+    """
+    The tenant's overrides and, for every limited quota, its effective limit,
+    the units remaining and the seconds until the quota is full again.
+    """
+    return jsonify({
+        "tenant_id": tenant_id,
+        "overrides": rate_limit.get_overrides(tenant_id),
+        "quotas": rate_limit.get_usage(tenant_id)
+    }), 200
+
+@admin_bp.route('/tenants/<int:tenant_id>/circuits', methods=['GET'])
+@jwt_required()
+def get_tenant_circuits(tenant_id):
+    """
+    The state of the tenant's circuit breakers (see app/circuit_breaker.py):
+    closed, open or half_open, when an open one lets a probe through, how many
+    times it opened in a row, and the calls and failures of the current window.
+    """
+    return jsonify({"tenant_id": tenant_id, "circuits": circuit_breaker.get_states(tenant_id)}), 200
+
+@admin_bp.route('/tenants/<int:tenant_id>/circuits/<dependency>', methods=['DELETE'])
+@jwt_required()
+def reset_tenant_circuit(tenant_id, dependency):
+    """
+    Closes the tenant's circuit breaker for a dependency, e.g. once its
+    Salesforce or SMTP configuration has been fixed.
+    """
+    if dependency not in circuit_breaker.DEPENDENCIES:
+        return jsonify({"error": f"Unknown dependency: {dependency}"}), 404
+    circuit_breaker.reset(tenant_id, dependency)
+    return jsonify({"tenant_id": tenant_id, "dependency": dependency, "state": "closed"}), 200
+
+@admin_bp.route('/queues', methods=['GET'])
+@jwt_required()
+def queue_stats():
+    """
+    Queue depth per agent queue, with each tenant's backlog, dispatched count
+    and weight. The depths are also exported to /metrics as agent_queue_depth
+    and agent_broker_queue_depth.
+    """
+    return jsonify(fair_share.get_stats()), 200
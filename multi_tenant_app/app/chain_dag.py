@@ -0,0 +1,78 @@
+"""
+Dependency resolution for agent chain steps.
+
+A step may declare ``depends_on`` as a list of step_orders it waits for. Steps
+that leave it unset (None) keep the original sequential semantics and wait for
+the previous step; an empty list makes the step a root that only needs the
+chain input. A step runs as soon as the steps it depends on have finished, and
+sees the chain input with the changes of the steps it (transitively) depends
+on, so e.g. the doc_sum agent's ``summary`` is only visible to its dependents.
+"""
+
+class ChainGraphError(ValueError):
+    """Raised when step dependencies reference unknown steps or form a cycle."""
+
+def resolve_dependencies(steps):
+    """
+    Returns {step_order: [step_orders it depends on]} for step dicts with
+    "step_order" and "depends_on" keys.
+    """
+    ordered = sorted(steps, key=lambda s: s["step_order"])
+    orders = [step["step_order"] for step in ordered]
+    if len(set(orders)) != len(orders):
+        raise ChainGraphError("step_order values must be unique")
+
+    known = set(orders)
+    dependencies = {}
+    previous = None
+    for step in ordered:
+        depends_on = step.get("depends_on")
+        if depends_on is None:
+            depends_on = [previous] if previous is not None else []
+        for order in depends_on:
+            if order not in known:
+                raise ChainGraphError(f"Step {step['step_order']} depends on unknown step {order}")
+            if order == step["step_order"]:
+                raise ChainGraphError(f"Step {order} cannot depend on itself")
+        dependencies[step["step_order"]] = sorted(set(depends_on))
+        previous = step["step_order"]
+    return dependencies
+
+def plan_steps(steps):
+    """
+    Returns the steps in a topological order (by step_order among steps whose
+    dependencies are met together), each as a copy with "depends_on" set to the
+    step_orders it waits for, "dependents" to those waiting for it and
+    "ancestors" to every step it transitively depends on, in plan order.
+    Raises ChainGraphError on cycles.
+    """
+    dependencies = resolve_dependencies(steps)
+    by_order = {step["step_order"]: step for step in steps}
+    order = []
+    placed = set()
+    remaining = sorted(dependencies)
+    while remaining:
+        ready = [step_order for step_order in remaining if all(dep in placed for dep in dependencies[step_order])]
+        if not ready:
+            raise ChainGraphError(f"Dependency cycle between steps {remaining}")
+        order.extend(ready)
+        placed.update(ready)
+        remaining = [step_order for step_order in remaining if step_order not in placed]
+
+    position = {step_order: index for index, step_order in enumerate(order)}
+    ancestors = {}
+    dependents = {step_order: [] for step_order in order}
+    for step_order in order:
+        ancestors[step_order] = set(dependencies[step_order])
+        for dep in dependencies[step_order]:
+            ancestors[step_order].update(ancestors[dep])
+            dependents[dep].append(step_order)
+    return [
+        dict(
+            by_order[step_order],
+            depends_on=dependencies[step_order],
+            dependents=dependents[step_order],
+            ancestors=sorted(ancestors[step_order], key=position.get)
+        )
+        for step_order in order
+    ]
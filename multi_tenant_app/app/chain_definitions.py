@@ -0,0 +1,67 @@
+"""
+Compiled chain definitions used by execute_chain.
+
+A chain is loaded with its steps in one query and compiled into what the chain
+engine dispatches: serializable step specs, their dependency plan and warmed
+condition predicates. Compiled definitions are cached per process, so repeated
+executions of a chain do not touch the database. Chains are not edited once
+created; deleting a tenant drops its entries in this process, and other
+processes let them expire after CHAIN_DEFINITION_CACHE_TTL seconds.
+"""
+import threading
+from flask import current_app
+from app.cache import TTLCache, MISSING
+from app.chain_dag import plan_steps
+from app.chain_engine import step_spec
+from app.conditions import get_predicate
+from app.models import AgentChain
+from app.tracing import dependency_call
+
+_cache = None
+_cache_lock = threading.Lock()
+
+def _get_cache():
+    global _cache
+    if _cache is None:
+        with _cache_lock:
+            if _cache is None:
+                _cache = TTLCache(
+                    maxsize=current_app.config['CHAIN_DEFINITION_CACHE_SIZE'],
+                    ttl=current_app.config['CHAIN_DEFINITION_CACHE_TTL']
+                )
+    return _cache
+
+def compile_definition(chain):
+    steps = [step_spec(step) for step in chain.steps]
+    for step in steps:
+        if step["condition"]:
+            get_predicate(step["id"], step["condition"])
+    return {
+        "chain_id": chain.id,
+        "tenant_id": chain.tenant_id,
+        "name": chain.name,
+        "steps": steps,
+        "plan": plan_steps(steps),
+        "run_ttl": chain.tenant.chain_run_ttl_seconds
+    }
+
+def get_chain_definition(chain_id, tenant_id):
+    """
+    Returns the compiled definition of the tenant's chain, or None if the tenant
+    has no such chain. Unknown chains are not cached, so a chain created later
+    is found immediately.
+    """
+    cache = _get_cache()
+    key = (tenant_id, chain_id)
+    definition = cache.get(key)
+    if definition is MISSING:
+        with dependency_call("db", "chain_definition"):
+            chain = AgentChain.get_with_steps(chain_id, tenant_id)
+        if chain is None:
+            return None
+        definition = compile_definition(chain)
+        cache.set(key, definition)
+    return definition
+
+def invalidate_chain_definitions(tenant_id):
+    _get_cache().pop_matching(lambda key: key[0] == tenant_id)
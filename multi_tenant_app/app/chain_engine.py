@@ -0,0 +1,225 @@
+import copy
+import time
+import uuid
+from celery import states
+from app import celery, chain_runs, idempotency, summary_cache
+from app.conditions import get_predicate
+from app.tracing import span
+
+class ChainInputError(Exception):
+    """Raised when a chain step is missing the input its agent needs."""
+
+# Agents whose side effects must not be repeated when a step task is retried.
+SIDE_EFFECT_AGENTS = ("sfdc", "email")
+
+# External dependencies behind circuit breakers (see app/circuit_breaker.py), by agent.
+AGENT_DEPENDENCIES = {"sfdc": "salesforce", "email": "smtp"}
+
+def step_spec(step):
+    """
+    Serializable description of an AgentChainStep, passed to the step tasks.
+    """
+    return {
+        "id": step.id,
+        "step_order": step.step_order,
+        "agent_name": step.agent_name,
+        "condition": step.condition,
+        "depends_on": step.dependencies
+    }
+
+def chain_dependencies(definition):
+    """The circuit-broken dependencies the steps of a compiled chain call."""
+    agents = {step["agent_name"] for step in definition["steps"]}
+    return sorted({AGENT_DEPENDENCIES[agent] for agent in agents if agent in AGENT_DEPENDENCIES})
+
+def should_run(step, input_data):
+    if not step["condition"]:
+        return True
+    return get_predicate(step["id"], step["condition"])(input_data)
+
+def run_agent(agent_name, tenant_id, input_data):
+    """
+    Runs a single agent inline (inside the step task) and returns its output.
+    If a summary is produced by the doc_sum agent, it is injected into the
+    lead_data (as the "Description" field) for the sfdc agent.
+    """
+    from app.tasks import summarize_document, create_lead, send_email  # Avoid circular import
+
+    if agent_name == "doc_sum":
+        document_text = input_data.get("document_text")
+        if not document_text:
+            raise ChainInputError("document_text is required for document summarization")
+        summary = summarize_document(tenant_id, document_text)
+        input_data["summary"] = summary
+        return summary
+    elif agent_name == "sfdc":
+        lead_data = input_data.get("lead_data")
+        if not lead_data:
+            raise ChainInputError("lead_data is required for SFDC lead creation")
+        if "summary" in input_data:
+            lead_data["Description"] = input_data["summary"]
+        return create_lead(tenant_id, lead_data)
+    elif agent_name == "email":
+        email_params = input_data.get("email_params")
+        if not email_params:
+            raise ChainInputError("email_params is required for sending email")
+        return send_email(
+            tenant_id,
+            email_params.get("recipient"),
+            email_params.get("subject"),
+            email_params.get("body")
+        )
+    raise ChainInputError(f"Unknown agent: {agent_name}")
+
+def merge_changes(input_data, changes):
+    """
+    The chain context after the given steps' changes (see execute_step), applied
+    in plan order over the chain input: a step's own changes win over those of
+    the steps it depends on, and unchanged copies never overwrite anything.
+    """
+    context = {"input": input_data, "result": {}}
+    for change in changes:
+        context["input"].update(change["input"])
+        context["result"].update(change["result"])
+    return context
+
+def step_context(run_id, step):
+    """The context a step runs in: the chain input with the changes of the steps it depends on."""
+    input_data, changes = chain_runs.get_changes(run_id, step["ancestors"])
+    return merge_changes(input_data, changes)
+
+def resolve_cached_step(run_id, tenant_id, step, input_data):
+    """
+    Completes a doc_sum step from the summary cache without dispatching it.
+    Returns the step's changes when it was resolved, else None.
+    """
+    document_text = input_data.get("document_text")
+    if step["agent_name"] != "doc_sum" or not document_text or not should_run(step, input_data):
+        return None
+    summary = summary_cache.get(summary_cache.cache_key(tenant_id, document_text, summary_cache.SINGLE))
+    if summary is None:
+        return None
+    now = time.time()
+    chain_runs.update_step(
+        run_id, step["step_order"],
+        status="succeeded",
+        cached=True,
+        started_at=now,
+        finished_at=now,
+        duration_ms=0,
+        output=summary
+    )
+    return {"input": {"summary": summary}, "result": {step["agent_name"]: summary}}
+
+def execute_step(run_id, tenant_id, step):
+    """
+    Executes one step of a chain run in the context of the steps it depends on,
+    and records its progress and timing. Returns the step's changes: the input
+    fields it set or modified, and its output.
+    """
+    input_data = step_context(run_id, step)["input"]
+    step_order = step["step_order"]
+    with span("chain.condition", step_id=step["id"]):
+        run = should_run(step, input_data)
+    if not run:
+        chain_runs.update_step(run_id, step_order, status="skipped")
+        return {"input": {}, "result": {}}
+
+    started_at = time.time()
+    chain_runs.update_step(run_id, step_order, status="running", started_at=started_at)
+
+    def run_step_agent():
+        before = copy.deepcopy(input_data)
+        output = run_agent(step["agent_name"], tenant_id, input_data)
+        changed = {name: value for name, value in input_data.items() if name not in before or before[name] != value}
+        return {"output": output, "changed": changed}
+
+    if step["agent_name"] in SIDE_EFFECT_AGENTS:
+        # The input changes are recorded with the output: a retry returns both
+        # without running the agent that made them.
+        outcome = idempotency.execute(tenant_id, "chain_step", f"{run_id}:{step['id']}", run_step_agent)
+    else:
+        outcome = run_step_agent()
+    output = outcome["output"]
+    finished_at = time.time()
+    chain_runs.update_step(
+        run_id, step_order,
+        status="succeeded",
+        finished_at=finished_at,
+        duration_ms=round((finished_at - started_at) * 1000, 2),
+        output=output
+    )
+    return {"input": outcome["changed"], "result": {step["agent_name"]: output}}
+
+def dispatch_step(run_id, tenant_id, plan, step, result_id):
+    from app.tasks import run_chain_step_task  # Avoid circular import
+    run_chain_step_task.apply_async((run_id, tenant_id, plan, step), {"result_id": result_id}, ignore_result=True)
+
+def start_step(run_id, tenant_id, plan, step, result_id=None, input_data=None):
+    """
+    Starts a step whose dependencies have all finished: a doc_sum step whose
+    summary is already cached is completed here instead of costing a task round
+    trip; any other step is dispatched. input_data is the step's context if the
+    caller already has it.
+    """
+    if step["agent_name"] == "doc_sum":
+        if input_data is None:
+            input_data = step_context(run_id, step)["input"]
+        changes = resolve_cached_step(run_id, tenant_id, step, input_data)
+        if changes is not None:
+            advance_run(run_id, tenant_id, plan, step, changes, result_id)
+            return
+    dispatch_step(run_id, tenant_id, plan, step, result_id)
+
+def advance_run(run_id, tenant_id, plan, step, changes, result_id=None):
+    """
+    Records a finished step and starts the dependents whose dependencies have
+    now all finished (see start_step); the last step to finish finalizes the run.
+    """
+    completed = chain_runs.complete_step(run_id, step["step_order"], changes, step["dependents"])
+    if completed is None:
+        return
+    remaining, ready = completed
+    by_order = {planned["step_order"]: planned for planned in plan}
+    for step_order in ready:
+        start_step(run_id, tenant_id, plan, by_order[step_order], result_id)
+    if remaining == 0:
+        finalize_run(run_id, plan, result_id)
+
+def fail_step(run_id, step, exc, result_id=None):
+    chain_runs.update_step(run_id, step["step_order"], status="failed", finished_at=time.time(), error=str(exc))
+    chain_runs.finish_run(run_id, "failed", error=str(exc))
+    if result_id:
+        celery.backend.mark_as_failure(result_id, exc)
+
+def finalize_run(run_id, plan, result_id=None):
+    input_data, changes = chain_runs.get_changes(run_id, [step["step_order"] for step in plan])
+    result = merge_changes(input_data, changes)["result"]
+    chain_runs.finish_run(run_id, "succeeded", result=result)
+    if result_id:
+        celery.backend.store_result(result_id, result, states.SUCCESS)
+    return result
+
+def start_chain_run(definition, tenant_id, input_data, store_result=True):
+    """
+    Records a new run for a compiled chain definition (see app/chain_definitions.py)
+    and starts its root steps without waiting (see start_step). Each step task
+    starts the dependents it was the last dependency of, and the last one to
+    finish finalizes the run.
+
+    Steps read their context from the run store rather than the messages. With
+    store_result, the chain result (or the error of the failed step) is also
+    written to the result backend under the id of the returned AsyncResult.
+    Returns (run_id, AsyncResult of the chain, or None without store_result).
+    """
+    run_id = uuid.uuid4().hex
+    result_id = uuid.uuid4().hex if store_result else None
+    plan = definition["plan"]
+    chain_runs.create_run(run_id, tenant_id, definition["chain_id"], plan, definition["run_ttl"], input_data)
+    if not plan:
+        finalize_run(run_id, plan, result_id)
+    for step in plan:
+        if step["depends_on"]:
+            continue
+        start_step(run_id, tenant_id, plan, step, result_id, input_data)
+    return run_id, celery.AsyncResult(result_id) if result_id else None
@@ -0,0 +1,188 @@
+import json
+import time
+import zlib
+import msgpack
+from flask import current_app
+from app.redis_client import get_redis
+
+# Each chain run is stored as a Redis hash: a "meta" field with the run status
+# and one "step:<step_order>" field per step, so parallel steps never overwrite
+# each other's progress. The scheduling state lives in the same hash: the chain
+# input, the changes each finished step made to its context, the number of
+# unfinished dependencies of each step and of unfinished steps. The whole run
+# expires after the tenant's retention.
+RUN_KEY = "chain_run:{run_id}"
+META_FIELD = "meta"
+STEP_FIELD = "step:{step_order}"
+STEP_PREFIX = "step:"
+INPUT_FIELD = "input"
+CHANGES_FIELD = "changes:{step_order}"
+WAITING_FIELD = "waiting:{step_order}"
+REMAINING_FIELD = "remaining"
+HALTED_FIELD = "halted"
+
+# Field values are msgpack, zlib-compressed when large (e.g. long summaries);
+# a one-byte prefix tells the two apart.
+PACKED = b"\x00"
+COMPRESSED = b"\x01"
+
+# KEYS[1] is the run. ARGV: the step_order, its encoded changes and the
+# step_orders of its dependents. Records the changes once, counts the step off
+# its dependents and returns {steps left, dependents now ready...}, or nil if
+# the step was already completed or the run failed or expired.
+_COMPLETE_SCRIPT = """
+if redis.call('EXISTS', KEYS[1]) == 0 or redis.call('HEXISTS', KEYS[1], 'halted') == 1 then
+    return nil
+end
+if redis.call('HSETNX', KEYS[1], 'changes:' .. ARGV[1], ARGV[2]) == 0 then
+    return nil
+end
+local ready = {redis.call('HINCRBY', KEYS[1], 'remaining', -1)}
+for i = 3, #ARGV do
+    if redis.call('HINCRBY', KEYS[1], 'waiting:' .. ARGV[i], -1) == 0 then
+        table.insert(ready, tonumber(ARGV[i]))
+    end
+end
+return ready
+"""
+
+_complete_script = None
+
+def _key(run_id):
+    return RUN_KEY.format(run_id=run_id)
+
+def _ttl():
+    return current_app.config.get('CHAIN_RUN_TTL_SECONDS', 86400)
+
+def encode(data):
+    packed = msgpack.packb(data, use_bin_type=True)
+    min_bytes = current_app.config['CHAIN_RUN_COMPRESS_MIN_BYTES']
+    if min_bytes and len(packed) >= min_bytes:
+        return COMPRESSED + zlib.compress(packed)
+    return PACKED + packed
+
+def decode(value):
+    marker, body = value[:1], value[1:]
+    if marker == COMPRESSED:
+        return msgpack.unpackb(zlib.decompress(body), raw=False)
+    if marker == PACKED:
+        return msgpack.unpackb(body, raw=False)
+    # Runs recorded before the msgpack encoding
+    return json.loads(value)
+
+def create_run(run_id, tenant_id, chain_id, steps, ttl=None, input_data=None):
+    """
+    Records a new chain run with all of its steps (as planned by
+    app.chain_dag.plan_steps) in the "pending" state, and its input.
+    The run itself is "running" as soon as it has been recorded. It is kept for
+    `ttl` seconds (the tenant's retention), else CHAIN_RUN_TTL_SECONDS.
+    """
+    meta = {
+        "run_id": run_id,
+        "tenant_id": tenant_id,
+        "chain_id": chain_id,
+        "status": "running",
+        "created_at": time.time(),
+        "finished_at": None,
+        "result": None,
+        "error": None
+    }
+    fields = {META_FIELD: encode(meta), INPUT_FIELD: encode(input_data or {}), REMAINING_FIELD: len(steps)}
+    for step in steps:
+        if step.get("depends_on"):
+            fields[WAITING_FIELD.format(step_order=step["step_order"])] = len(step["depends_on"])
+        fields[STEP_FIELD.format(step_order=step["step_order"])] = encode({
+            "step_order": step["step_order"],
+            "agent_name": step["agent_name"],
+            "status": "pending",
+            "started_at": None,
+            "finished_at": None,
+            "duration_ms": None,
+            "output": None,
+            "error": None
+        })
+    key = _key(run_id)
+    pipe = get_redis().pipeline()
+    pipe.hset(key, mapping=fields)
+    pipe.expire(key, ttl or _ttl())
+    pipe.execute()
+
+def _update_field(run_id, field, changes):
+    redis_client = get_redis()
+    key = _key(run_id)
+    raw = redis_client.hget(key, field)
+    if raw is None:
+        # The run has expired; writing would recreate it without a TTL.
+        return
+    data = decode(raw)
+    data.update(changes)
+    redis_client.hset(key, field, encode(data))
+
+def update_step(run_id, step_order, **changes):
+    """
+    Updates the progress of a single step (status, timings, output, error).
+    """
+    _update_field(run_id, STEP_FIELD.format(step_order=step_order), changes)
+
+def complete_step(run_id, step_order, changes, dependents):
+    """
+    Records the changes a finished step made to its context and counts it off
+    its dependents. Returns (number of steps left, step_orders of dependents
+    whose dependencies have now all finished), or None if the step had already
+    been completed, or the run failed or expired: nothing more is to be done.
+    """
+    global _complete_script
+    redis_client = get_redis()
+    if _complete_script is None:
+        _complete_script = redis_client.register_script(_COMPLETE_SCRIPT)
+    completed = _complete_script(keys=[_key(run_id)], args=[step_order, encode(changes), *dependents])
+    if completed is None:
+        return None
+    return completed[0], completed[1:]
+
+def get_changes(run_id, step_orders):
+    """
+    Returns the run's input and the changes recorded by the given steps, in
+    their order.
+    """
+    fields = [INPUT_FIELD] + [CHANGES_FIELD.format(step_order=step_order) for step_order in step_orders]
+    values = get_redis().hmget(_key(run_id), fields)
+    if values[0] is None:
+        raise LookupError(f"Chain run {run_id} has expired")
+    return decode(values[0]), [decode(value) for value in values[1:] if value is not None]
+
+def finish_run(run_id, status, result=None, error=None):
+    """
+    Marks the run as finished with the given status ("succeeded" or "failed").
+    No steps are started for a failed run.
+    """
+    if status == "failed":
+        key = _key(run_id)
+        if get_redis().exists(key):
+            get_redis().hset(key, HALTED_FIELD, 1)
+    _update_field(run_id, META_FIELD, {
+        "status": status,
+        "finished_at": time.time(),
+        "result": result,
+        "error": error
+    })
+
+def get_run(run_id):
+    """
+    Returns the run with its steps ordered by step_order, or None if unknown/expired.
+    """
+    raw = get_redis().hgetall(_key(run_id))
+    if not raw:
+        return None
+    run = None
+    steps = []
+    for field, value in raw.items():
+        field = field.decode() if isinstance(field, bytes) else field
+        if field == META_FIELD:
+            run = decode(value)
+        elif field.startswith(STEP_PREFIX):
+            steps.append(decode(value))
+    if run is None:
+        return None
+    run["steps"] = sorted(steps, key=lambda s: s["step_order"])
+    return run
@@ -1,6 +1,9 @@
-from flask import Blueprint, request, jsonify
+from flask import Blueprint, request, jsonify, current_app, url_for
 from app.models import AgentChain, AgentChainStep
-from app import db
+from app import circuit_breaker, db, rate_limit
+from app.chain_definitions import get_chain_definition
+from app.chain_engine import ChainInputError, chain_dependencies, start_chain_run
+from app.chain_runs import get_run
 from app.schemas import AgentChain as AgentChainSchema
 from pydantic import ValidationError
 from flask_jwt_extended import jwt_required
@@ -19,9 +22,11 @@ def create_chain():
         "steps": [
             {"step_order": 1, "agent_name": "doc_sum", "condition": "True"},
             {"step_order": 2, "agent_name": "sfdc", "condition": "input_data.get('summary') is not None"},
-            {"step_order": 3, "agent_name": "email"}
+            {"step_order": 3, "agent_name": "email", "depends_on": []}
         ]
     }
+    "depends_on" lists the step_orders a step waits for. When omitted, a step waits
+    for the previous one; independent steps are dispatched in parallel.
     """
     try:
         validated_data = AgentChainSchema.parse_obj(request.get_json())
@@ -29,25 +34,27 @@ def create_chain():
         return jsonify({"error": err.errors()}), 400
 
     try:
+        # The steps are inserted with the chain in a single transaction.
         new_chain = AgentChain(
             tenant_id=validated_data.tenant_id,
-            name=validated_data.name
+            name=validated_data.name,
+            steps=[
+                AgentChainStep(
+                    step_order=step.step_order,
+                    agent_name=step.agent_name,
+                    condition=step.condition,
+                    depends_on=",".join(str(order) for order in step.depends_on) if step.depends_on is not None else None
+                )
+                for step in sorted(validated_data.steps, key=lambda x: x.step_order)
+            ]
         )
         db.session.add(new_chain)
+        # Read the id before committing; afterwards the expired instance would be reloaded.
+        db.session.flush()
+        chain_id = new_chain.id
         db.session.commit()
 
-        # Save chain steps
-        for step in sorted(validated_data.steps, key=lambda x: x.step_order):
-            chain_step = AgentChainStep(
-                agent_chain_id=new_chain.id,
-                step_order=step.step_order,
-                agent_name=step.agent_name,
-                condition=step.condition
-            )
-            db.session.add(chain_step)
-        db.session.commit()
-
-        return jsonify({"message": "Agent chain created", "chain_id": new_chain.id}), 201
+        return jsonify({"message": "Agent chain created", "chain_id": chain_id}), 201
     except Exception as e:
         db.session.rollback()
         return jsonify({"error": str(e)}), 500
@@ -55,18 +62,34 @@ def create_chain():
 @chain_bp.route('/<int:chain_id>', methods=['GET'])
 @jwt_required()
 def get_chain(chain_id):
-    chain = AgentChain.query.get(chain_id)
+    chain = AgentChain.get_with_steps(chain_id)
     if not chain:
         return jsonify({"error": "Chain not found"}), 404
     chain_data = {
         "chain_id": chain.id,
         "tenant_id": chain.tenant_id,
         "name": chain.name,
-        "steps": [{"step_order": step.step_order, "agent_name": step.agent_name, "condition": step.condition} for step in chain.steps]
+        "steps": [
+            {
+                "step_order": step.step_order,
+                "agent_name": step.agent_name,
+                "condition": step.condition,
+                "depends_on": step.dependencies
+            }
+            for step in chain.steps
+        ]
     }
     return jsonify(chain_data), 200
 
+def _chain_tokens(data):
+    # Only summarization steps call the LLM; their input is the document text.
+    input_data = data.get("input")
+    if not isinstance(input_data, dict) or not input_data.get("document_text"):
+        return 0
+    return rate_limit.estimate_tokens(input_data["document_text"]) + current_app.config['SUMMARIZER_MAX_TOKENS']
+
 @chain_bp.route('/execute', methods=['POST'])
+@rate_limit.limit('chain_execute', llm_tokens=_chain_tokens)
 @jwt_required()
 def execute_chain():
     """
@@ -75,6 +98,7 @@ def execute_chain():
     {
        "tenant_id": 1,
        "chain_id": 2,
+       "async": false,   // optional; when true, returns a run_id immediately (202)
        "input": {
             "document_text": "Text for summarization",
             "lead_data": { ... },
@@ -85,59 +109,72 @@ def execute_chain():
             }
        }
     }
-    The chain steps are executed in order. If a summary is produced by the doc_sum agent,
-    it is injected into the lead_data (as the "Description" field) for the sfdc agent.
+    Each chain step is dispatched to the workers as soon as the steps it depends on
+    have finished, so steps that do not depend on each other run in parallel.
+    If a summary is produced by the doc_sum agent, it is injected into the lead_data
+    (as the "Description" field) for the sfdc agent.
+    In async mode, progress is reported by GET /api/v1/chain/runs/<run_id>?tenant_id=<tenant_id>.
+    While the tenant's circuit breaker for a dependency of the chain (Salesforce
+    for sfdc steps, SMTP for email steps) is open, the run is refused with 503.
     """
     data = request.get_json()
     tenant_id = data.get("tenant_id")
     chain_id = data.get("chain_id")
     input_data = data.get("input", {})
+    run_async = bool(data.get("async", False))
 
     if not tenant_id or not chain_id or not input_data:
         return jsonify({"error": "tenant_id, chain_id and input are required"}), 400
 
-    from app.models import AgentChain
-    from app.tasks import summarize_document_task, create_lead_task, send_email_task
-
-    chain_config = AgentChain.query.filter_by(id=chain_id, tenant_id=tenant_id).first()
-    if not chain_config:
+    definition = get_chain_definition(chain_id, tenant_id)
+    if not definition:
         return jsonify({"error": "Agent chain configuration not found"}), 404
 
-    result = {}
-    try:
-        for step in chain_config.steps:
-            # Evaluate condition if provided
-            if step.condition:
-                # WARNING: using eval can be risky in production; ensure you use a secure method!
-                if not eval(step.condition, {"input_data": input_data}):
-                    continue
+    refused = circuit_breaker.refuse(tenant_id, chain_dependencies(definition))
+    if refused:
+        return refused
 
-            if step.agent_name == "doc_sum":
-                document_text = input_data.get("document_text")
-                if not document_text:
-                    return jsonify({"error": "document_text is required for document summarization"}), 400
-                summary = summarize_document_task.delay(tenant_id, document_text).get(timeout=60)
-                result["doc_sum"] = summary
-                input_data["summary"] = summary
-            elif step.agent_name == "sfdc":
-                lead_data = input_data.get("lead_data")
-                if not lead_data:
-                    return jsonify({"error": "lead_data is required for SFDC lead creation"}), 400
-                if "summary" in input_data:
-                    lead_data["Description"] = input_data["summary"]
-                sfdc_result = create_lead_task.delay(tenant_id, lead_data).get(timeout=60)
-                result["sfdc"] = sfdc_result
-            elif step.agent_name == "email":
-                email_params = input_data.get("email_params")
-                if not email_params:
-                    return jsonify({"error": "email_params is required for sending email"}), 400
-                email_result = send_email_task.delay(
-                    tenant_id,
-                    email_params.get("recipient"),
-                    email_params.get("subject"),
-                    email_params.get("body")
-                ).get(timeout=60)
-                result["email"] = email_result
-        return jsonify({"message": "Chain executed successfully", "result": result}), 200
+    try:
+        run_id, async_result = start_chain_run(definition, tenant_id, input_data, store_result=not run_async)
+    except ChainInputError as e:
+        return jsonify({"error": str(e)}), 400
     except Exception as e:
         return jsonify({"error": str(e)}), 500
+
+    if run_async:
+        return jsonify({
+            "message": "Chain execution started",
+            "run_id": run_id,
+            "status_url": url_for('chain.get_chain_run', run_id=run_id, tenant_id=tenant_id)
+        }), 202
+
+    try:
+        result = async_result.get(timeout=current_app.config['CHAIN_SYNC_TIMEOUT'])
+        return jsonify({"message": "Chain executed successfully", "run_id": run_id, "result": result}), 200
+    except ChainInputError as e:
+        return jsonify({"error": str(e), "run_id": run_id}), 400
+    except Exception as e:
+        return jsonify({"error": str(e), "run_id": run_id}), 500
+
+@chain_bp.route('/runs/<run_id>', methods=['GET'])
+@jwt_required()
+def get_chain_run(run_id):
+    """
+    Returns the status of a chain run with per-step progress, timings and outputs.
+    The tenant_id query parameter must name the tenant that started the run;
+    another tenant's run is reported as not found.
+    """
+    tenant_id = request.args.get('tenant_id', type=int)
+    if not tenant_id:
+        return jsonify({"error": "tenant_id is required"}), 400
+    run = get_run(run_id)
+    if not run or not _is_tenant(run.get("tenant_id"), tenant_id):
+        return jsonify({"error": "Chain run not found"}), 404
+    return jsonify(run), 200
+
+def _is_tenant(stored_tenant_id, tenant_id):
+    # The run keeps the tenant_id as the execute request gave it, e.g. "1".
+    try:
+        return int(stored_tenant_id) == tenant_id
+    except (TypeError, ValueError):
+        return False
@@ -1,55 +1,273 @@
-import chromadb
-from chromadb.config import Settings
-import openai
+import logging
+import os
+import threading
 from flask import current_app
+from app.embeddings import get_embedding, get_embeddings
+from app.text_chunks import chunk_text
+from app import offload, search_cache
+from app.tracing import dependency_call
 
-# Initialize a persistent Chroma client.
-client = chromadb.Client(
-    Settings(chroma_db_impl="duckdb+parquet", persist_directory="./chroma_db")
-)
+logger = logging.getLogger(__name__)
 
-# Get or create a collection for documents.
-collection = client.get_or_create_collection("documents")
+# Each tenant's vectors live in their own collection, so search cost depends only
+# on the tenant's corpus. "documents" is the legacy collection shared by all
+# tenants (filtered by tenant_id metadata); `flask chroma migrate-tenants` moves
+# its data into the per-tenant collections.
+SHARED_COLLECTION_NAME = "documents"
 
-def get_embedding(text: str) -> list:
+_client = None
+_client_pid = None
+# Serializes the calls to the embedded store (see _store_call).
+_store_lock = None
+_collections = {}
+_collections_lock = threading.Lock()
+
+def shared_store() -> bool:
+    """
+    True if the vectors live in a Chroma server shared by all processes, False
+    for the embedded store, which only the process that opened it can see.
+    """
+    return bool(current_app.config['CHROMA_SERVER_HOST'])
+
+def get_client():
+    """
+    Returns this process's Chroma client, opening it on first use so that
+    processes which never search (e.g. email workers) do not load chromadb and
+    DuckDB: a client of the Chroma server if CHROMA_SERVER_HOST is set, else the
+    embedded persistent store. The client does not survive a fork, so a forked
+    worker child opens its own.
+    """
+    global _client, _client_pid, _store_lock
+    if _client is None or _client_pid != os.getpid():
+        with _collections_lock:
+            if _client is None or _client_pid != os.getpid():
+                import chromadb
+                from chromadb.config import Settings
+                config = current_app.config
+                if shared_store():
+                    settings = Settings(
+                        chroma_api_impl="rest",
+                        chroma_server_host=config['CHROMA_SERVER_HOST'],
+                        chroma_server_http_port=str(config['CHROMA_SERVER_PORT'])
+                    )
+                else:
+                    settings = Settings(chroma_db_impl="duckdb+parquet", persist_directory=config['CHROMA_PERSIST_DIRECTORY'])
+                _client = chromadb.Client(settings)
+                _store_lock = offload.native_lock()
+                _collections.clear()
+                _client_pid = os.getpid()
+    return _client
+
+def _serialized(func, *args, **kwargs):
+    with _store_lock:
+        return func(*args, **kwargs)
+
+def _store_call(func, *args, **kwargs):
+    """
+    Runs a Chroma call on the offload pool. The embedded store's DuckDB
+    connection and HNSW index are not safe for concurrent use, so its calls run
+    one at a time; calls to a Chroma server run concurrently.
+    """
+    if shared_store():
+        return offload.run(func, *args, **kwargs)
+    return offload.run(_serialized, func, *args, **kwargs)
+
+def tenant_collection_name(tenant_id: int) -> str:
+    return f"tenant_{tenant_id}_documents"
+
+def get_tenant_collection(tenant_id: int):
+    """
+    Returns the tenant's collection, creating it on first use and caching it for
+    the lifetime of the process.
     """
-    Uses OpenAI's embeddings API to generate a vector representation.
+    client = get_client()
+    collection = _collections.get(tenant_id)
+    if collection is None:
+        with _collections_lock:
+            collection = _collections.get(tenant_id)
+            if collection is None:
+                collection = _store_call(client.get_or_create_collection, tenant_collection_name(tenant_id))
+                _collections[tenant_id] = collection
+    return collection
+
+def drop_tenant_collection(tenant_id: int) -> bool:
+    """
+    Deletes the tenant's collection and all of its vectors.
+    Returns False if the tenant had no collection.
     """
-    response = openai.Embedding.create(
-        input=text,
-        model="text-embedding-ada-002"
-    )
-    return response["data"][0]["embedding"]
+    with _collections_lock:
+        _collections.pop(tenant_id, None)
+    search_cache.invalidate_tenant(tenant_id)
+    try:
+        client = get_client()
+        _store_call(client.delete_collection, tenant_collection_name(tenant_id))
+        return True
+    except ValueError:
+        return False
+
+def migrate_shared_collection(batch_size: int = 1000) -> dict:
+    """
+    Moves every vector of the shared "documents" collection into the collection
+    of the tenant named by its tenant_id metadata, deleting each page from the
+    shared collection once the tenant collections hold it. Records a tenant
+    collection already has (from an interrupted run) are not added again, so a
+    re-run picks up where the last one stopped. Records without a tenant_id are
+    left in place and counted as skipped. Returns per-tenant counts.
+    """
+    shared = _store_call(get_client().get_or_create_collection, SHARED_COLLECTION_NAME)
+    migrated = {}
+    skipped = 0
+    while True:
+        # Migrated records are deleted, so each page starts after the records left in place.
+        page = _store_call(shared.get, limit=batch_size, offset=skipped, include=["embeddings", "documents", "metadatas"])
+        if not page["ids"]:
+            break
+        by_tenant = {}
+        for record in zip(page["ids"], page["embeddings"], page["documents"], page["metadatas"]):
+            tenant_id = (record[3] or {}).get("tenant_id")
+            if tenant_id is None:
+                skipped += 1
+                continue
+            by_tenant.setdefault(tenant_id, []).append(record)
+        for tenant_id, records in by_tenant.items():
+            collection = get_tenant_collection(tenant_id)
+            stored = set(_store_call(collection.get, ids=[record[0] for record in records], include=[])["ids"])
+            records = [record for record in records if record[0] not in stored]
+            if records:
+                ids, embeddings, documents, metadatas = (list(column) for column in zip(*records))
+                _store_call(collection.add, ids=ids, embeddings=embeddings, documents=documents, metadatas=metadatas)
+                search_cache.invalidate_tenant(tenant_id)
+            migrated[tenant_id] = migrated.get(tenant_id, 0) + len(records)
+        moved = [record[0] for records in by_tenant.values() for record in records]
+        if moved:
+            _store_call(shared.delete, ids=moved)
+    return {"migrated": migrated, "skipped": skipped}
 
 def index_document(tenant_id: int, document_id: str, document_text: str) -> dict:
     """
-    Computes the embedding for a document and adds it to the ChromaDB collection.
-    Each document is tagged with its tenant_id.
+    Computes the embedding for a document and adds it to the tenant's ChromaDB collection.
+    Each document is also tagged with its tenant_id. Raises offload.Overloaded
+    when the vector store pool is saturated.
     """
     try:
-        embedding = get_embedding(document_text)
-        collection.add(
-            ids=[document_id],
-            embeddings=[embedding],
-            documents=[document_text],
-            metadatas=[{"tenant_id": tenant_id}]
-        )
+        with dependency_call("embeddings", "embed"):
+            embedding = get_embedding(document_text, tenant_id)
+        with dependency_call("chroma", "add"):
+            _store_call(
+                get_tenant_collection(tenant_id).add,
+                ids=[document_id],
+                embeddings=[embedding],
+                documents=[document_text],
+                metadatas=[{"tenant_id": tenant_id}]
+            )
+        search_cache.invalidate_tenant(tenant_id)
         return {"status": "success", "message": "Document indexed successfully"}
+    except offload.Overloaded:
+        raise
     except Exception as e:
         return {"status": "error", "message": str(e)}
 
+def index_documents(tenant_id: int, documents: list) -> dict:
+    """
+    Splits each document into overlapping chunks, embeds the chunks in batches
+    and adds them to the collection in batches of INDEX_ADD_BATCH_SIZE.
+    Chunk ids are "<document_id>#<chunk number>". A document's stored chunks are
+    deleted before its new ones are added, so re-indexing an edited document
+    leaves only its current chunks; a retried batch re-embeds from the
+    embedding cache rather than the provider. Returns counts and per-document
+    errors.
+    """
+    config = current_app.config
+    collection = get_tenant_collection(tenant_id)
+    indexed = 0
+    chunk_count = 0
+    errors = []
+    pending = []
+
+    def flush():
+        chunks = list(pending)
+        pending.clear()
+        # A document's first chunk is always in the batch that starts it.
+        for chunk in chunks:
+            if chunk["metadata"]["chunk"] == 0:
+                with dependency_call("chroma", "delete"):
+                    _store_call(collection.delete, where={"document_id": chunk["metadata"]["document_id"]})
+        with dependency_call("embeddings", "embed_batch"):
+            embeddings = get_embeddings([chunk["text"] for chunk in chunks], tenant_id)
+        with dependency_call("chroma", "add"):
+            _store_call(
+                collection.add,
+                ids=[chunk["id"] for chunk in chunks],
+                embeddings=embeddings,
+                documents=[chunk["text"] for chunk in chunks],
+                metadatas=[chunk["metadata"] for chunk in chunks]
+            )
+        search_cache.invalidate_tenant(tenant_id)
+
+    for document in documents:
+        document_id = document.get("document_id")
+        document_text = document.get("document_text")
+        if not document_id or not document_text:
+            errors.append({"document_id": document_id, "error": "document_id and document_text are required"})
+            continue
+        chunks = chunk_text(document_text, config['INDEX_CHUNK_SIZE'], config['INDEX_CHUNK_OVERLAP'])
+        # The last copy of a document repeated in the upload wins.
+        pending[:] = [chunk for chunk in pending if chunk["metadata"]["document_id"] != document_id]
+        for number, chunk in enumerate(chunks):
+            pending.append({
+                "id": f"{document_id}#{number}",
+                "text": chunk,
+                "metadata": {"tenant_id": tenant_id, "document_id": document_id, "chunk": number}
+            })
+            if len(pending) >= config['INDEX_ADD_BATCH_SIZE']:
+                flush()
+        indexed += 1
+        chunk_count += len(chunks)
+    if pending:
+        flush()
+    return {"documents_indexed": indexed, "chunks_indexed": chunk_count, "errors": errors}
+
 def search_document(tenant_id: int, query_text: str, n_results: int = 3) -> dict:
     """
     Computes the embedding for the query and performs a similarity search on documents
-    belonging to the given tenant.
+    in the tenant's collection. Results are cached in Redis (see app/search_cache.py)
+    until the tenant's documents change or SEARCH_CACHE_TTL expires. Raises
+    offload.Overloaded when the vector store pool is saturated.
     """
+    use_cache = current_app.config['SEARCH_CACHE_ENABLED']
+    generation = None
+    if use_cache:
+        try:
+            generation, cached = search_cache.lookup(tenant_id, query_text, n_results)
+            if cached is not None:
+                return {"status": "success", "results": cached}
+        except Exception:
+            logger.exception("Search cache lookup failed")
+
     try:
-        query_embedding = get_embedding(query_text)
-        results = collection.query(
-            query_embeddings=[query_embedding],
-            n_results=n_results,
-            where={"tenant_id": tenant_id}
-        )
-        return {"status": "success", "results": results}
+        collection = get_tenant_collection(tenant_id)
+        # Chroma rejects n_results larger than the collection.
+        with dependency_call("chroma", "count"):
+            limit = min(n_results, _store_call(collection.count))
+        if limit == 0:
+            results = {"ids": [[]], "distances": [[]], "documents": [[]], "metadatas": [[]]}
+        else:
+            with dependency_call("embeddings", "embed"):
+                query_embedding = get_embedding(query_text, tenant_id)
+            with dependency_call("chroma", "query"):
+                results = _store_call(
+                    collection.query,
+                    query_embeddings=[query_embedding],
+                    n_results=limit
+                )
+    except offload.Overloaded:
+        raise
     except Exception as e:
         return {"status": "error", "message": str(e)}
+
+    if generation is not None:
+        try:
+            search_cache.store(tenant_id, generation, query_text, n_results, results)
+        except Exception:
+            logger.exception("Search cache store failed")
+    return {"status": "success", "results": results}
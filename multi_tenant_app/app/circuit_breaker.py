@@ -0,0 +1,227 @@
+"""
+Circuit breakers for the external dependencies of the agents, per tenant.
+
+Each (tenant, dependency) pair, e.g. (7, "salesforce"), has a breaker whose
+state lives in Redis, so every worker and web replica sees the same one:
+
+- closed: calls go through. Calls and failures are counted in a window of
+  CIRCUIT_FAILURE_WINDOW seconds; once at least CIRCUIT_FAILURE_THRESHOLD
+  calls failed and they are at least CIRCUIT_FAILURE_RATIO of the calls, the
+  breaker opens.
+- open: calls fail at once with CircuitOpen instead of waiting on timeouts.
+  After CIRCUIT_OPEN_SECONDS the next caller is let through as a probe.
+- half_open: one probe is in flight and everybody else is still turned away.
+  A successful probe closes the breaker; a failed one opens it again for
+  twice as long as the last time, up to CIRCUIT_OPEN_MAX_SECONDS.
+
+Only failures of the dependency itself count (connection errors, timeouts,
+5xx replies); a rejected record or recipient means the dependency is up.
+Tasks that hit an open breaker are retried once it is due to close instead
+of tying up a worker, and the API refuses new work for the dependency with
+503 and Retry-After. Since breakers are per tenant, one tenant's broken
+Salesforce instance or SMTP relay does not affect the others. If Redis is
+unavailable, calls are let through.
+"""
+import logging
+import math
+from contextlib import contextmanager
+from flask import current_app, jsonify
+from app.metrics import CIRCUIT_REJECTED, CIRCUIT_TRIPS
+from app.redis_client import get_redis
+
+logger = logging.getLogger(__name__)
+
+BREAKER_KEY = "circuit:{{tenant:{tenant_id}}}:{dependency}"
+
+DEPENDENCIES = ("salesforce", "smtp")
+
+# KEYS[1] is the breaker. ARGV: operation ("check", "acquire", "success" or
+# "failure"), threshold, ratio, window, open seconds, max open seconds and probe
+# seconds. Returns {allowed, state, retry_after, tripped}. "check" reports
+# whether the breaker lets calls through without claiming the probe.
+_SCRIPT = """
+local now = redis.call('TIME')
+now = tonumber(now[1]) + tonumber(now[2]) / 1000000
+local op = ARGV[1]
+local threshold, ratio, window = tonumber(ARGV[2]), tonumber(ARGV[3]), tonumber(ARGV[4])
+local open_seconds, open_max, probe_seconds = tonumber(ARGV[5]), tonumber(ARGV[6]), tonumber(ARGV[7])
+local breaker = redis.call('HMGET', KEYS[1], 'state', 'until', 'trips', 'window_start', 'calls', 'failures')
+local state = breaker[1] or 'closed'
+local until_ts = tonumber(breaker[2]) or 0
+local trips = tonumber(breaker[3]) or 0
+local window_start = tonumber(breaker[4]) or now
+local calls, failures = tonumber(breaker[5]) or 0, tonumber(breaker[6]) or 0
+local tripped = 0
+
+local function trip()
+    trips = trips + 1
+    state = 'open'
+    until_ts = now + math.min(open_max, open_seconds * 2 ^ (trips - 1))
+    calls, failures, window_start = 0, 0, now
+    tripped = 1
+end
+
+if op == 'check' or op == 'acquire' then
+    if state == 'closed' then
+        return {1, state, '0', 0}
+    elseif now < until_ts then
+        return {0, state, tostring(until_ts - now), 0}
+    elseif op == 'check' then
+        return {1, state, '0', 0}
+    end
+    -- Due for a probe (or the last probe's caller went away): this call is it.
+    state = 'half_open'
+    until_ts = now + probe_seconds
+elseif op == 'success' then
+    if state == 'half_open' then
+        redis.call('DEL', KEYS[1])
+        return {1, 'closed', '0', 0}
+    end
+    if state == 'closed' then
+        if now - window_start >= window then
+            calls, failures, window_start = 0, 0, now
+        end
+        calls = calls + 1
+    end
+elseif op == 'failure' then
+    if state == 'half_open' then
+        trip()
+    elseif state == 'closed' then
+        if now - window_start >= window then
+            calls, failures, window_start = 0, 0, now
+        end
+        calls, failures = calls + 1, failures + 1
+        if failures >= threshold and failures >= ratio * calls then
+            trip()
+        end
+    end
+end
+
+redis.call('HSET', KEYS[1], 'state', state, 'until', tostring(until_ts), 'trips', trips,
+    'window_start', tostring(window_start), 'calls', calls, 'failures', failures)
+-- A breaker nobody calls is forgotten a window after it was due to close.
+redis.call('EXPIRE', KEYS[1], math.ceil(math.max(0, until_ts - now) + window))
+return {1, state, '0', tripped}
+"""
+
+_script = None
+
+class CircuitOpen(Exception):
+    """Raised instead of calling a dependency whose circuit breaker is open."""
+
+    def __init__(self, dependency, retry_after):
+        super().__init__(dependency, retry_after)
+        self.dependency = dependency
+        self.retry_after = retry_after
+
+    def __str__(self):
+        return (f"{self.dependency} is unavailable for this tenant (circuit open); "
+                f"retry after {math.ceil(self.retry_after)} seconds")
+
+def _run(tenant_id, dependency, op):
+    global _script
+    config = current_app.config
+    if not config['CIRCUIT_BREAKER_ENABLED']:
+        return True, "closed", 0.0, False
+    try:
+        redis_client = get_redis()
+        if _script is None:
+            _script = redis_client.register_script(_SCRIPT)
+        allowed, state, retry_after, tripped = _script(
+            keys=[BREAKER_KEY.format(tenant_id=tenant_id, dependency=dependency)],
+            args=[
+                op,
+                config['CIRCUIT_FAILURE_THRESHOLD'],
+                config['CIRCUIT_FAILURE_RATIO'],
+                config['CIRCUIT_FAILURE_WINDOW'],
+                config['CIRCUIT_OPEN_SECONDS'],
+                config['CIRCUIT_OPEN_MAX_SECONDS'],
+                config['CIRCUIT_PROBE_SECONDS']
+            ]
+        )
+    except Exception:
+        logger.exception("Circuit breaker %s failed for %s", op, dependency)
+        return True, "closed", 0.0, False
+    if tripped:
+        logger.warning("Circuit for %s opened for tenant %s", dependency, tenant_id)
+        CIRCUIT_TRIPS.labels(dependency, str(tenant_id)).inc()
+    return bool(allowed), state.decode(), float(retry_after), bool(tripped)
+
+def check(tenant_id, dependency):
+    """
+    Raises CircuitOpen if the tenant's breaker for the dependency is open.
+    Unlike acquire(), it does not claim the probe of an open breaker, so it is
+    used to refuse new work before it is queued.
+    """
+    allowed, _, retry_after, _ = _run(tenant_id, dependency, "check")
+    if not allowed:
+        raise CircuitOpen(dependency, retry_after)
+
+def acquire(tenant_id, dependency):
+    """
+    Raises CircuitOpen unless a call to the dependency may go ahead now. The
+    caller must report the call's outcome with record().
+    """
+    allowed, _, retry_after, _ = _run(tenant_id, dependency, "acquire")
+    if not allowed:
+        CIRCUIT_REJECTED.labels(dependency, str(tenant_id)).inc()
+        raise CircuitOpen(dependency, retry_after)
+
+def record(tenant_id, dependency, ok):
+    _run(tenant_id, dependency, "success" if ok else "failure")
+
+@contextmanager
+def guard(tenant_id, dependency, is_failure=lambda exc: True):
+    """
+    Runs the block as a call to the dependency: raises CircuitOpen without
+    running it if the breaker is open, and records the outcome otherwise. An
+    exception the block raises counts as a failure if is_failure(exc) is true.
+    """
+    acquire(tenant_id, dependency)
+    try:
+        yield
+    except Exception as exc:
+        record(tenant_id, dependency, ok=not is_failure(exc))
+        raise
+    record(tenant_id, dependency, ok=True)
+
+def get_states(tenant_id):
+    """The state of each of the tenant's breakers, for the admin API."""
+    pipe = get_redis().pipeline()
+    for dependency in DEPENDENCIES:
+        pipe.hgetall(BREAKER_KEY.format(tenant_id=tenant_id, dependency=dependency))
+    states = {}
+    for dependency, breaker in zip(DEPENDENCIES, pipe.execute()):
+        breaker = {name.decode(): value.decode() for name, value in breaker.items()}
+        states[dependency] = {
+            "state": breaker.get("state", "closed"),
+            "until": float(breaker["until"]) if breaker.get("state", "closed") != "closed" else None,
+            "trips": int(breaker.get("trips", 0)),
+            "calls": int(breaker.get("calls", 0)),
+            "failures": int(breaker.get("failures", 0))
+        }
+    return states
+
+def reset(tenant_id, dependency):
+    """Closes the tenant's breaker for the dependency, e.g. after fixing its configuration."""
+    get_redis().delete(BREAKER_KEY.format(tenant_id=tenant_id, dependency=dependency))
+
+def clear_tenant(tenant_id):
+    """Deletes all of the tenant's breakers, e.g. when the tenant is deleted."""
+    get_redis().delete(*[BREAKER_KEY.format(tenant_id=tenant_id, dependency=dependency) for dependency in DEPENDENCIES])
+
+# Flask
+
+def refuse(tenant_id, dependencies):
+    """
+    A 503 response with Retry-After if any of the dependencies' breakers is
+    open for the tenant, else None.
+    """
+    for dependency in dependencies:
+        try:
+            check(tenant_id, dependency)
+        except CircuitOpen as e:
+            response = jsonify({"error": str(e), "dependency": e.dependency})
+            response.headers['Retry-After'] = str(max(1, math.ceil(e.retry_after)))
+            return response, 503
+    return None
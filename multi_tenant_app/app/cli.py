@@ -0,0 +1,46 @@
+import click
+from flask.cli import AppGroup, with_appcontext
+
+@click.command('init-db')
+@with_appcontext
+def init_db():
+    """Create any missing tables (scratch databases; deployments run `flask db upgrade`)."""
+    from app import db
+
+    db.create_all()
+    click.echo("Database tables created")
+
+chroma_cli = AppGroup('chroma', help="Manage the Chroma vector store.")
+
+@chroma_cli.command('migrate-tenants')
+@click.option('--batch-size', default=1000, show_default=True, help="Records read from the shared collection per page.")
+@click.option('--drop-shared', is_flag=True, help="Delete the shared collection once every record was migrated.")
+def migrate_tenants(batch_size, drop_shared):
+    """Move vectors from the shared "documents" collection into per-tenant collections."""
+    from app.chroma import get_client, migrate_shared_collection, _store_call, SHARED_COLLECTION_NAME
+
+    result = migrate_shared_collection(batch_size=batch_size)
+    for tenant_id, count in sorted(result["migrated"].items()):
+        click.echo(f"tenant {tenant_id}: {count} records")
+    click.echo(f"skipped (no tenant_id): {result['skipped']}")
+    if drop_shared:
+        if result["skipped"]:
+            raise click.ClickException("Not dropping the shared collection: some records have no tenant_id")
+        _store_call(get_client().delete_collection, SHARED_COLLECTION_NAME)
+        click.echo(f'Dropped shared collection "{SHARED_COLLECTION_NAME}"')
+
+fair_share_cli = AppGroup('fair-share', help="Dispatch tenant tasks fairly to the Celery queues.")
+
+@fair_share_cli.command('dispatch')
+@click.option('--once', is_flag=True, help="Fill the queues once and exit.")
+def dispatch(once):
+    """Move tasks from the tenant backlogs to the broker (see app/fair_share.py)."""
+    from flask import current_app
+    from app.fair_share import FairShareDispatcher
+
+    dispatcher = FairShareDispatcher(current_app.config['FAIR_SHARE_MAX_QUEUE_DEPTH'])
+    if once:
+        click.echo(f"dispatched {dispatcher.dispatch_once()} tasks")
+        return
+    click.echo("Dispatching tenant backlogs (Ctrl+C to stop)")
+    dispatcher.run(current_app.config['FAIR_SHARE_POLL_INTERVAL'])
@@ -0,0 +1,148 @@
+"""
+Small, sandboxed expression language for agent chain step conditions.
+
+A condition is a Python-like expression over ``input_data`` limited to:
+  - literals (strings, numbers, True/False/None, and tuples/lists of literals),
+  - ``.get(key[, default])`` lookups, e.g. ``input_data.get('lead_data').get('Company')``,
+  - comparisons (==, !=, <, <=, >, >=, in, not in, is None, is not None),
+  - boolean operators (and, or, not).
+
+Lookups of missing keys evaluate to None, and a comparison whose operands
+cannot be compared (e.g. ``None > 5`` or ``'a' in None``) is false, so a
+condition never raises on missing or mistyped input: evaluation is
+deterministic, and a step task retrying it would only fail again.
+
+Conditions are parsed once with ``ast`` and compiled into plain Python closures;
+nothing is ever passed to eval().
+"""
+import ast
+import hashlib
+import operator
+import threading
+
+class ConditionError(ValueError):
+    """Raised when a condition uses syntax outside the allowed expression language."""
+
+_COMPARE_OPS = {
+    ast.Eq: operator.eq,
+    ast.NotEq: operator.ne,
+    ast.Lt: operator.lt,
+    ast.LtE: operator.le,
+    ast.Gt: operator.gt,
+    ast.GtE: operator.ge,
+    ast.In: lambda a, b: a in b,
+    ast.NotIn: lambda a, b: a not in b,
+    ast.Is: operator.is_,
+    ast.IsNot: operator.is_not,
+}
+
+_LITERAL_TYPES = (str, int, float, bool, type(None))
+
+def _compile_node(node):
+    if isinstance(node, ast.Constant):
+        if not isinstance(node.value, _LITERAL_TYPES):
+            raise ConditionError(f"Unsupported literal: {node.value!r}")
+        value = node.value
+        return lambda input_data: value
+
+    if isinstance(node, (ast.Tuple, ast.List)):
+        items = tuple(_literal(elt) for elt in node.elts)
+        return lambda input_data: items
+
+    if isinstance(node, ast.Name):
+        if node.id != "input_data":
+            raise ConditionError(f"Unknown name: {node.id}")
+        return lambda input_data: input_data
+
+    if isinstance(node, ast.Call):
+        func = node.func
+        if not (isinstance(func, ast.Attribute) and func.attr == "get"):
+            raise ConditionError("Only .get() calls are allowed")
+        if node.keywords or not 1 <= len(node.args) <= 2:
+            raise ConditionError(".get() takes a key and an optional default")
+        receiver = _compile_node(func.value)
+        args = [_compile_node(arg) for arg in node.args]
+
+        def get(input_data):
+            target = receiver(input_data)
+            # Chained lookups on missing keys evaluate to None instead of raising.
+            if not isinstance(target, dict):
+                return None
+            return target.get(*(arg(input_data) for arg in args))
+        return get
+
+    if isinstance(node, ast.Compare):
+        left = _compile_node(node.left)
+        steps = []
+        for op, comparator in zip(node.ops, node.comparators):
+            if type(op) not in _COMPARE_OPS:
+                raise ConditionError(f"Unsupported comparison: {type(op).__name__}")
+            if isinstance(op, (ast.Is, ast.IsNot)) and not (
+                isinstance(comparator, ast.Constant) and comparator.value is None
+            ):
+                raise ConditionError("'is' comparisons are only allowed with None")
+            steps.append((_COMPARE_OPS[type(op)], _compile_node(comparator)))
+
+        def compare(input_data):
+            current = left(input_data)
+            for op_func, right in steps:
+                other = right(input_data)
+                try:
+                    if not op_func(current, other):
+                        return False
+                except TypeError:
+                    return False
+                current = other
+            return True
+        return compare
+
+    if isinstance(node, ast.BoolOp):
+        values = [_compile_node(value) for value in node.values]
+        if isinstance(node.op, ast.And):
+            return lambda input_data: all(value(input_data) for value in values)
+        return lambda input_data: any(value(input_data) for value in values)
+
+    if isinstance(node, ast.UnaryOp) and isinstance(node.op, ast.Not):
+        operand = _compile_node(node.operand)
+        return lambda input_data: not operand(input_data)
+
+    raise ConditionError(f"Unsupported expression: {type(node).__name__}")
+
+def _literal(node):
+    if isinstance(node, ast.Constant) and isinstance(node.value, _LITERAL_TYPES):
+        return node.value
+    raise ConditionError("Only literals are allowed inside tuples and lists")
+
+def compile_condition(expression):
+    """
+    Parses and validates a condition, returning a predicate ``f(input_data) -> bool``.
+    Raises ConditionError if the expression is invalid or not allowed.
+    """
+    try:
+        tree = ast.parse(expression.strip(), mode="eval")
+    except SyntaxError as e:
+        raise ConditionError(f"Invalid condition syntax: {e.msg}")
+    evaluate = _compile_node(tree.body)
+    return lambda input_data: bool(evaluate(input_data))
+
+def condition_version(expression):
+    return hashlib.sha1(expression.encode("utf-8")).hexdigest()[:16]
+
+# Process-level cache of compiled predicates: step_id -> (version, predicate).
+# The version is derived from the condition text, so an edited step recompiles.
+_predicates = {}
+_predicates_lock = threading.Lock()
+
+def get_predicate(step_id, expression):
+    """
+    Returns the compiled predicate for a chain step, compiling it at most once
+    per (step_id, version) in this process.
+    """
+    version = condition_version(expression)
+    cached = _predicates.get(step_id)
+    if cached is not None and cached[0] == version:
+        return cached[1]
+    predicate = compile_condition(expression)
+    with _predicates_lock:
+        _predicates[step_id] = (version, predicate)
+    return predicate
@@ -1,19 +1,218 @@
 import os
 import logging
 
+# Connection pool profiles. The web profile serves many short requests per
+# process; Celery children hold few connections (raise pool_size to the
+# concurrency when running the worker with --pool threads).
+DB_POOL_PROFILES = {
+    'web': {'pool_size': 10, 'max_overflow': 20, 'pool_timeout': 10, 'pool_recycle': 1800, 'pool_pre_ping': True},
+    'worker': {'pool_size': 2, 'max_overflow': 3, 'pool_timeout': 30, 'pool_recycle': 1800, 'pool_pre_ping': True},
+}
+
+def engine_options(database_uri, profile):
+    """
+    SQLAlchemy engine options for the pool profile; DB_POOL_* environment
+    variables override individual values. SQLite does not use a queue pool.
+    """
+    if database_uri.startswith('sqlite'):
+        return {}
+    options = dict(DB_POOL_PROFILES[profile])
+    overrides = {
+        'pool_size': ('DB_POOL_SIZE', int),
+        'max_overflow': ('DB_MAX_OVERFLOW', int),
+        'pool_timeout': ('DB_POOL_TIMEOUT', int),
+        'pool_recycle': ('DB_POOL_RECYCLE', int),
+        'pool_pre_ping': ('DB_POOL_PRE_PING', lambda value: value.lower() in ('1', 'true', 'yes')),
+    }
+    for option, (variable, parse) in overrides.items():
+        if variable in os.environ:
+            options[option] = parse(os.environ[variable])
+    return options
+
+def rate_limits(spec):
+    """Parses "quota=count/seconds,..." into {quota: "count/seconds"}."""
+    limits = {}
+    for item in spec.split(','):
+        if item.strip():
+            name, _, value = item.partition('=')
+            limits[name.strip()] = value.strip()
+    return limits
+
 class Config:
     SECRET_KEY = os.environ.get('SECRET_KEY', 'your-secret-key')
     SQLALCHEMY_DATABASE_URI = os.environ.get('DATABASE_URL', 'sqlite:///multitenant_app.db')
     SQLALCHEMY_TRACK_MODIFICATIONS = False
+    # "web" or "worker" (celery_worker.py selects "worker")
+    DB_POOL_PROFILE = os.environ.get('DB_POOL_PROFILE', 'web')
+    SQLALCHEMY_ENGINE_OPTIONS = engine_options(SQLALCHEMY_DATABASE_URI, DB_POOL_PROFILE)
 
     CELERY_BROKER_URL = os.environ.get('CELERY_BROKER_URL', 'redis://localhost:6379/0')
     CELERY_RESULT_BACKEND = os.environ.get('CELERY_RESULT_BACKEND', 'redis://localhost:6379/0')
+    # Seconds task results are kept in the result backend
+    CELERY_RESULT_EXPIRES = int(os.environ.get('CELERY_RESULT_EXPIRES', 3600))
+    # Queues and preloaded modules of a Celery worker (WORKER_PROFILES in app/queues.py)
+    WORKER_PROFILE = os.environ.get('WORKER_PROFILE', 'all')
+
+    # Weighted fair-share dispatch of tenant tasks (see app/fair_share.py). When
+    # enabled, `flask fair-share dispatch` must run to move tasks to the broker.
+    FAIR_SHARE_ENABLED = os.environ.get('FAIR_SHARE_ENABLED', 'false').lower() in ('1', 'true', 'yes')
+    FAIR_SHARE_MAX_QUEUE_DEPTH = int(os.environ.get('FAIR_SHARE_MAX_QUEUE_DEPTH', 100))
+    FAIR_SHARE_POLL_INTERVAL = float(os.environ.get('FAIR_SHARE_POLL_INTERVAL', 0.5))
+
+    # Task retries: exponential backoff with full jitter, in seconds
+    RETRY_BACKOFF_BASE = float(os.environ.get('RETRY_BACKOFF_BASE', 2))
+    RETRY_BACKOFF_MAX = float(os.environ.get('RETRY_BACKOFF_MAX', 300))
+
+    # Idempotency records of side-effecting tasks (see app/idempotency.py). Without
+    # a caller-supplied key, identical payloads within the TTL run once.
+    # IDEMPOTENCY_LOCK_TTL bounds how long a crashed execution blocks its key.
+    IDEMPOTENCY_TTL_SECONDS = int(os.environ.get('IDEMPOTENCY_TTL_SECONDS', 3600))
+    IDEMPOTENCY_LOCK_TTL = int(os.environ.get('IDEMPOTENCY_LOCK_TTL', 900))
+
+    # Redis used directly by the app (chain run state, caches, ...)
+    REDIS_URL = os.environ.get('REDIS_URL', 'redis://localhost:6379/0')
+
+    # Per-process tenant config cache used by the Celery tasks
+    TENANT_CONFIG_CACHE_TTL = int(os.environ.get('TENANT_CONFIG_CACHE_TTL', 300))
+    TENANT_CONFIG_CACHE_SIZE = int(os.environ.get('TENANT_CONFIG_CACHE_SIZE', 1024))
+
+    # Pooled SMTP sessions used by the email agent
+    # Seconds to connect to the SMTP server, then to wait for each of its replies
+    SMTP_CONNECT_TIMEOUT = float(os.environ.get('SMTP_CONNECT_TIMEOUT', 5))
+    SMTP_TIMEOUT = int(os.environ.get('SMTP_TIMEOUT', 30))
+    # Disable only for local relays and sinks (bench/smtp_sink.py) that do not offer TLS
+    SMTP_STARTTLS = os.environ.get('SMTP_STARTTLS', 'true').lower() in ('1', 'true', 'yes')
+    SMTP_POOL_IDLE_TIMEOUT = int(os.environ.get('SMTP_POOL_IDLE_TIMEOUT', 60))
+    SMTP_POOL_MAX_MESSAGES = int(os.environ.get('SMTP_POOL_MAX_MESSAGES', 100))
+    SMTP_POOL_MAX_IDLE = int(os.environ.get('SMTP_POOL_MAX_IDLE', 4))
+    EMAIL_BATCH_MAX_MESSAGES = int(os.environ.get('EMAIL_BATCH_MAX_MESSAGES', 1000))
+
+    # Salesforce REST API used by the SFDC agent
+    SFDC_API_VERSION = os.environ.get('SFDC_API_VERSION', 'v58.0')
+    SFDC_POOL_MAXSIZE = int(os.environ.get('SFDC_POOL_MAXSIZE', 10))
+    # Seconds to connect to the instance, then to wait for each read of its response
+    SFDC_CONNECT_TIMEOUT = float(os.environ.get('SFDC_CONNECT_TIMEOUT', 5))
+    SFDC_READ_TIMEOUT = float(os.environ.get('SFDC_READ_TIMEOUT', 30))
+    SFDC_BULK_THRESHOLD = int(os.environ.get('SFDC_BULK_THRESHOLD', 2000))
+    SFDC_BULK_POLL_INTERVAL = float(os.environ.get('SFDC_BULK_POLL_INTERVAL', 2))
+    SFDC_BULK_TIMEOUT = int(os.environ.get('SFDC_BULK_TIMEOUT', 600))
+    LEAD_BATCH_MAX_RECORDS = int(os.environ.get('LEAD_BATCH_MAX_RECORDS', 50000))
+
+    # Chroma vector store. With CHROMA_SERVER_HOST set, every process talks to that
+    # Chroma server; otherwise each process opens the embedded store in
+    # CHROMA_PERSIST_DIRECTORY, which only that process sees, so bulk indexing
+    # then runs in a background thread of the web process instead of the Celery
+    # workers (see app/local_indexer.py).
+    CHROMA_SERVER_HOST = os.environ.get('CHROMA_SERVER_HOST', '')
+    CHROMA_SERVER_PORT = int(os.environ.get('CHROMA_SERVER_PORT', 8000))
+    CHROMA_PERSIST_DIRECTORY = os.environ.get('CHROMA_PERSIST_DIRECTORY', './chroma_db')
+
+    # Bulk document indexing
+    INDEX_CHUNK_SIZE = int(os.environ.get('INDEX_CHUNK_SIZE', 2000))
+    INDEX_CHUNK_OVERLAP = int(os.environ.get('INDEX_CHUNK_OVERLAP', 200))
+    INDEX_ADD_BATCH_SIZE = int(os.environ.get('INDEX_ADD_BATCH_SIZE', 500))
+    INDEX_BULK_BATCH_DOCUMENTS = int(os.environ.get('INDEX_BULK_BATCH_DOCUMENTS', 100))
+    INDEX_BULK_BATCH_BYTES = int(os.environ.get('INDEX_BULK_BATCH_BYTES', 1024 * 1024))
+    INDEX_BULK_MAX_LINE_BYTES = int(os.environ.get('INDEX_BULK_MAX_LINE_BYTES', 10 * 1024 * 1024))
+    INDEX_JOB_TTL_SECONDS = int(os.environ.get('INDEX_JOB_TTL_SECONDS', 86400))
+    # Batches waiting for the web process's indexer (embedded store only), and how
+    # long an upload waits for room before it is refused with 503.
+    INDEX_LOCAL_MAX_PENDING = int(os.environ.get('INDEX_LOCAL_MAX_PENDING', 8))
+    INDEX_LOCAL_QUEUE_TIMEOUT = float(os.environ.get('INDEX_LOCAL_QUEUE_TIMEOUT', 30))
+
+    # Redis cache for search_document results
+    SEARCH_CACHE_ENABLED = os.environ.get('SEARCH_CACHE_ENABLED', 'true').lower() == 'true'
+    SEARCH_CACHE_TTL = int(os.environ.get('SEARCH_CACHE_TTL', 300))
+
+    # Tenant rate limits and quotas (see app/rate_limit.py). "requests" counts every
+    # API request, "llm_tokens" the estimated tokens of summarization and
+    # embedding requests; other names are endpoint quotas. Unlisted quotas are
+    # unlimited unless a tenant override sets them.
+    RATE_LIMIT_ENABLED = os.environ.get('RATE_LIMIT_ENABLED', 'true').lower() in ('1', 'true', 'yes')
+    RATE_LIMITS = rate_limits(os.environ.get(
+        'RATE_LIMITS',
+        'requests=1200/60,summarize_document=120/60,search_document=600/60,llm_tokens=2000000/60'
+    ))
+
+    # Per-tenant circuit breakers for Salesforce and SMTP (see app/circuit_breaker.py).
+    # A breaker opens once FAILURE_THRESHOLD calls, and at least FAILURE_RATIO of
+    # the calls, failed within FAILURE_WINDOW seconds. It stays open for
+    # OPEN_SECONDS, doubling after each failed probe up to OPEN_MAX_SECONDS.
+    CIRCUIT_BREAKER_ENABLED = os.environ.get('CIRCUIT_BREAKER_ENABLED', 'true').lower() in ('1', 'true', 'yes')
+    CIRCUIT_FAILURE_THRESHOLD = int(os.environ.get('CIRCUIT_FAILURE_THRESHOLD', 5))
+    CIRCUIT_FAILURE_RATIO = float(os.environ.get('CIRCUIT_FAILURE_RATIO', 0.5))
+    CIRCUIT_FAILURE_WINDOW = int(os.environ.get('CIRCUIT_FAILURE_WINDOW', 60))
+    CIRCUIT_OPEN_SECONDS = int(os.environ.get('CIRCUIT_OPEN_SECONDS', 30))
+    CIRCUIT_OPEN_MAX_SECONDS = int(os.environ.get('CIRCUIT_OPEN_MAX_SECONDS', 600))
+    # How long a probe may take before another caller is let through instead
+    CIRCUIT_PROBE_SECONDS = int(os.environ.get('CIRCUIT_PROBE_SECONDS', 60))
+
+    # Native threads for Chroma calls under the gevent serving mode (see app/offload.py)
+    OFFLOAD_MAX_THREADS = int(os.environ.get('OFFLOAD_MAX_THREADS', 16))
+    OFFLOAD_MAX_PENDING = int(os.environ.get('OFFLOAD_MAX_PENDING', 512))
+
+    # Document summarizer model parameters (part of the summary cache key)
+    SUMMARIZER_MODEL = os.environ.get('SUMMARIZER_MODEL', 'text-davinci-003')
+    SUMMARIZER_MAX_TOKENS = int(os.environ.get('SUMMARIZER_MAX_TOKENS', 150))
+    SUMMARIZER_TEMPERATURE = float(os.environ.get('SUMMARIZER_TEMPERATURE', 0.5))
+    SUMMARY_CACHE_MAX_ENTRIES = int(os.environ.get('SUMMARY_CACHE_MAX_ENTRIES', 100000))
+
+    # Map-reduce summarization of long documents
+    SUMMARY_CHUNK_SIZE = int(os.environ.get('SUMMARY_CHUNK_SIZE', 6000))
+    SUMMARY_CHUNK_OVERLAP = int(os.environ.get('SUMMARY_CHUNK_OVERLAP', 200))
+    SUMMARY_REDUCE_MAX_CHARS = int(os.environ.get('SUMMARY_REDUCE_MAX_CHARS', 6000))
+    # Reduction levels before the remaining partials are truncated into the final prompt
+    SUMMARY_REDUCE_MAX_LEVELS = int(os.environ.get('SUMMARY_REDUCE_MAX_LEVELS', 5))
+    SUMMARY_PARTIAL_MAX_TOKENS = int(os.environ.get('SUMMARY_PARTIAL_MAX_TOKENS', 200))
+    SUMMARY_FINAL_MAX_TOKENS = int(os.environ.get('SUMMARY_FINAL_MAX_TOKENS', 300))
+    SUMMARY_JOB_TTL_SECONDS = int(os.environ.get('SUMMARY_JOB_TTL_SECONDS', 3600))
+    SUMMARY_SSE_TIMEOUT = int(os.environ.get('SUMMARY_SSE_TIMEOUT', 600))
+
+    # Batch task status lookups and watchers
+    TASK_STATUS_MAX_IDS = int(os.environ.get('TASK_STATUS_MAX_IDS', 1000))
+    # Ids in a query string: about 100 UUIDs fit gunicorn's 4094-byte request line
+    TASK_STATUS_QUERY_MAX_IDS = int(os.environ.get('TASK_STATUS_QUERY_MAX_IDS', 100))
+    TASK_STATUS_WATCH_TIMEOUT = int(os.environ.get('TASK_STATUS_WATCH_TIMEOUT', 30))
+    TASK_STATUS_SSE_TIMEOUT = int(os.environ.get('TASK_STATUS_SSE_TIMEOUT', 600))
+
+    # Agent chain execution
+    CHAIN_SYNC_TIMEOUT = int(os.environ.get('CHAIN_SYNC_TIMEOUT', 180))
+    CHAIN_RUN_TTL_SECONDS = int(os.environ.get('CHAIN_RUN_TTL_SECONDS', 86400))
+    CHAIN_RUN_COMPRESS_MIN_BYTES = int(os.environ.get('CHAIN_RUN_COMPRESS_MIN_BYTES', 1024))  # 0 disables compression
+    CHAIN_DEFINITION_CACHE_TTL = int(os.environ.get('CHAIN_DEFINITION_CACHE_TTL', 300))
+    CHAIN_DEFINITION_CACHE_SIZE = int(os.environ.get('CHAIN_DEFINITION_CACHE_SIZE', 1024))
     
     OPENAI_API_KEY = os.environ.get('OPENAI_API_KEY', '')
+    OPENAI_API_BASE = os.environ.get('OPENAI_API_BASE', 'https://api.openai.com/v1')
+
+    # Async LLM client: connection pool and per-tenant limits (LLM_TENANT_RATE is
+    # requests per second, 0 disables the token bucket)
+    LLM_MAX_CONNECTIONS = int(os.environ.get('LLM_MAX_CONNECTIONS', 100))
+    LLM_KEEPALIVE_TIMEOUT = float(os.environ.get('LLM_KEEPALIVE_TIMEOUT', 30))
+    LLM_REQUEST_TIMEOUT = float(os.environ.get('LLM_REQUEST_TIMEOUT', 60))
+    LLM_TENANT_CONCURRENCY = int(os.environ.get('LLM_TENANT_CONCURRENCY', 8))
+    LLM_TENANT_RATE = float(os.environ.get('LLM_TENANT_RATE', 0))
+    LLM_TENANT_BURST = int(os.environ.get('LLM_TENANT_BURST', 10))
+
+    # Embeddings: provider ("openai" or "fake" for offline benchmarks), cache and batching
+    EMBEDDING_PROVIDER = os.environ.get('EMBEDDING_PROVIDER', 'openai')
+    EMBEDDING_MODEL = os.environ.get('EMBEDDING_MODEL', 'text-embedding-ada-002')
+    EMBEDDING_CACHE_PATH = os.environ.get('EMBEDDING_CACHE_PATH', './embedding_cache.sqlite3')
+    # Vectors held in memory per process, 6 KB each for 1536 dimensions
+    EMBEDDING_CACHE_MEMORY_SIZE = int(os.environ.get('EMBEDDING_CACHE_MEMORY_SIZE', 2000))
+    EMBEDDING_BATCH_SIZE = int(os.environ.get('EMBEDDING_BATCH_SIZE', 64))
+    EMBEDDING_BATCH_WAIT_MS = float(os.environ.get('EMBEDDING_BATCH_WAIT_MS', 10))
+    EMBEDDING_TIMEOUT = float(os.environ.get('EMBEDDING_TIMEOUT', 120))  # 0 waits indefinitely
+    FAKE_EMBEDDING_DIMENSIONS = int(os.environ.get('FAKE_EMBEDDING_DIMENSIONS', 1536))
+    FAKE_EMBEDDING_LATENCY = float(os.environ.get('FAKE_EMBEDDING_LATENCY', 0))
 
     # JWT configuration for securing endpoints
     JWT_SECRET_KEY = os.environ.get('JWT_SECRET_KEY', 'jwt-secret-key')
 
+    # Port of the Prometheus exporter started by Celery workers (0 disables).
+    # Prefork children need PROMETHEUS_MULTIPROC_DIR (see app/metrics.py).
+    METRICS_WORKER_PORT = int(os.environ.get('METRICS_WORKER_PORT', 0))
+
     # Logging configuration
     LOG_LEVEL = os.environ.get('LOG_LEVEL', 'INFO')
 
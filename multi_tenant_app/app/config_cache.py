@@ -0,0 +1,144 @@
+"""
+Per-process cache of tenant agent configurations.
+
+Celery tasks look up the same handful of config rows thousands of times per
+minute, so resolved configs (tenant-specific row, else the global row) are kept
+in a TTL/LRU cache as detached pydantic snapshots. Writers call
+invalidate_tenant_config(), which drops the local entries and broadcasts the
+invalidation over Redis pub/sub so every web and worker process drops its
+stale entries too.
+"""
+import json
+import logging
+import os
+import threading
+import time
+from flask import current_app
+from app.cache import TTLCache, MISSING
+from app.models import Tenant, EmailAgentConfig, DocumentSummarizerConfig, SFDCConfig
+from app.redis_client import get_redis
+from app.tracing import dependency_call
+from app import schemas
+
+logger = logging.getLogger(__name__)
+
+INVALIDATION_CHANNEL = "tenant_config:invalidate"
+ALL_TENANTS = "*"
+
+CONFIG_KINDS = {
+    "email": (EmailAgentConfig, schemas.EmailConfig),
+    "doc_sum": (DocumentSummarizerConfig, schemas.DocSumConfig),
+    "sfdc": (SFDCConfig, schemas.SFDCConfig),
+}
+
+_cache = None
+_cache_lock = threading.Lock()
+_listener_pid = None
+
+def _get_cache():
+    global _cache
+    if _cache is None:
+        with _cache_lock:
+            if _cache is None:
+                _cache = TTLCache(
+                    maxsize=current_app.config['TENANT_CONFIG_CACHE_SIZE'],
+                    ttl=current_app.config['TENANT_CONFIG_CACHE_TTL']
+                )
+    return _cache
+
+def _listen(redis_client, cache):
+    while True:
+        try:
+            pubsub = redis_client.pubsub(ignore_subscribe_messages=True)
+            pubsub.subscribe(INVALIDATION_CHANNEL)
+            # Invalidations may have been missed while (re)connecting.
+            cache.clear()
+            for message in pubsub.listen():
+                tenant_id = json.loads(message["data"])
+                if tenant_id == ALL_TENANTS:
+                    cache.clear()
+                else:
+                    cache.pop_matching(lambda key: key[1] == tenant_id)
+        except Exception:
+            logger.exception("Tenant config invalidation listener failed; reconnecting")
+            time.sleep(1)
+
+def _ensure_listener(cache):
+    """
+    Starts the invalidation listener thread once per process. Threads do not
+    survive a fork, so a prefork Celery child starts its own.
+    """
+    global _listener_pid
+    if _listener_pid == os.getpid():
+        return
+    with _cache_lock:
+        if _listener_pid == os.getpid():
+            return
+        _listener_pid = os.getpid()
+        cache.clear()
+        thread = threading.Thread(
+            target=_listen, args=(get_redis(), cache),
+            name="tenant-config-invalidation", daemon=True
+        )
+        thread.start()
+
+def _tenant_key(tenant_id):
+    # Requests may name a tenant as "1" or "01"; cache, and invalidate, them all
+    # under the tenant's integer id.
+    return int(tenant_id)
+
+def _load(kind, tenant_id):
+    model, schema = CONFIG_KINDS[kind]
+    row = model.query.filter_by(tenant_id=tenant_id).first()
+    if row is None:
+        row = model.query.filter_by(is_global=True).first()
+    if row is None:
+        return None
+    return schema(**{field: getattr(row, field) for field in schema.__fields__})
+
+def get_tenant_config(kind, tenant_id):
+    """
+    Returns the resolved config for the tenant ("email", "doc_sum" or "sfdc"):
+    the tenant's own row, else the global row, else None. Missing configs are
+    cached as well.
+    """
+    cache = _get_cache()
+    _ensure_listener(cache)
+    tenant_id = _tenant_key(tenant_id)
+    key = (kind, tenant_id)
+    config = cache.get(key)
+    if config is MISSING:
+        with dependency_call("db", "tenant_config"):
+            config = _load(kind, tenant_id)
+        cache.set(key, config)
+    return config
+
+def tenant_exists(tenant_id):
+    """Whether the tenant exists. Cached, and invalidated, with the tenant's configs."""
+    cache = _get_cache()
+    _ensure_listener(cache)
+    tenant_id = _tenant_key(tenant_id)
+    key = ("tenant", tenant_id)
+    exists = cache.get(key)
+    if exists is MISSING:
+        with dependency_call("db", "tenant"):
+            exists = Tenant.query.filter_by(id=tenant_id).count() > 0
+        cache.set(key, exists)
+    return exists
+
+def invalidate_tenant_config(tenant_id=None):
+    """
+    Drops cached configs for a tenant (or for all tenants when tenant_id is None,
+    e.g. after a global config change) in this process and broadcasts the
+    invalidation to all other processes.
+    """
+    cache = _get_cache()
+    if tenant_id is None:
+        cache.clear()
+    else:
+        tenant_id = _tenant_key(tenant_id)
+        cache.pop_matching(lambda key: key[1] == tenant_id)
+    try:
+        get_redis().publish(INVALIDATION_CHANNEL, json.dumps(tenant_id if tenant_id is not None else ALL_TENANTS))
+    except Exception:
+        logger.exception("Failed to broadcast tenant config invalidation")
@@ -0,0 +1,245 @@
+"""
+Embedding service shared by the document index and query paths.
+
+Texts are looked up in a content-hash keyed cache (in memory, backed by an
+on-disk SQLite store) before reaching the provider. Cache misses from
+concurrent callers are merged by a micro-batcher into a single provider
+request. The provider is pluggable: "openai" calls the embeddings API, "fake"
+returns deterministic vectors with a configurable latency for offline
+benchmarks.
+"""
+import array
+import hashlib
+import logging
+import os
+import queue
+import sqlite3
+import threading
+import time
+from concurrent.futures import Future
+from flask import current_app
+from app.cache import TTLCache, MISSING
+
+logger = logging.getLogger(__name__)
+
+class OpenAIEmbeddingProvider:
+    def __init__(self, model):
+        self.model = model
+
+    def embed(self, texts, tenant_id=None):
+        from app import llm_client  # Avoid loading aiohttp at import time
+        return llm_client.embed(tenant_id, texts, self.model)
+
+class FakeEmbeddingProvider:
+    """
+    Deterministic, network-free provider: the vector is derived from the text's
+    hash, so identical texts get identical vectors.
+    """
+
+    def __init__(self, model, dimensions=1536, latency=0.0):
+        self.model = model
+        self.dimensions = dimensions
+        self.latency = latency
+
+    def embed(self, texts, tenant_id=None):
+        if self.latency:
+            time.sleep(self.latency)
+        vectors = []
+        for text in texts:
+            seed = hashlib.sha256(text.encode("utf-8")).digest()
+            vectors.append([(seed[i % len(seed)] - 127.5) / 127.5 for i in range(self.dimensions)])
+        return vectors
+
+PROVIDERS = {
+    "openai": OpenAIEmbeddingProvider,
+    "fake": FakeEmbeddingProvider,
+}
+
+class EmbeddingCache:
+    """
+    Two-level cache: a per-process LRU in front of a SQLite file that is shared
+    by every process on the host and survives restarts. Vectors are stored as
+    float32 arrays in both (a list of Python floats takes about six times the
+    memory) and returned as lists.
+    """
+
+    def __init__(self, path=None, memory_size=2000):
+        self.memory = TTLCache(maxsize=memory_size, ttl=float("inf"))
+        self.path = path
+        self._conn = None
+        self._lock = threading.Lock()
+        if path:
+            self._conn = sqlite3.connect(path, check_same_thread=False, timeout=30)
+            self._conn.execute("PRAGMA journal_mode=WAL")
+            self._conn.execute("CREATE TABLE IF NOT EXISTS embeddings (key TEXT PRIMARY KEY, vector BLOB NOT NULL)")
+            self._conn.commit()
+
+    @staticmethod
+    def key(model, text):
+        return hashlib.sha256(f"{model}\0{text}".encode("utf-8")).hexdigest()
+
+    def get_many(self, keys):
+        found = {}
+        missing = []
+        for key in keys:
+            vector = self.memory.get(key)
+            if vector is MISSING:
+                missing.append(key)
+            else:
+                found[key] = vector.tolist()
+        if missing and self._conn is not None:
+            with self._lock:
+                for start in range(0, len(missing), 500):
+                    chunk = missing[start:start + 500]
+                    rows = self._conn.execute(
+                        f"SELECT key, vector FROM embeddings WHERE key IN ({','.join('?' * len(chunk))})", chunk
+                    ).fetchall()
+                    for key, blob in rows:
+                        vector = array.array("f", blob)
+                        self.memory.set(key, vector)
+                        found[key] = vector.tolist()
+        return found
+
+    def set_many(self, items):
+        items = {key: array.array("f", vector) for key, vector in items.items()}
+        for key, vector in items.items():
+            self.memory.set(key, vector)
+        if items and self._conn is not None:
+            with self._lock:
+                self._conn.executemany(
+                    "INSERT OR REPLACE INTO embeddings (key, vector) VALUES (?, ?)",
+                    [(key, vector.tobytes()) for key, vector in items.items()]
+                )
+                self._conn.commit()
+
+class EmbeddingBatcher:
+    """
+    Merges concurrent embedding requests into batched provider calls. A
+    background thread waits up to max_wait seconds after the first pending text
+    (or until max_batch texts are queued) and sends them in one request per
+    tenant, so each request counts against its tenant's LLM limits.
+    Callers wait up to timeout seconds for their vectors.
+    """
+
+    def __init__(self, provider, max_batch=64, max_wait=0.01, timeout=None):
+        self.provider = provider
+        self.max_batch = max_batch
+        self.max_wait = max_wait
+        self.timeout = timeout
+        self._queue = queue.Queue()
+        self._thread = threading.Thread(target=self._run, name="embedding-batcher", daemon=True)
+        self._thread.start()
+
+    def embed(self, texts, tenant_id=None):
+        futures = []
+        for text in texts:
+            future = Future()
+            self._queue.put((tenant_id, text, future))
+            futures.append(future)
+        deadline = time.monotonic() + self.timeout if self.timeout else None
+        return [future.result(timeout=deadline and max(0, deadline - time.monotonic())) for future in futures]
+
+    def _run(self):
+        while True:
+            batch = [self._queue.get()]
+            deadline = time.monotonic() + self.max_wait
+            while len(batch) < self.max_batch:
+                timeout = deadline - time.monotonic()
+                if timeout <= 0:
+                    break
+                try:
+                    batch.append(self._queue.get(timeout=timeout))
+                except queue.Empty:
+                    break
+            try:
+                self._dispatch(batch)
+            except Exception:
+                # Keep the thread alive: every later embedding would wait on it.
+                logger.exception("Embedding batch failed")
+
+    def _dispatch(self, batch):
+        by_tenant = {}
+        for tenant_id, text, future in batch:
+            by_tenant.setdefault(tenant_id, []).append((text, future))
+        for tenant_id, requests in by_tenant.items():
+            texts = list(dict.fromkeys(text for text, _ in requests))
+            try:
+                vectors = self.provider.embed(texts, tenant_id)
+                if len(vectors) != len(texts):
+                    raise ValueError(f"Embedding provider returned {len(vectors)} vectors for {len(texts)} texts")
+                vectors = dict(zip(texts, vectors))
+                for text, future in requests:
+                    future.set_result(vectors[text])
+            except Exception as exc:
+                for _, future in requests:
+                    if not future.done():
+                        future.set_exception(exc)
+
+class EmbeddingService:
+    def __init__(self, provider, cache, batcher):
+        self.provider = provider
+        self.cache = cache
+        self.batcher = batcher
+
+    def embed(self, texts, tenant_id=None):
+        """
+        Returns one vector per text, computing only texts not already cached.
+        The provider calls for the rest count against the tenant's LLM limits.
+        """
+        keys = [self.cache.key(self.provider.model, text) for text in texts]
+        found = self.cache.get_many(set(keys))
+        missing = {}
+        for key, text in zip(keys, texts):
+            if key not in found:
+                missing[key] = text
+        if missing:
+            vectors = self.batcher.embed(list(missing.values()), tenant_id)
+            computed = dict(zip(missing.keys(), vectors))
+            self.cache.set_many(computed)
+            found.update(computed)
+        return [found[key] for key in keys]
+
+_service = None
+_service_pid = None
+_service_lock = threading.Lock()
+
+def build_embedding_service(config):
+    provider_name = config['EMBEDDING_PROVIDER']
+    if provider_name == "fake":
+        provider = FakeEmbeddingProvider(
+            config['EMBEDDING_MODEL'],
+            dimensions=config['FAKE_EMBEDDING_DIMENSIONS'],
+            latency=config['FAKE_EMBEDDING_LATENCY']
+        )
+    else:
+        provider = PROVIDERS[provider_name](config['EMBEDDING_MODEL'])
+        # The batcher thread runs without an app context, so build the LLM client now.
+        from app import llm_client  # Avoid loading aiohttp at import time
+        llm_client.get_llm_client()
+    cache = EmbeddingCache(config['EMBEDDING_CACHE_PATH'] or None, config['EMBEDDING_CACHE_MEMORY_SIZE'])
+    batcher = EmbeddingBatcher(
+        provider,
+        config['EMBEDDING_BATCH_SIZE'],
+        config['EMBEDDING_BATCH_WAIT_MS'] / 1000.0,
+        timeout=config['EMBEDDING_TIMEOUT'] or None
+    )
+    return EmbeddingService(provider, cache, batcher)
+
+def get_embedding_service():
+    """
+    Returns this process's embedding service. The batcher thread and SQLite
+    connection do not survive a fork, so a forked worker child builds its own.
+    """
+    global _service, _service_pid
+    if _service is None or _service_pid != os.getpid():
+        with _service_lock:
+            if _service is None or _service_pid != os.getpid():
+                _service = build_embedding_service(current_app.config)
+                _service_pid = os.getpid()
+    return _service
+
+def get_embeddings(texts, tenant_id=None):
+    return get_embedding_service().embed(texts, tenant_id)
+
+def get_embedding(text, tenant_id=None):
+    return get_embedding_service().embed([text], tenant_id)[0]
@@ -0,0 +1,293 @@
+"""
+Weighted fair-share dispatching of tenant work.
+
+With FAIR_SHARE_ENABLED, tasks submitted through submit() are not published
+to the broker directly. They wait in a per-tenant backlog in Redis, and the
+dispatcher (`flask fair-share dispatch`) moves them to the Celery queues with
+deficit round robin over the tenants that have a backlog, keeping at most
+FAIR_SHARE_MAX_QUEUE_DEPTH messages in each broker queue. A tenant that
+submits 10k summarizations therefore only ever holds its weighted share of
+the doc_sum queue, and other tenants' tasks are dispatched next to it.
+Tenant weights (default 1) are kept in Redis and set by an admin endpoint.
+
+Each tenant has one backlog per priority level (PRIORITY_STEPS in
+app/queues.py), and the dispatcher takes a tenant's tasks from its highest
+priority backlog first, so an interactive request is not queued behind the
+bulk batches the same tenant submitted earlier.
+"""
+import bisect
+import json
+import logging
+import time
+from celery import signature as celery_signature
+from flask import current_app
+from app import celery
+from app.queues import PRIORITY_STEPS, QUEUES, route_task
+from app.redis_client import get_redis
+
+logger = logging.getLogger(__name__)
+
+BACKLOG_KEY = "fair_share:{queue}:tenant:{tenant_id}:p{priority}"
+ACTIVE_KEY = "fair_share:{queue}:active"
+WEIGHTS_KEY = "fair_share:weights"
+DISPATCHED_KEY = "fair_share:dispatched"
+WAKE_KEY = "fair_share:wake"
+
+# KEYS[1] is the queue's active set, KEYS[2..] the tenant's backlogs from the
+# highest priority down; ARGV: the number of tasks to pop, the tenant id and
+# the priority of each backlog. Pops up to ARGV[1] tasks, highest priority
+# first, returns {priority, task, priority, task...} and removes the tenant
+# from the active set once its backlogs are empty, atomically with respect to
+# submit().
+_POP_SCRIPT = """
+local popped = {}
+local wanted = tonumber(ARGV[1])
+local empty = true
+for i = 2, #KEYS do
+    if wanted > 0 then
+        local items = redis.call('LRANGE', KEYS[i], 0, wanted - 1)
+        redis.call('LTRIM', KEYS[i], #items, -1)
+        for _, item in ipairs(items) do
+            table.insert(popped, ARGV[i + 1])
+            table.insert(popped, item)
+        end
+        wanted = wanted - #items
+    end
+    if empty and redis.call('LLEN', KEYS[i]) > 0 then
+        empty = false
+    end
+end
+if empty then
+    redis.call('SREM', KEYS[1], ARGV[2])
+end
+return popped
+"""
+
+_pop = None
+
+def route_for(sig):
+    """
+    The agent queue and priority a signature (or the header of a chord) is
+    routed to. A priority set on the signature itself takes precedence.
+    """
+    priority = sig.get("options", {}).get("priority")
+    if sig.get("subtask_type") == "chord":
+        sig = celery_signature(sig["kwargs"]["header"][0])
+    route = route_task(sig.task, sig.args, sig.kwargs, sig.options)
+    if route is None:
+        route = {"queue": celery.conf.task_default_queue, "priority": celery.conf.task_default_priority}
+    return route["queue"], route["priority"] if priority is None else priority
+
+def queue_for(sig):
+    """The agent queue a signature (or the header of a chord) is routed to."""
+    return route_for(sig)[0]
+
+def priority_level(priority):
+    """The priority step a priority falls in, as the Redis broker rounds it."""
+    return PRIORITY_STEPS[max(0, bisect.bisect(PRIORITY_STEPS, priority) - 1)]
+
+def _backlog_keys(queue, tenant_id):
+    """The tenant's backlogs on a queue, highest priority first."""
+    return [BACKLOG_KEY.format(queue=queue, tenant_id=tenant_id, priority=priority) for priority in PRIORITY_STEPS]
+
+def submit(sig, tenant_id):
+    """
+    Submits a task signature (or chord) on behalf of a tenant and returns its
+    AsyncResult. The task id is assigned up front, so callers can report it
+    before the task reaches the broker.
+    """
+    if not current_app.config['FAIR_SHARE_ENABLED'] or tenant_id is None:
+        return sig.apply_async()
+    queue, priority = route_for(sig)
+    result = sig.freeze()
+    pipe = get_redis().pipeline()
+    pipe.rpush(BACKLOG_KEY.format(queue=queue, tenant_id=tenant_id, priority=priority_level(priority)), json.dumps(sig))
+    pipe.sadd(ACTIVE_KEY.format(queue=queue), tenant_id)
+    # Wakes an idle dispatcher; one pending wake-up is enough.
+    pipe.lpush(WAKE_KEY, 1)
+    pipe.ltrim(WAKE_KEY, 0, 0)
+    pipe.execute()
+    return result
+
+def set_weight(tenant_id, weight):
+    get_redis().hset(WEIGHTS_KEY, str(tenant_id), weight)
+
+def clear_tenant(tenant_id):
+    """
+    Drops the tenant's backlogs, weight and dispatched counts, e.g. when the
+    tenant is deleted. Tasks already in the broker are not recalled.
+    """
+    pipe = get_redis().pipeline()
+    for queue in QUEUES:
+        pipe.delete(*_backlog_keys(queue, tenant_id))
+        pipe.srem(ACTIVE_KEY.format(queue=queue), tenant_id)
+        pipe.hdel(DISPATCHED_KEY, f"{queue}:{tenant_id}")
+    pipe.hdel(WEIGHTS_KEY, str(tenant_id))
+    pipe.execute()
+
+def _pop_backlog(queue, tenant_id, count):
+    """Pops up to count of the tenant's tasks, highest priority first, as [(priority, task)]."""
+    global _pop
+    redis_client = get_redis()
+    if _pop is None:
+        _pop = redis_client.register_script(_POP_SCRIPT)
+    popped = _pop(
+        keys=[ACTIVE_KEY.format(queue=queue)] + _backlog_keys(queue, tenant_id),
+        args=[count, tenant_id] + PRIORITY_STEPS,
+        client=redis_client
+    )
+    return [(int(priority), item) for priority, item in zip(popped[::2], popped[1::2])]
+
+def _requeue(queue, tenant_id, items):
+    """Returns popped [(priority, task)] to the front of their backlogs, in order."""
+    pipe = get_redis().pipeline()
+    for priority, item in reversed(items):
+        pipe.lpush(BACKLOG_KEY.format(queue=queue, tenant_id=tenant_id, priority=priority), item)
+    pipe.sadd(ACTIVE_KEY.format(queue=queue), tenant_id)
+    pipe.execute()
+
+def _backlog_lengths(queue, tenant_ids):
+    """{(tenant_id, priority): tasks waiting} for the given tenants' backlogs on a queue."""
+    pipe = get_redis().pipeline()
+    for tenant_id in tenant_ids:
+        for key in _backlog_keys(queue, tenant_id):
+            pipe.llen(key)
+    lengths = iter(pipe.execute())
+    return {(tenant_id, priority): next(lengths) for tenant_id in tenant_ids for priority in PRIORITY_STEPS}
+
+def get_stats():
+    """
+    Per queue: broker depth, and per tenant the backlog waiting for dispatch,
+    the number of tasks dispatched so far and the tenant's weight.
+    """
+    redis_client = get_redis()
+    weights = {key.decode(): float(value) for key, value in redis_client.hgetall(WEIGHTS_KEY).items()}
+    dispatched = {key.decode(): int(value) for key, value in redis_client.hgetall(DISPATCHED_KEY).items()}
+    depths = broker_depths()
+    stats = {}
+    for queue in QUEUES:
+        tenant_ids = sorted(member.decode() for member in redis_client.smembers(ACTIVE_KEY.format(queue=queue)))
+        backlogs = dict.fromkeys(tenant_ids, 0)
+        for (tenant_id, _), length in _backlog_lengths(queue, tenant_ids).items():
+            backlogs[tenant_id] += length
+        tenants = {}
+        for field, count in dispatched.items():
+            field_queue, tenant_id = field.rsplit(":", 1)
+            if field_queue == queue:
+                tenants.setdefault(tenant_id, {})["dispatched"] = count
+        for tenant_id, backlog in backlogs.items():
+            tenants.setdefault(tenant_id, {})["backlog"] = backlog
+        for tenant_id, tenant in tenants.items():
+            tenant.setdefault("backlog", 0)
+            tenant.setdefault("dispatched", 0)
+            tenant["weight"] = weights.get(tenant_id, 1.0)
+        stats[queue] = {
+            "broker_depth": depths.get(queue),
+            "backlog": sum(backlogs.values()),
+            "tenants": dict(sorted(tenants.items()))
+        }
+    return stats
+
+def backlog_depths():
+    """{(queue, tenant_id, priority): tasks waiting in the tenant's backlog} for every non-empty backlog."""
+    redis_client = get_redis()
+    depths = {}
+    for queue in QUEUES:
+        tenant_ids = sorted(member.decode() for member in redis_client.smembers(ACTIVE_KEY.format(queue=queue)))
+        for (tenant_id, priority), length in _backlog_lengths(queue, tenant_ids).items():
+            if length:
+                depths[(queue, tenant_id, priority)] = length
+    return depths
+
+def broker_depths():
+    """Messages waiting in each agent queue of the broker (all priorities)."""
+    depths = {}
+    with celery.connection_for_read() as connection:
+        channel = connection.default_channel
+        for queue in QUEUES:
+            depths[queue] = celery.amqp.queues[queue].bind(channel).queue_declare().message_count
+    return depths
+
+class FairShareDispatcher:
+    """
+    Deficit round robin over the tenants with a backlog. Each turn a tenant's
+    deficit grows by its weight and it may dispatch that many tasks; deficits
+    and the round-robin position carry over between calls, so small budgets
+    are still shared in proportion to the weights.
+    """
+
+    def __init__(self, max_queue_depth):
+        self.max_queue_depth = max_queue_depth
+        self.deficits = {}
+        self.cursors = {}
+
+    def dispatch_once(self):
+        """Fills every agent queue up to max_queue_depth. Returns the number of tasks dispatched."""
+        redis_client = get_redis()
+        weights = {key.decode(): float(value) for key, value in redis_client.hgetall(WEIGHTS_KEY).items()}
+        depths = broker_depths()
+        dispatched = 0
+        for queue in QUEUES:
+            budget = self.max_queue_depth - depths[queue]
+            if budget > 0:
+                dispatched += self._dispatch_queue(queue, budget, weights)
+        return dispatched
+
+    def _dispatch_queue(self, queue, budget, weights):
+        redis_client = get_redis()
+        tenant_ids = sorted(member.decode() for member in redis_client.smembers(ACTIVE_KEY.format(queue=queue)))
+        if not tenant_ids:
+            return 0
+        # Resume the round robin after the tenant served last.
+        cursor = self.cursors.get(queue)
+        start = next((i for i, tenant_id in enumerate(tenant_ids) if cursor is not None and tenant_id > cursor), 0)
+        tenant_ids = tenant_ids[start:] + tenant_ids[:start]
+        sent = 0
+        while budget > 0 and tenant_ids:
+            for tenant_id in list(tenant_ids):
+                if budget <= 0:
+                    break
+                key = (queue, tenant_id)
+                deficit = self.deficits.get(key, 0) + weights.get(tenant_id, 1.0)
+                count = min(int(deficit), budget)
+                items = _pop_backlog(queue, tenant_id, count) if count > 0 else []
+                for position, (_, raw) in enumerate(items):
+                    if not self._publish(raw):
+                        # Broker unavailable: return the rest to the front of the backlog.
+                        _requeue(queue, tenant_id, items[position:])
+                        if position:
+                            redis_client.hincrby(DISPATCHED_KEY, f"{queue}:{tenant_id}", position)
+                        return sent + position
+                if items:
+                    redis_client.hincrby(DISPATCHED_KEY, f"{queue}:{tenant_id}", len(items))
+                budget -= len(items)
+                sent += len(items)
+                if len(items) < count:
+                    # Backlog drained: an idle tenant does not bank credit.
+                    tenant_ids.remove(tenant_id)
+                    self.deficits.pop(key, None)
+                else:
+                    self.deficits[key] = deficit - len(items)
+                self.cursors[queue] = tenant_id
+        return sent
+
+    def _publish(self, raw):
+        try:
+            celery_signature(json.loads(raw), app=celery).apply_async()
+            return True
+        except Exception:
+            logger.exception("Failed to dispatch task")
+            return False
+
+    def run(self, poll_interval):
+        """Dispatches forever, sleeping until new work arrives or poll_interval passes."""
+        redis_client = get_redis()
+        while True:
+            try:
+                dispatched = self.dispatch_once()
+            except Exception:
+                logger.exception("Fair-share dispatch failed")
+                dispatched = 0
+                time.sleep(poll_interval)
+            if not dispatched:
+                redis_client.blpop(WAKE_KEY, timeout=poll_interval)
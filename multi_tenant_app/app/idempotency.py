@@ -0,0 +1,81 @@
+"""
+Idempotent execution of tasks with side effects.
+
+An execution is identified by an idempotency key, supplied by the caller (the
+Idempotency-Key header or an "idempotency_key" field) or derived from the
+tenant, the task and a hash of its payload. The first execution claims the key
+in Redis and records its outcome there for IDEMPOTENCY_TTL_SECONDS, so a task
+retry or a duplicate submission with the same key returns the recorded result
+instead of sending the email or creating the lead again.
+
+A failure that certainly left no side effect releases the claim, so the task
+may retry. A failure after the request reached the remote service (e.g. a
+read timeout, a 5xx reply to a lead creation or an SMTP session dropped after
+the message data) leaves the outcome unknown: func raises OutcomeUnknown, it
+is recorded, and later executions with the key fail with OutcomeUnknown
+instead of risking a duplicate. An execution interrupted midway (e.g. by a
+worker shutdown) keeps its claim until IDEMPOTENCY_LOCK_TTL expires.
+"""
+import hashlib
+import json
+from flask import current_app
+from app.redis_client import delete_matching, get_redis
+
+RECORD_KEY = "idempotency:{tenant_id}:{digest}"
+
+STARTED = "started"
+SUCCEEDED = "succeeded"
+UNKNOWN = "unknown"
+
+class OutcomeUnknown(Exception):
+    """Raised when a side effect may or may not have happened, so retrying could duplicate it."""
+
+class DuplicateInFlight(Exception):
+    """Raised when another execution with the same idempotency key is still running."""
+
+def derive_key(payload):
+    """Idempotency key for a JSON-serializable task payload."""
+    return hashlib.sha256(json.dumps(payload, sort_keys=True, default=str).encode("utf-8")).hexdigest()
+
+def _record_key(tenant_id, task_name, key):
+    # Caller keys are scoped to the task, so one key reused across endpoints does not collide.
+    digest = hashlib.sha256(f"{task_name}:{key}".encode("utf-8")).hexdigest()
+    return RECORD_KEY.format(tenant_id=tenant_id, digest=digest)
+
+def execute(tenant_id, task_name, key, func):
+    """
+    Runs func() at most once per (tenant, task, key) and returns its result, or
+    the result recorded by an earlier execution. The result must be JSON
+    serializable.
+    """
+    config = current_app.config
+    redis_client = get_redis()
+    record_key = _record_key(tenant_id, task_name, key)
+    while True:
+        # The claim expires on its own if the worker dies mid-execution.
+        if redis_client.set(record_key, json.dumps({"status": STARTED}), nx=True, ex=config['IDEMPOTENCY_LOCK_TTL']):
+            break
+        raw = redis_client.get(record_key)
+        if raw is None:
+            continue  # Released or expired since the claim attempt
+        record = json.loads(raw)
+        if record["status"] == SUCCEEDED:
+            return record["result"]
+        if record["status"] == UNKNOWN:
+            raise OutcomeUnknown(record["error"])
+        raise DuplicateInFlight(f"{task_name} with this idempotency key is already running")
+
+    try:
+        result = func()
+    except OutcomeUnknown as exc:
+        redis_client.set(record_key, json.dumps({"status": UNKNOWN, "error": str(exc)}), ex=config['IDEMPOTENCY_TTL_SECONDS'])
+        raise
+    except Exception:
+        redis_client.delete(record_key)
+        raise
+    redis_client.set(record_key, json.dumps({"status": SUCCEEDED, "result": result}), ex=config['IDEMPOTENCY_TTL_SECONDS'])
+    return result
+
+def clear_tenant(tenant_id):
+    """Deletes the tenant's idempotency records, e.g. when the tenant is deleted."""
+    delete_matching(RECORD_KEY.format(tenant_id=tenant_id, digest="*"))
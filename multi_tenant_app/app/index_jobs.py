@@ -0,0 +1,97 @@
+import json
+import time
+from flask import current_app
+from app.redis_client import get_redis
+
+# Progress of a bulk indexing job, stored as a Redis hash. Counters are updated
+# with HINCRBY so batches indexed by different workers never overwrite each other.
+JOB_KEY = "index_job:{job_id}"
+ERRORS_KEY = "index_job:{job_id}:errors"
+MAX_ERRORS = 100
+
+def _ttl():
+    return current_app.config['INDEX_JOB_TTL_SECONDS']
+
+def create_job(job_id, tenant_id):
+    key = JOB_KEY.format(job_id=job_id)
+    pipe = get_redis().pipeline()
+    pipe.hset(key, mapping={
+        "job_id": job_id,
+        "tenant_id": tenant_id,
+        "status": "receiving",
+        "created_at": time.time(),
+        "upload_complete": 0,
+        "documents_received": 0,
+        "documents_indexed": 0,
+        "chunks_indexed": 0,
+        "batches_total": 0,
+        "batches_done": 0,
+        "errors_total": 0
+    })
+    pipe.expire(key, _ttl())
+    pipe.execute()
+
+def add_errors(job_id, errors, total=None):
+    """
+    Records per-document errors; only the first MAX_ERRORS are kept. `total`
+    counts errors the caller did not keep (default: len(errors)).
+    """
+    total = len(errors) if total is None else total
+    if not total:
+        return
+    errors_key = ERRORS_KEY.format(job_id=job_id)
+    pipe = get_redis().pipeline()
+    pipe.hincrby(JOB_KEY.format(job_id=job_id), "errors_total", total)
+    if not errors:
+        pipe.execute()
+        return
+    pipe.rpush(errors_key, *[json.dumps(error) for error in errors])
+    pipe.ltrim(errors_key, 0, MAX_ERRORS - 1)
+    pipe.expire(errors_key, _ttl())
+    pipe.execute()
+
+def record_dispatched(job_id, documents):
+    pipe = get_redis().pipeline()
+    key = JOB_KEY.format(job_id=job_id)
+    pipe.hincrby(key, "documents_received", documents)
+    pipe.hincrby(key, "batches_total", 1)
+    pipe.execute()
+
+def _maybe_complete(job_id):
+    redis_client = get_redis()
+    key = JOB_KEY.format(job_id=job_id)
+    upload_complete, batches_total, batches_done, errors_total = redis_client.hmget(
+        key, "upload_complete", "batches_total", "batches_done", "errors_total"
+    )
+    if int(upload_complete or 0) and int(batches_done or 0) >= int(batches_total or 0):
+        status = "completed_with_errors" if int(errors_total or 0) else "completed"
+        redis_client.hset(key, mapping={"status": status, "finished_at": time.time()})
+
+def mark_upload_complete(job_id):
+    get_redis().hset(JOB_KEY.format(job_id=job_id), mapping={"upload_complete": 1, "status": "indexing"})
+    _maybe_complete(job_id)
+
+def record_batch(job_id, documents_indexed, chunks_indexed):
+    pipe = get_redis().pipeline()
+    key = JOB_KEY.format(job_id=job_id)
+    pipe.hincrby(key, "documents_indexed", documents_indexed)
+    pipe.hincrby(key, "chunks_indexed", chunks_indexed)
+    pipe.hincrby(key, "batches_done", 1)
+    pipe.execute()
+    _maybe_complete(job_id)
+
+def get_job(job_id):
+    redis_client = get_redis()
+    raw = redis_client.hgetall(JOB_KEY.format(job_id=job_id))
+    if not raw:
+        return None
+    job = {key.decode(): value.decode() for key, value in raw.items()}
+    for field in ("tenant_id", "documents_received", "documents_indexed", "chunks_indexed",
+                  "batches_total", "batches_done", "errors_total"):
+        job[field] = int(job[field])
+    for field in ("created_at", "finished_at"):
+        if field in job:
+            job[field] = float(job[field])
+    job["upload_complete"] = bool(int(job["upload_complete"]))
+    job["errors"] = [json.loads(error) for error in redis_client.lrange(ERRORS_KEY.format(job_id=job_id), 0, -1)]
+    return job
@@ -0,0 +1,171 @@
+"""
+Asynchronous client for the OpenAI-compatible completion and embedding APIs.
+
+Every request of a process runs on one event loop (in a background thread)
+over a keep-alive aiohttp connection pool. Synchronous callers submit
+coroutines to that loop, so a worker started with many threads, e.g.
+
+    celery -A celery_worker.celery worker --pool threads --concurrency 64
+
+keeps that many LLM calls in flight from a single process. Each tenant is
+limited by a semaphore (concurrent requests) and a token bucket (requests per
+second). OPENAI_API_BASE points the client at any compatible server, such as
+the local fake in bench/fake_openai.py.
+"""
+import asyncio
+import json
+import os
+import threading
+import time
+import aiohttp
+from flask import current_app
+from app.offload import native_thread_class
+
+class LLMError(Exception):
+    """Raised when the LLM API rejects a request."""
+
+    def __init__(self, message, status=None):
+        super().__init__(message)
+        self.status = status
+
+class TokenBucket:
+    """
+    Allows `rate` acquisitions per second on average with bursts of up to
+    `capacity`. Must be used from the event loop thread.
+    """
+
+    def __init__(self, rate, capacity):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated = time.monotonic()
+        self._lock = asyncio.Lock()
+
+    async def acquire(self):
+        async with self._lock:
+            while True:
+                now = time.monotonic()
+                self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+                self.updated = now
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                await asyncio.sleep((1 - self.tokens) / self.rate)
+
+class AsyncLLMClient:
+    def __init__(self, api_base, api_key, max_connections=100, keepalive_timeout=30, request_timeout=60,
+                 tenant_concurrency=8, tenant_rate=0, tenant_burst=1):
+        self.api_base = api_base.rstrip("/")
+        self.api_key = api_key
+        self.max_connections = max_connections
+        self.keepalive_timeout = keepalive_timeout
+        self.request_timeout = request_timeout
+        self.tenant_concurrency = tenant_concurrency
+        self.tenant_rate = tenant_rate
+        self.tenant_burst = tenant_burst
+        self._session = None
+        self._tenants = {}
+
+    def _get_session(self):
+        # Created lazily so the session binds to the loop it is used on.
+        if self._session is None or self._session.closed:
+            self._session = aiohttp.ClientSession(
+                connector=aiohttp.TCPConnector(limit=self.max_connections, keepalive_timeout=self.keepalive_timeout),
+                timeout=aiohttp.ClientTimeout(total=self.request_timeout),
+                headers={"Authorization": f"Bearer {self.api_key}"}
+            )
+        return self._session
+
+    def _limits(self, tenant_id):
+        limits = self._tenants.get(tenant_id)
+        if limits is None:
+            bucket = TokenBucket(self.tenant_rate, self.tenant_burst) if self.tenant_rate > 0 else None
+            limits = self._tenants[tenant_id] = (asyncio.Semaphore(self.tenant_concurrency), bucket)
+        return limits
+
+    async def _post(self, tenant_id, path, payload):
+        semaphore, bucket = self._limits(tenant_id)
+        async with semaphore:
+            if bucket is not None:
+                await bucket.acquire()
+            async with self._get_session().post(f"{self.api_base}/{path}", json=payload) as response:
+                body = await response.text()
+                if response.status != 200:
+                    raise LLMError(f"{path} request failed with HTTP {response.status}: {body}", response.status)
+                return json.loads(body)
+
+    async def complete(self, tenant_id, prompt, model, max_tokens, temperature):
+        response = await self._post(tenant_id, "completions", {
+            "model": model,
+            "prompt": prompt,
+            "max_tokens": max_tokens,
+            "temperature": temperature
+        })
+        return response["choices"][0]["text"].strip()
+
+    async def embed(self, tenant_id, texts, model):
+        response = await self._post(tenant_id, "embeddings", {"model": model, "input": texts})
+        data = sorted(response["data"], key=lambda item: item["index"])
+        return [item["embedding"] for item in data]
+
+    async def close(self):
+        if self._session is not None:
+            await self._session.close()
+
+class EventLoopThread:
+    """
+    Runs an asyncio event loop in a daemon thread and executes coroutines on it.
+    Under gevent the thread is a native one, so the loop never shares the hub.
+    """
+
+    def __init__(self):
+        self.loop = asyncio.new_event_loop()
+        self._thread = native_thread_class()(target=self.loop.run_forever, name="llm-event-loop", daemon=True)
+        self._thread.start()
+
+    def run(self, coro):
+        return asyncio.run_coroutine_threadsafe(coro, self.loop).result()
+
+_client = None
+_loop = None
+_client_pid = None
+_client_lock = threading.Lock()
+
+def build_llm_client(config):
+    return AsyncLLMClient(
+        config['OPENAI_API_BASE'],
+        config['OPENAI_API_KEY'],
+        max_connections=config['LLM_MAX_CONNECTIONS'],
+        keepalive_timeout=config['LLM_KEEPALIVE_TIMEOUT'],
+        request_timeout=config['LLM_REQUEST_TIMEOUT'],
+        tenant_concurrency=config['LLM_TENANT_CONCURRENCY'],
+        tenant_rate=config['LLM_TENANT_RATE'],
+        tenant_burst=config['LLM_TENANT_BURST']
+    )
+
+def get_llm_client():
+    """
+    Returns this process's client and the loop it runs on. The loop thread does
+    not survive a fork, so a forked worker child builds its own.
+    """
+    global _client, _loop, _client_pid
+    if _client is None or _client_pid != os.getpid():
+        with _client_lock:
+            if _client is None or _client_pid != os.getpid():
+                _loop = EventLoopThread()
+                _client = build_llm_client(current_app.config)
+                _client_pid = os.getpid()
+    return _client, _loop
+
+def run_coroutine(coro):
+    """Runs a coroutine on the client's event loop and waits for its result."""
+    _, loop = get_llm_client()
+    return loop.run(coro)
+
+def complete(tenant_id, prompt, model, max_tokens, temperature):
+    client, loop = get_llm_client()
+    return loop.run(client.complete(tenant_id, prompt, model, max_tokens, temperature))
+
+def embed(tenant_id, texts, model):
+    client, loop = get_llm_client()
+    return loop.run(client.embed(tenant_id, texts, model))
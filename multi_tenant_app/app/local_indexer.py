@@ -0,0 +1,87 @@
+"""
+Background bulk indexing for the embedded vector store.
+
+The embedded Chroma store (no CHROMA_SERVER_HOST) is only visible to the
+process that opened it, so the batches of a bulk upload cannot be indexed by
+the Celery workers. They are queued here instead and indexed by a background
+thread of the web process, with the retry policy of index_documents_task,
+while the upload request returns. Progress is recorded in the index job (see
+app/index_jobs.py) as for batches indexed by Celery.
+
+The queue holds at most INDEX_LOCAL_MAX_PENDING batches. An upload that finds
+it full waits up to INDEX_LOCAL_QUEUE_TIMEOUT seconds for room, so it is read
+no faster than it is indexed; beyond that Overloaded is raised. Batches still
+queued when the process exits are lost, and their job expires unfinished.
+"""
+import logging
+import os
+import queue
+import threading
+import time
+from flask import current_app
+from app.offload import Overloaded
+
+logger = logging.getLogger(__name__)
+
+class LocalIndexer:
+    def __init__(self, max_pending, queue_timeout):
+        self.queue_timeout = queue_timeout
+        self._queue = queue.Queue(maxsize=max_pending)
+        self._thread = threading.Thread(target=self._run, name="local-indexer", daemon=True)
+        self._thread.start()
+
+    def submit(self, job_id, tenant_id, documents):
+        """Queues a batch of a bulk indexing job; raises Overloaded if the queue stays full."""
+        item = (current_app._get_current_object(), job_id, tenant_id, documents)
+        try:
+            self._queue.put(item, timeout=self.queue_timeout)
+        except queue.Full:
+            raise Overloaded("Too many bulk indexing batches waiting") from None
+
+    def join(self):
+        """Waits until every queued batch has been indexed or has failed."""
+        self._queue.join()
+
+    def _run(self):
+        while True:
+            app, job_id, tenant_id, documents = self._queue.get()
+            try:
+                with app.app_context():
+                    index_with_retries(job_id, tenant_id, documents)
+            except Exception:
+                # Keep the thread alive: the batches behind this one would never run.
+                logger.exception("Bulk indexing batch of job %s failed", job_id)
+            finally:
+                self._queue.task_done()
+
+def index_with_retries(job_id, tenant_id, documents):
+    """Indexes a batch in this process, retrying as index_documents_task would."""
+    from app.tasks import backoff, fail_index_batch, index_batch, index_documents_task  # Avoid circular import
+    retries = 0
+    while True:
+        try:
+            return index_batch(job_id, tenant_id, documents)
+        except Exception as exc:
+            if retries >= index_documents_task.max_retries:
+                fail_index_batch(job_id, exc)
+                raise
+            time.sleep(backoff(retries))
+            retries += 1
+
+_indexer = None
+_indexer_pid = None
+_indexer_lock = threading.Lock()
+
+def get_local_indexer():
+    """
+    Returns this process's indexer. Its thread does not survive a fork, so a
+    forked worker child starts its own.
+    """
+    global _indexer, _indexer_pid
+    if _indexer is None or _indexer_pid != os.getpid():
+        with _indexer_lock:
+            if _indexer is None or _indexer_pid != os.getpid():
+                config = current_app.config
+                _indexer = LocalIndexer(config['INDEX_LOCAL_MAX_PENDING'], config['INDEX_LOCAL_QUEUE_TIMEOUT'])
+                _indexer_pid = os.getpid()
+    return _indexer
@@ -0,0 +1,101 @@
+"""
+Prometheus metrics, exported in the text format by GET /metrics.
+
+The histograms are fed by app/tracing.py, the rate limiter's counter by
+app/rate_limit.py and the circuit breaker counters by app/circuit_breaker.py.
+Queue depths are read from Redis and the broker when /metrics is scraped
+(QueueDepthCollector); they are shared by all processes, so only the web
+exporter reports them.
+Web and worker processes each keep their own samples; with several processes
+per host (gunicorn workers, prefork Celery children) set PROMETHEUS_MULTIPROC_DIR to a directory shared by them
+before start-up, and /metrics (or the worker exporter on METRICS_WORKER_PORT)
+aggregates all of them.
+"""
+import logging
+import os
+from flask import Blueprint, Response
+from prometheus_client import (
+    CONTENT_TYPE_LATEST, REGISTRY, CollectorRegistry, Counter, Histogram, generate_latest, multiprocess, start_http_server
+)
+from prometheus_client.core import GaugeMetricFamily
+
+logger = logging.getLogger(__name__)
+
+# LLM calls and bulk jobs take far longer than the default buckets allow for.
+BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300)
+
+REQUEST_DURATION = Histogram(
+    "http_request_duration_seconds", "HTTP request duration",
+    ["endpoint", "method", "status", "tenant"], buckets=BUCKETS
+)
+TASK_DURATION = Histogram(
+    "celery_task_duration_seconds", "Celery task run time",
+    ["task", "agent", "tenant", "state"], buckets=BUCKETS
+)
+TASK_QUEUE_WAIT = Histogram(
+    "celery_task_queue_wait_seconds", "Time from publishing a task to a worker starting it",
+    ["task", "agent"], buckets=BUCKETS
+)
+DEPENDENCY_DURATION = Histogram(
+    "dependency_call_duration_seconds", "Duration of calls to external dependencies",
+    ["dependency", "operation", "agent", "tenant", "outcome"], buckets=BUCKETS
+)
+RATE_LIMITED = Counter(
+    "rate_limited_requests", "Requests rejected by the rate limiter, by the quota they exceeded",
+    ["quota", "tenant"]
+)
+CIRCUIT_TRIPS = Counter(
+    "circuit_breaker_trips", "Times a tenant's circuit breaker for a dependency opened",
+    ["dependency", "tenant"]
+)
+CIRCUIT_REJECTED = Counter(
+    "circuit_breaker_rejected_calls", "Calls to a dependency not made because its circuit breaker was open",
+    ["dependency", "tenant"]
+)
+
+class QueueDepthCollector:
+    """
+    Tasks waiting per agent queue: each tenant's fair-share backlog by priority,
+    and the messages already in the broker queue.
+    """
+
+    def collect(self):
+        from app import fair_share  # Avoid loading Celery's broker code at import time
+        backlog = GaugeMetricFamily(
+            "agent_queue_depth", "Tasks waiting in a tenant's fair-share backlog",
+            labels=["tenant", "agent", "priority"]
+        )
+        for (queue, tenant_id, priority), count in sorted(fair_share.backlog_depths().items()):
+            backlog.add_metric([tenant_id, queue, str(priority)], count)
+        yield backlog
+        broker = GaugeMetricFamily("agent_broker_queue_depth", "Messages waiting in an agent queue of the broker", labels=["agent"])
+        try:
+            depths = fair_share.broker_depths()
+        except Exception:
+            # An unreachable broker must not fail the whole scrape.
+            logger.exception("Failed to read the broker queue depths")
+            depths = {}
+        for queue, depth in sorted(depths.items()):
+            broker.add_metric([queue], depth)
+        yield broker
+
+QUEUE_REGISTRY = CollectorRegistry(auto_describe=False)
+QUEUE_REGISTRY.register(QueueDepthCollector())
+
+def get_registry():
+    """The registry to export: this process's, or every process's in multiprocess mode."""
+    if "PROMETHEUS_MULTIPROC_DIR" not in os.environ:
+        return REGISTRY
+    registry = CollectorRegistry()
+    multiprocess.MultiProcessCollector(registry)
+    return registry
+
+def start_exporter(port):
+    """Serves /metrics from a Celery worker, which has no web server of its own."""
+    start_http_server(port, registry=get_registry())
+
+metrics_bp = Blueprint('metrics', __name__)
+
+@metrics_bp.route('/metrics', methods=['GET'])
+def metrics():
+    return Response(generate_latest(get_registry()) + generate_latest(QUEUE_REGISTRY), mimetype=CONTENT_TYPE_LATEST)
@@ -1,9 +1,11 @@
+from sqlalchemy.orm import joinedload, selectinload
 from app import db
 
 class Tenant(db.Model):
     __tablename__ = 'tenants'
     id = db.Column(db.Integer, primary_key=True)
     name = db.Column(db.String(100), unique=True, nullable=False)
+    chain_run_ttl_seconds = db.Column(db.Integer, nullable=True)  # chain run retention; NULL = CHAIN_RUN_TTL_SECONDS
 
     # Change to one-to-many for flexible configuration
     email_configs = db.relationship("EmailAgentConfig", backref="tenant", cascade="all, delete-orphan")
@@ -13,8 +15,22 @@ class Tenant(db.Model):
     # One-to-many relationship for agent chains
     agent_chains = db.relationship("AgentChain", backref="tenant", cascade="all, delete-orphan")
 
+    @classmethod
+    def get_with_children(cls, tenant_id):
+        """
+        Loads a tenant with its configs, chains and chain steps eagerly (one
+        query per table), so the delete cascade does not lazy-load each chain.
+        """
+        return cls.query.options(
+            selectinload(cls.email_configs),
+            selectinload(cls.doc_sum_configs),
+            selectinload(cls.sfdc_configs),
+            selectinload(cls.agent_chains).selectinload(AgentChain.steps)
+        ).filter_by(id=tenant_id).first()
+
 class EmailAgentConfig(db.Model):
     __tablename__ = 'email_agent_config'
+    __table_args__ = (db.Index('ix_email_agent_config_tenant_id_is_global', 'tenant_id', 'is_global'),)
     id = db.Column(db.Integer, primary_key=True)
     tenant_id = db.Column(db.Integer, db.ForeignKey('tenants.id'), nullable=True)  # nullable for global configs
     smtp_server = db.Column(db.String(255), nullable=False)
@@ -25,6 +41,7 @@ class EmailAgentConfig(db.Model):
 
 class DocumentSummarizerConfig(db.Model):
     __tablename__ = 'document_summarizer_config'
+    __table_args__ = (db.Index('ix_document_summarizer_config_tenant_id_is_global', 'tenant_id', 'is_global'),)
     id = db.Column(db.Integer, primary_key=True)
     tenant_id = db.Column(db.Integer, db.ForeignKey('tenants.id'), nullable=True)
     summarizer_setting = db.Column(db.String(255), nullable=False)
@@ -32,6 +49,7 @@ class DocumentSummarizerConfig(db.Model):
 
 class SFDCConfig(db.Model):
     __tablename__ = 'sfdc_config'
+    __table_args__ = (db.Index('ix_sfdc_config_tenant_id_is_global', 'tenant_id', 'is_global'),)
     id = db.Column(db.Integer, primary_key=True)
     tenant_id = db.Column(db.Integer, db.ForeignKey('tenants.id'), nullable=True)
     sfdc_instance_url = db.Column(db.String(255), nullable=False)
@@ -43,14 +61,34 @@ class SFDCConfig(db.Model):
 class AgentChain(db.Model):
     __tablename__ = 'agent_chain'
     id = db.Column(db.Integer, primary_key=True)
-    tenant_id = db.Column(db.Integer, db.ForeignKey('tenants.id'), nullable=False)
+    tenant_id = db.Column(db.Integer, db.ForeignKey('tenants.id'), nullable=False, index=True)
     name = db.Column(db.String(100), nullable=False)
     steps = db.relationship('AgentChainStep', backref='chain', order_by='AgentChainStep.step_order', cascade="all, delete-orphan")
 
+    @classmethod
+    def get_with_steps(cls, chain_id, tenant_id=None):
+        """
+        Loads a chain (optionally scoped to a tenant) together with its steps and
+        tenant in a single query.
+        """
+        query = cls.query.options(joinedload(cls.steps), joinedload(cls.tenant)).filter_by(id=chain_id)
+        if tenant_id is not None:
+            query = query.filter_by(tenant_id=tenant_id)
+        return query.first()
+
 class AgentChainStep(db.Model):
     __tablename__ = 'agent_chain_step'
+    __table_args__ = (db.Index('ix_agent_chain_step_agent_chain_id_step_order', 'agent_chain_id', 'step_order'),)
     id = db.Column(db.Integer, primary_key=True)
     agent_chain_id = db.Column(db.Integer, db.ForeignKey('agent_chain.id'), nullable=False)
     step_order = db.Column(db.Integer, nullable=False)
     agent_name = db.Column(db.String(50), nullable=False)  # 'doc_sum', 'sfdc', or 'email'
     condition = db.Column(db.String(255), nullable=True)   # Optional conditional expression
+    depends_on = db.Column(db.String(255), nullable=True)  # Comma-separated step_orders; NULL = previous step
+
+    @property
+    def dependencies(self):
+        """Step orders this step waits for, or None to wait for the previous step."""
+        if self.depends_on is None:
+            return None
+        return [int(order) for order in self.depends_on.split(",") if order]
@@ -0,0 +1,78 @@
+"""
+Runs blocking calls off the event loop when the app is served by gevent.
+
+Under `gunicorn -c gunicorn.conf.py run:app` each request is a greenlet, so
+network waits (Redis, the LLM API, SMTP) yield to other requests, but a call
+that blocks inside C code, such as Chroma's DuckDB and HNSW queries, would
+stall every request of the worker process. Such calls go through run(), which
+executes them on a bounded pool of native threads: OFFLOAD_MAX_THREADS run at
+once and up to OFFLOAD_MAX_PENDING more wait, beyond that Overloaded is raised
+and the API answers 503 instead of queueing without limit. Without gevent
+(Flask's dev server, Celery workers) the caller already owns a thread and
+run() calls the function directly. Callers that must not run concurrently
+(the embedded Chroma store) serialize themselves with a native_lock().
+"""
+import os
+import threading
+from flask import current_app
+
+class Overloaded(Exception):
+    """Raised when too many offloaded calls are already running or waiting."""
+
+def gevent_active() -> bool:
+    """True if gevent has monkey-patched this process (gevent serving mode)."""
+    try:
+        from gevent import monkey
+    except ImportError:
+        return False
+    return monkey.is_module_patched("threading")
+
+def native_thread_class():
+    """
+    threading.Thread, or the unpatched original under gevent, for threads that
+    must run in parallel with the hub (such as the LLM client's event loop).
+    """
+    if gevent_active():
+        from gevent import monkey
+        return monkey.get_original("threading", "Thread")
+    return threading.Thread
+
+def native_lock():
+    """
+    A lock between native threads, also under gevent, where threading.Lock
+    would only coordinate greenlets of the hub's thread.
+    """
+    if gevent_active():
+        from gevent import monkey
+        return monkey.get_original("threading", "Lock")()
+    return threading.Lock()
+
+_pool = None
+_slots = None
+_pool_pid = None
+_pool_lock = threading.Lock()
+
+def _get_pool():
+    # The pool's threads do not survive a fork, so each worker builds its own.
+    global _pool, _slots, _pool_pid
+    if _pool is None or _pool_pid != os.getpid():
+        with _pool_lock:
+            if _pool is None or _pool_pid != os.getpid():
+                from gevent.threadpool import ThreadPoolExecutor
+                config = current_app.config
+                _pool = ThreadPoolExecutor(config['OFFLOAD_MAX_THREADS'])
+                _slots = threading.BoundedSemaphore(config['OFFLOAD_MAX_THREADS'] + config['OFFLOAD_MAX_PENDING'])
+                _pool_pid = os.getpid()
+    return _pool, _slots
+
+def run(func, *args, **kwargs):
+    """Calls func(*args, **kwargs) on the offload pool and waits for its result."""
+    if not gevent_active():
+        return func(*args, **kwargs)
+    pool, slots = _get_pool()
+    if not slots.acquire(blocking=False):
+        raise Overloaded("Too many vector store calls in flight")
+    try:
+        return pool.submit(func, *args, **kwargs).result()
+    finally:
+        slots.release()
@@ -0,0 +1,63 @@
+"""
+Celery queue layout: one queue per agent type, so a backlog of one kind of
+work (e.g. summarizations) never sits in front of another (emails, leads),
+and workers can be dedicated to queues with `celery worker -Q email,sfdc`.
+Within a queue, messages are consumed by priority: interactive requests and
+chain steps before bulk batches. With the Redis broker lower numbers are
+consumed first.
+"""
+from kombu import Queue
+
+PRIORITY_HIGH = 0    # single interactive requests and chain steps
+PRIORITY_NORMAL = 3
+PRIORITY_LOW = 6     # bulk batches and map-reduce chunks
+PRIORITY_STEPS = [0, 3, 6, 9]
+
+QUEUES = ("email", "doc_sum", "sfdc", "index", "chain")
+
+# Task name -> (queue, default priority)
+TASK_ROUTES = {
+    "app.tasks.send_email_task": ("email", PRIORITY_HIGH),
+    "app.tasks.send_email_batch_task": ("email", PRIORITY_LOW),
+    "app.tasks.summarize_document_task": ("doc_sum", PRIORITY_NORMAL),
+    "app.tasks.summarize_chunk_task": ("doc_sum", PRIORITY_LOW),
+    "app.tasks.reduce_summaries_task": ("doc_sum", PRIORITY_LOW),
+    "app.tasks.create_lead_task": ("sfdc", PRIORITY_HIGH),
+    "app.tasks.create_leads_batch_task": ("sfdc", PRIORITY_LOW),
+    "app.tasks.index_documents_task": ("index", PRIORITY_LOW),
+}
+
+# Worker profiles (WORKER_PROFILE, see celery_worker.py): the queues a worker
+# consumes and the modules it imports before forking its pool. Everything else
+# is loaded on first use, so an email worker never imports chromadb, aiohttp
+# or requests. "all" consumes every queue.
+WORKER_PROFILES = {
+    "all": (None, ("app.llm_client", "app.sfdc", "chromadb")),
+    "email": (("email",), ()),
+    "sfdc": (("sfdc",), ("app.sfdc",)),
+    "llm": (("doc_sum", "chain"), ("app.llm_client",)),
+    "index": (("index",), ("app.llm_client", "chromadb")),
+}
+
+# Chain steps run on the queue of the agent they execute.
+AGENT_QUEUES = {"doc_sum": "doc_sum", "sfdc": "sfdc", "email": "email"}
+
+def route_task(name, args, kwargs, options, task=None, **kw):
+    if name == "app.tasks.run_chain_step_task":
+        step = kwargs.get("step") or args[-1]
+        return {"queue": AGENT_QUEUES.get(step["agent_name"], "chain"), "priority": PRIORITY_HIGH}
+    route = TASK_ROUTES.get(name)
+    if route is None:
+        return None
+    queue, priority = route
+    return {"queue": queue, "priority": priority}
+
+def configure_queues(celery):
+    celery.conf.task_queues = [Queue(name) for name in QUEUES] + [Queue(celery.conf.task_default_queue)]
+    celery.conf.task_routes = (route_task,)
+    celery.conf.task_default_priority = PRIORITY_NORMAL
+    celery.conf.broker_transport_options = {
+        "priority_steps": PRIORITY_STEPS,
+        "sep": ":",
+        "queue_order_strategy": "priority",
+    }
@@ -0,0 +1,254 @@
+"""
+Tenant rate limiting and quota accounting, shared by all web replicas.
+
+Every quota is a token bucket in Redis that holds up to `count` units and
+refills at count/seconds units per second. A request is checked against all
+of its quotas, and debited from them, in one Lua call that also reads the
+tenant's overrides. The check is all or nothing: a rejected request uses up
+no quota. The quotas are:
+
+- "requests": every API request, cost 1. Requests without a tenant are
+  limited per client address instead.
+- endpoint quotas: views declare a name with @limit("search_document"),
+  cost 1 per request.
+- "llm_tokens": the estimated LLM tokens of summarization and embedding
+  requests, declared with @limit(..., llm_tokens=<estimate>). These
+  requests are turned away here, before any work reaches Celery.
+
+Only the API blueprints are limited; admin, auth and /metrics are not.
+Requests are charged to the tenant their view acts for (see
+tracing.request_tenant); a tenant id that is not an existing tenant is
+rejected with 404 before any quota is used, so made-up ids cannot be used to
+get fresh buckets. Requests to JWT-protected blueprints are only charged once
+the token has been verified.
+Defaults come from RATE_LIMITS ("quota=count/seconds"). A quota without a
+default or a tenant override is unlimited. Per-tenant overrides are kept in
+Redis and set by an admin endpoint. Rejected requests get 429 with
+Retry-After. Limited responses carry X-RateLimit-Limit, -Remaining and
+-Reset headers for the most constrained quota, which is named in
+X-RateLimit-Quota. If Redis is unavailable, requests are let through.
+"""
+import logging
+import math
+import re
+from collections import namedtuple
+from flask import current_app, g, jsonify, request
+from flask_jwt_extended import verify_jwt_in_request
+from app.metrics import RATE_LIMITED
+from app.redis_client import delete_matching, get_redis
+from app.tracing import request_tenant, request_tenant_id
+
+logger = logging.getLogger(__name__)
+
+# Hash tags keep a subject's keys in one cluster slot, as the script needs.
+BUCKET_KEY = "ratelimit:{{{subject}}}:{quota}"
+OVERRIDES_KEY = "ratelimit:{{{subject}}}:overrides"
+
+LIMITED_BLUEPRINTS = ("api", "chain")
+# Blueprints whose views all require a JWT
+JWT_BLUEPRINTS = ("chain",)
+
+SPEC_PATTERN = re.compile(r"^\d+(\.\d+)?/\d+(\.\d+)?$")
+
+# KEYS[1] holds the subject's overrides, KEYS[2..] one bucket per quota.
+# ARGV holds name, default "count/seconds" ('' if none) and cost per bucket.
+# Returns {allowed, {name, count, seconds, remaining, reset, retry_after}...}
+# for the quotas that are limited.
+_CHECK_SCRIPT = """
+local now = redis.call('TIME')
+now = tonumber(now[1]) + tonumber(now[2]) / 1000000
+local quotas = {}
+local allowed = 1
+for i = 2, #KEYS do
+    local n = (i - 2) * 3
+    local name, cost = ARGV[n + 1], tonumber(ARGV[n + 3])
+    local spec = redis.call('HGET', KEYS[1], name) or ARGV[n + 2]
+    if spec ~= '' then
+        local count, seconds = string.match(spec, '^([%d.]+)/([%d.]+)$')
+        count, seconds = tonumber(count), tonumber(seconds)
+        local rate = count / seconds
+        local bucket = redis.call('HMGET', KEYS[i], 'tokens', 'ts', 'count')
+        local tokens = tonumber(bucket[1]) or count
+        local elapsed = math.max(0, now - (tonumber(bucket[2]) or now))
+        -- A changed limit takes effect at once: the bucket gains (or loses) the difference.
+        tokens = tokens + count - (tonumber(bucket[3]) or count)
+        tokens = math.min(count, tokens + elapsed * rate)
+        if tokens < cost then
+            allowed = 0
+        end
+        table.insert(quotas, {KEYS[i], name, count, seconds, rate, tokens, cost})
+    end
+end
+local result = {allowed}
+for _, q in ipairs(quotas) do
+    local key, name, count, seconds, rate, tokens, cost = q[1], q[2], q[3], q[4], q[5], q[6], q[7]
+    local retry_after = 0
+    if allowed == 1 then
+        tokens = tokens - cost
+    elseif tokens < cost then
+        retry_after = (cost - tokens) / rate
+    end
+    redis.call('HSET', key, 'tokens', tostring(tokens), 'ts', tostring(now), 'count', tostring(count))
+    -- An idle bucket is full again after `seconds`.
+    redis.call('EXPIRE', key, math.ceil(seconds) + 1)
+    table.insert(result, {
+        name, tostring(count), tostring(seconds), tostring(tokens),
+        tostring((count - tokens) / rate), tostring(retry_after)
+    })
+end
+return result
+"""
+
+_check = None
+
+Quota = namedtuple("Quota", ["name", "limit", "seconds", "remaining", "reset", "retry_after"])
+
+def valid_spec(spec):
+    """True for a positive "count/seconds" limit."""
+    if not isinstance(spec, str) or not SPEC_PATTERN.match(spec):
+        return False
+    count, seconds = (float(part) for part in spec.split("/"))
+    return count > 0 and seconds > 0
+
+def estimate_tokens(text):
+    """Rough LLM token count of a text (about four characters per token)."""
+    return len(text) // 4 + 1 if isinstance(text, str) else 0
+
+def limit(name, llm_tokens=None):
+    """
+    Declares a view's endpoint quota and, for views that call the LLM, a
+    function estimating the tokens a request will use from its JSON body.
+    """
+    def decorator(view):
+        view.rate_limit = (name, llm_tokens)
+        return view
+    return decorator
+
+def check(subject, costs):
+    """
+    Debits `costs` ([(quota, cost)]) from the subject's quotas if all of them
+    allow it. Returns (allowed, [Quota]) for the quotas that are limited.
+    """
+    global _check
+    redis_client = get_redis()
+    if _check is None:
+        _check = redis_client.register_script(_CHECK_SCRIPT)
+    defaults = current_app.config['RATE_LIMITS']
+    keys = [OVERRIDES_KEY.format(subject=subject)]
+    args = []
+    for quota, cost in costs:
+        keys.append(BUCKET_KEY.format(subject=subject, quota=quota))
+        args.extend([quota, defaults.get(quota, ""), cost])
+    allowed, *rows = _check(keys=keys, args=args)
+    quotas = []
+    for name, *values in rows:
+        count, seconds, remaining, reset, retry_after = (float(value) for value in values)
+        quotas.append(Quota(name.decode(), count, seconds, remaining, reset, retry_after))
+    return bool(allowed), quotas
+
+def get_overrides(tenant_id):
+    overrides = get_redis().hgetall(OVERRIDES_KEY.format(subject=f"tenant:{tenant_id}"))
+    return {name.decode(): spec.decode() for name, spec in overrides.items()}
+
+def set_overrides(tenant_id, limits):
+    """
+    Sets the tenant's quotas from {quota: "count/seconds"}; None restores the
+    default. Raises ValueError for a malformed limit.
+    """
+    for name, spec in limits.items():
+        if spec is not None and not valid_spec(spec):
+            raise ValueError(f'{name}: expected "count/seconds", got {spec!r}')
+    key = OVERRIDES_KEY.format(subject=f"tenant:{tenant_id}")
+    pipe = get_redis().pipeline()
+    for name, spec in limits.items():
+        if spec is None:
+            pipe.hdel(key, name)
+        else:
+            pipe.hset(key, name, spec)
+    pipe.execute()
+
+def clear_tenant(tenant_id):
+    """Deletes the tenant's overrides and buckets, e.g. when the tenant is deleted."""
+    # The hash tag braces are literal in a SCAN pattern.
+    delete_matching(BUCKET_KEY.format(subject=f"tenant:{tenant_id}", quota="*"))
+
+def get_usage(tenant_id):
+    """The tenant's effective limits and what remains of each, without using any."""
+    names = set(current_app.config['RATE_LIMITS']) | set(get_overrides(tenant_id))
+    _, quotas = check(f"tenant:{tenant_id}", [(name, 0) for name in sorted(names)])
+    return {
+        quota.name: {
+            "limit": quota.limit,
+            "seconds": quota.seconds,
+            "remaining": math.floor(quota.remaining),
+            "reset": math.ceil(quota.reset),
+        }
+        for quota in quotas
+    }
+
+# Flask
+
+def _request_costs():
+    costs = [("requests", 1)]
+    view = current_app.view_functions.get(request.endpoint)
+    name, llm_tokens = getattr(view, "rate_limit", (None, None))
+    if name:
+        costs.append((name, 1))
+    if llm_tokens:
+        data = request.get_json(silent=True) if request.is_json else None
+        costs.append(("llm_tokens", llm_tokens(data if isinstance(data, dict) else {})))
+    return costs
+
+def _before_request():
+    if not current_app.config['RATE_LIMIT_ENABLED'] or request.method == "OPTIONS":
+        return None
+    if request.blueprint not in LIMITED_BLUEPRINTS:
+        return None
+    if request.blueprint in JWT_BLUEPRINTS:
+        try:
+            verify_jwt_in_request()
+        except Exception:
+            return None  # Rejected by the view without using quota
+    tenant = request_tenant()
+    try:
+        tenant_id = request_tenant_id()
+        if tenant and tenant_id is None:
+            return jsonify({"error": f"Unknown tenant: {tenant}"}), 404
+        tenant = "" if tenant_id is None else str(tenant_id)
+        subject = f"tenant:{tenant}" if tenant else f"ip:{request.remote_addr}"
+        costs = _request_costs()
+        allowed, quotas = check(subject, costs)
+    except Exception:
+        logger.exception("Rate limit check failed")
+        return None
+    g.rate_limit_quotas = quotas
+    if allowed:
+        return None
+
+    cost = dict(costs)
+    exceeded = [quota for quota in quotas if quota.retry_after > 0]
+    quota = max(exceeded, key=lambda quota: quota.retry_after)
+    RATE_LIMITED.labels(quota.name, tenant).inc()
+    if cost[quota.name] > quota.limit:
+        # Would never fit, however long the caller waits.
+        return jsonify({
+            "error": f"Request needs {cost[quota.name]} {quota.name}; the quota allows "
+                     f"{quota.limit:g} per {quota.seconds:g} seconds"
+        }), 429
+    response = jsonify({"error": f"Rate limit exceeded for {quota.name}"})
+    response.headers["Retry-After"] = str(math.ceil(quota.retry_after))
+    return response, 429
+
+def _after_request(response):
+    quotas = g.pop("rate_limit_quotas", None)
+    if quotas:
+        quota = min(quotas, key=lambda quota: quota.remaining / quota.limit)
+        response.headers["X-RateLimit-Quota"] = quota.name
+        response.headers["X-RateLimit-Limit"] = f"{quota.limit:g}"
+        response.headers["X-RateLimit-Remaining"] = str(max(0, math.floor(quota.remaining)))
+        response.headers["X-RateLimit-Reset"] = str(math.ceil(quota.reset))
+    return response
+
+def init_app(app):
+    app.before_request(_before_request)
+    app.after_request(_after_request)
@@ -0,0 +1,32 @@
+import redis
+from flask import current_app
+
+_clients = {}
+
+def get_redis():
+    """
+    Returns a process-wide Redis client for the configured REDIS_URL.
+    The underlying connection pool is shared by all callers in the process.
+    """
+    url = current_app.config['REDIS_URL']
+    client = _clients.get(url)
+    if client is None:
+        client = _clients[url] = redis.Redis.from_url(url)
+    return client
+
+def delete_matching(pattern, batch_size=500):
+    """
+    Deletes every key matching a SCAN pattern, in batches, without blocking
+    Redis as KEYS would. Returns the number of keys deleted.
+    """
+    redis_client = get_redis()
+    deleted = 0
+    batch = []
+    for key in redis_client.scan_iter(match=pattern, count=batch_size):
+        batch.append(key)
+        if len(batch) >= batch_size:
+            deleted += redis_client.delete(*batch)
+            batch = []
+    if batch:
+        deleted += redis_client.delete(*batch)
+    return deleted
@@ -1,12 +1,46 @@
-from flask import Blueprint, request, jsonify
-from app.tasks import send_email_task, summarize_document_task, create_lead_task
+import json
+import time
+import uuid
+from flask import Blueprint, request, jsonify, current_app, url_for, Response, stream_with_context
+from app.tasks import (
+    send_email_task, send_email_batch_task, summarize_document_task, create_lead_task, create_leads_batch_task,
+    index_documents_task
+)
+from app import circuit_breaker, index_jobs, offload, rate_limit, search_cache, summary_jobs, fair_share
 from celery.result import AsyncResult
+from celery.states import READY_STATES
 from app import celery
-from app.chroma import index_document, search_document
+from app.chroma import index_document, search_document, shared_store
+from app.local_indexer import get_local_indexer
+from app.task_status import get_statuses, watch as watch_tasks
 
 bp = Blueprint('api', __name__)
 
+def _idempotency_key(data):
+    """
+    Caller-supplied idempotency key (Idempotency-Key header or "idempotency_key"
+    field). Without one, the task derives a key from its payload.
+    """
+    return request.headers.get('Idempotency-Key') or data.get('idempotency_key')
+
+# Estimated LLM tokens per request, charged to the tenant's llm_tokens quota.
+
+def _summary_tokens(data):
+    return rate_limit.estimate_tokens(data.get("document_text")) + current_app.config['SUMMARIZER_MAX_TOKENS']
+
+def _document_tokens(data):
+    return rate_limit.estimate_tokens(data.get("document_text"))
+
+def _query_tokens(data):
+    return rate_limit.estimate_tokens(data.get("query_text"))
+
+def _bulk_tokens(data):
+    # The NDJSON body is streamed, so estimate from its size. Uploads without a
+    # Content-Length are rejected by the view.
+    return (request.content_length or 0) // 4
+
 @bp.route('/send_email', methods=['POST'])
+@rate_limit.limit('send_email')
 def api_send_email():
     """
     Expected JSON:
@@ -14,7 +48,8 @@ def api_send_email():
         "tenant_id": 1,
         "recipient": "recipient@example.com",
         "subject": "Test Email",
-        "body": "Email content here..."
+        "body": "Email content here...",
+        "idempotency_key": "..."   // optional, or the Idempotency-Key header
     }
     """
     data = request.get_json()
@@ -22,25 +57,126 @@ def api_send_email():
     recipient = data.get('recipient')
     subject = data.get('subject')
     body = data.get('body')
-    task = send_email_task.delay(tenant_id, recipient, subject, body)
+    refused = circuit_breaker.refuse(tenant_id, ["smtp"])
+    if refused:
+        return refused
+    task = fair_share.submit(send_email_task.s(tenant_id, recipient, subject, body, idempotency_key=_idempotency_key(data)), tenant_id)
+    return jsonify({'task_id': task.id}), 202
+
+@bp.route('/send_email_batch', methods=['POST'])
+@rate_limit.limit('send_email_batch')
+def api_send_email_batch():
+    """
+    Sends many emails for a tenant over a single pooled SMTP session.
+    Expected JSON:
+    {
+        "tenant_id": 1,
+        "messages": [
+            {"recipient": "recipient@example.com", "subject": "Test Email", "body": "Email content here..."},
+            ...
+        ],
+        "idempotency_key": "..."   // optional, or the Idempotency-Key header
+    }
+    """
+    data = request.get_json()
+    tenant_id = data.get('tenant_id')
+    messages = data.get('messages')
+    if not tenant_id or not isinstance(messages, list) or not messages:
+        return jsonify({'error': 'tenant_id and a non-empty messages list are required'}), 400
+    max_messages = current_app.config['EMAIL_BATCH_MAX_MESSAGES']
+    if len(messages) > max_messages:
+        return jsonify({'error': f'At most {max_messages} messages per batch'}), 400
+    if not all(isinstance(message, dict) for message in messages):
+        return jsonify({'error': 'Each message must be an object'}), 400
+    refused = circuit_breaker.refuse(tenant_id, ["smtp"])
+    if refused:
+        return refused
+    task = fair_share.submit(send_email_batch_task.s(tenant_id, messages, idempotency_key=_idempotency_key(data)), tenant_id)
     return jsonify({'task_id': task.id}), 202
 
 @bp.route('/summarize_document', methods=['POST'])
+@rate_limit.limit('summarize_document', llm_tokens=_summary_tokens)
 def api_summarize_document():
     """
     Expected JSON:
     {
         "tenant_id": 1,
-        "document_text": "Your document text..."
+        "document_text": "Your document text...",
+        "idempotency_key": "..."   // optional, or the Idempotency-Key header
     }
     """
     data = request.get_json()
     tenant_id = data.get('tenant_id')
     document_text = data.get('document_text')
-    task = summarize_document_task.delay(tenant_id, document_text)
+    task = fair_share.submit(summarize_document_task.s(tenant_id, document_text, idempotency_key=_idempotency_key(data)), tenant_id)
     return jsonify({'task_id': task.id}), 202
 
+@bp.route('/summarize_document/stream', methods=['POST'])
+@rate_limit.limit('summarize_document', llm_tokens=_summary_tokens)
+def api_summarize_document_stream():
+    """
+    Summarizes a long document with map-reduce: chunks are summarized in parallel and
+    the partial summaries are reduced into one. Partial results are streamed by
+    GET /api/v1/summaries/<job_id>/events (server-sent events).
+    Expected JSON:
+    {
+        "tenant_id": 1,
+        "document_text": "Your long document text..."
+    }
+    """
+    data = request.get_json()
+    tenant_id = data.get('tenant_id')
+    document_text = data.get('document_text')
+    if not tenant_id or not document_text or not document_text.strip():
+        return jsonify({'error': 'tenant_id and document_text are required'}), 400
+    job_id = summary_jobs.start_summary_job(tenant_id, document_text)
+    return jsonify({
+        'job_id': job_id,
+        'status_url': url_for('api.summary_job_status', job_id=job_id),
+        'events_url': url_for('api.summary_job_events', job_id=job_id)
+    }), 202
+
+@bp.route('/summaries/<job_id>', methods=['GET'])
+def summary_job_status(job_id):
+    job = summary_jobs.get_job(job_id)
+    if not job:
+        return jsonify({'error': 'Summary job not found'}), 404
+    return jsonify(job)
+
+@bp.route('/summaries/<job_id>/events', methods=['GET'])
+def summary_job_events(job_id):
+    """
+    Server-sent events for a summary job: "started", one "partial" per chunk or
+    reduce batch, then "final" (or "error"). Reconnecting clients resume after
+    the Last-Event-ID they received.
+    """
+    if not summary_jobs.get_job(job_id):
+        return jsonify({'error': 'Summary job not found'}), 404
+    last_event_id = request.headers.get('Last-Event-ID', '0')
+    timeout = current_app.config['SUMMARY_SSE_TIMEOUT']
+
+    def generate(last_event_id):
+        deadline = time.monotonic() + timeout
+        while time.monotonic() < deadline:
+            events = summary_jobs.read_events(job_id, last_event_id, block_ms=15000)
+            if not events:
+                # Keeps proxies from closing an idle connection.
+                yield ": keep-alive\n\n"
+                continue
+            for event_id, event_type, data in events:
+                last_event_id = event_id
+                yield f"id: {event_id}\nevent: {event_type}\ndata: {json.dumps(data)}\n\n"
+                if event_type in summary_jobs.TERMINAL_EVENTS:
+                    return
+
+    return Response(
+        stream_with_context(generate(last_event_id)),
+        mimetype='text/event-stream',
+        headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'}
+    )
+
 @bp.route('/create_lead', methods=['POST'])
+@rate_limit.limit('create_lead')
 def api_create_lead():
     """
     Expected JSON:
@@ -50,13 +186,49 @@ def api_create_lead():
             "FirstName": "John",
             "LastName": "Doe",
             "Company": "Example Inc."
-        }
+        },
+        "idempotency_key": "..."   // optional, or the Idempotency-Key header
     }
     """
     data = request.get_json()
     tenant_id = data.get('tenant_id')
     lead_data = data.get('lead_data')
-    task = create_lead_task.delay(tenant_id, lead_data)
+    refused = circuit_breaker.refuse(tenant_id, ["salesforce"])
+    if refused:
+        return refused
+    task = fair_share.submit(create_lead_task.s(tenant_id, lead_data, idempotency_key=_idempotency_key(data)), tenant_id)
+    return jsonify({'task_id': task.id}), 202
+
+@bp.route('/create_leads_batch', methods=['POST'])
+@rate_limit.limit('create_leads_batch')
+def api_create_leads_batch():
+    """
+    Creates many leads for a tenant via the Salesforce Composite API, or a
+    Bulk API job for large batches. The task result reports each record as
+    created, failed or unknown ("success": null); resubmit only the failed ones,
+    as an unknown record may have been created.
+    Expected JSON:
+    {
+        "tenant_id": 1,
+        "leads": [
+            {"FirstName": "John", "LastName": "Doe", "Company": "Example Inc."},
+            ...
+        ],
+        "idempotency_key": "..."   // optional, or the Idempotency-Key header
+    }
+    """
+    data = request.get_json()
+    tenant_id = data.get('tenant_id')
+    leads = data.get('leads')
+    if not tenant_id or not isinstance(leads, list) or not leads:
+        return jsonify({'error': 'tenant_id and a non-empty leads list are required'}), 400
+    max_records = current_app.config['LEAD_BATCH_MAX_RECORDS']
+    if len(leads) > max_records:
+        return jsonify({'error': f'At most {max_records} leads per batch'}), 400
+    refused = circuit_breaker.refuse(tenant_id, ["salesforce"])
+    if refused:
+        return refused
+    task = fair_share.submit(create_leads_batch_task.s(tenant_id, leads, idempotency_key=_idempotency_key(data)), tenant_id)
     return jsonify({'task_id': task.id}), 202
 
 @bp.route('/task_status/<task_id>', methods=['GET'])
@@ -69,7 +241,104 @@ def task_status(task_id):
     }
     return jsonify(response)
 
+def _task_ids_error(task_ids, max_ids=None):
+    max_ids = max_ids or current_app.config['TASK_STATUS_MAX_IDS']
+    if not isinstance(task_ids, list) or not task_ids or not all(isinstance(task_id, str) for task_id in task_ids):
+        return 'task_ids must be a non-empty list of task ids'
+    if len(task_ids) > max_ids:
+        return f'At most {max_ids} task ids per request'
+    return None
+
+@bp.route('/task_status', methods=['POST'])
+def batch_task_status():
+    """
+    Returns the status of many tasks in one request.
+    Expected JSON:
+    {
+        "task_ids": ["id1", "id2", ...]
+    }
+    """
+    task_ids = (request.get_json() or {}).get('task_ids')
+    error = _task_ids_error(task_ids)
+    if error:
+        return jsonify({'error': error}), 400
+    return jsonify({'tasks': get_statuses(task_ids)})
+
+@bp.route('/task_status/watch', methods=['POST'])
+def watch_task_status():
+    """
+    Long poll: returns as soon as any watched task is in a state other than the
+    one the client last saw, with the status of each changed task. Returns an
+    empty "tasks" object when nothing changed within the timeout.
+    Expected JSON:
+    {
+        "task_ids": ["id1", "id2", ...],
+        "known": {"id1": "PENDING", "id2": "STARTED"},   // optional
+        "timeout": 30                                    // optional, seconds
+    }
+    """
+    data = request.get_json() or {}
+    task_ids = data.get('task_ids')
+    error = _task_ids_error(task_ids)
+    if error:
+        return jsonify({'error': error}), 400
+    known = data.get('known') or {}
+    max_timeout = current_app.config['TASK_STATUS_WATCH_TIMEOUT']
+    try:
+        timeout = min(float(data.get('timeout', max_timeout)), max_timeout)
+    except (TypeError, ValueError):
+        return jsonify({'error': 'timeout must be a number of seconds'}), 400
+    return jsonify({'tasks': watch_tasks(task_ids, known, max(timeout, 0))})
+
+@bp.route('/task_status/events', methods=['GET', 'POST'])
+def task_status_events():
+    """
+    Server-sent events for a set of tasks, given as ?task_ids=id1,id2,... (up to
+    TASK_STATUS_QUERY_MAX_IDS, as a longer request line would be refused) or,
+    for more, POSTed like /task_status/watch:
+    {
+        "task_ids": ["id1", "id2", ...]
+    }
+    A "status" event carries the statuses of the tasks that changed (all tasks
+    in the first event); the stream ends once every task is ready.
+    """
+    if request.method == 'POST':
+        task_ids = (request.get_json(silent=True) or {}).get('task_ids')
+        error = _task_ids_error(task_ids)
+    else:
+        task_ids = [task_id for task_id in request.args.get('task_ids', '').split(',') if task_id]
+        error = _task_ids_error(task_ids, current_app.config['TASK_STATUS_QUERY_MAX_IDS'])
+    if error:
+        return jsonify({'error': error}), 400
+    timeout = current_app.config['TASK_STATUS_SSE_TIMEOUT']
+
+    def generate():
+        known = {}
+        deadline = time.monotonic() + timeout
+        while time.monotonic() < deadline:
+            changed = watch_tasks(task_ids, known, min(15, deadline - time.monotonic()))
+            if not changed:
+                # Keeps proxies from closing an idle connection.
+                yield ": keep-alive\n\n"
+                continue
+            known.update((task_id, status['status']) for task_id, status in changed.items())
+            yield f"event: status\ndata: {json.dumps(changed)}\n\n"
+            if all(state in READY_STATES for state in known.values()):
+                return
+
+    return Response(
+        stream_with_context(generate()),
+        mimetype='text/event-stream',
+        headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'}
+    )
+
+def _overloaded(error):
+    response = jsonify({"error": str(error)})
+    response.headers['Retry-After'] = '1'
+    return response, 503
+
 @bp.route('/index_document', methods=['POST'])
+@rate_limit.limit('index_document', llm_tokens=_document_tokens)
 def api_index_document():
     """
     Expected JSON:
@@ -83,10 +352,14 @@ def api_index_document():
     tenant_id = data.get("tenant_id")
     document_id = data.get("document_id")
     document_text = data.get("document_text")
-    result = index_document(tenant_id, document_id, document_text)
+    try:
+        result = index_document(tenant_id, document_id, document_text)
+    except offload.Overloaded as e:
+        return _overloaded(e)
     return jsonify(result)
 
 @bp.route('/search_document', methods=['POST'])
+@rate_limit.limit('search_document', llm_tokens=_query_tokens)
 def api_search_document():
     """
     Expected JSON:
@@ -100,5 +373,128 @@ def api_search_document():
     tenant_id = data.get("tenant_id")
     query_text = data.get("query_text")
     n_results = data.get("n_results", 3)
-    result = search_document(tenant_id, query_text, n_results)
+    try:
+        result = search_document(tenant_id, query_text, n_results)
+    except offload.Overloaded as e:
+        return _overloaded(e)
     return jsonify(result)
+
+@bp.route('/search_cache/stats', methods=['GET'])
+def api_search_cache_stats():
+    """
+    Returns search cache hit/miss counters, overall or for ?tenant_id=1.
+    """
+    return jsonify(search_cache.get_stats(request.args.get('tenant_id', type=int)))
+
+def _iter_ndjson_lines(stream, max_line_bytes):
+    """
+    Yields (line_number, line) from a binary stream without reading it whole.
+    Lines longer than max_line_bytes are yielded as None (and skipped).
+    """
+    line_number = 0
+    while True:
+        line = stream.readline(max_line_bytes + 1)
+        if not line:
+            return
+        line_number += 1
+        if len(line) > max_line_bytes and not line.endswith(b"\n"):
+            # Discard the rest of the oversized line.
+            while line and not line.endswith(b"\n"):
+                line = stream.readline(max_line_bytes + 1)
+            yield line_number, None
+            continue
+        if line.strip():
+            yield line_number, line
+
+@bp.route('/index_documents_bulk', methods=['POST'])
+@rate_limit.limit('index_documents_bulk', llm_tokens=_bulk_tokens)
+def api_index_documents_bulk():
+    """
+    Bulk-indexes documents from an NDJSON body (Content-Type: application/x-ndjson)
+    or an uploaded NDJSON file (multipart/form-data, field "file"), one document per line:
+        {"document_id": "doc1", "document_text": "..."}
+    The tenant is given as ?tenant_id=1 (or a "tenant_id" form field).
+    The upload is streamed and dispatched to Celery in bounded batches, so memory use
+    does not depend on the upload size. With the embedded vector store (no
+    CHROMA_SERVER_HOST) the batches are queued for a background thread of this
+    process instead, where the searches run (see app/local_indexer.py); if its
+    queue stays full the rest of the upload is refused with 503.
+    Progress is reported by GET /api/v1/index_jobs/<job_id>.
+    The llm_tokens quota is charged by the upload size, so a chunked upload
+    without a Content-Length is refused with 411.
+    """
+    if request.content_length is None:
+        return jsonify({'error': 'Content-Length is required'}), 411
+    config = current_app.config
+    tenant_id = request.args.get('tenant_id', type=int)
+    if request.mimetype == 'multipart/form-data':
+        tenant_id = tenant_id or request.form.get('tenant_id', type=int)
+        upload = request.files.get('file')
+        stream = upload.stream if upload else None
+    else:
+        stream = request.stream
+    if not tenant_id or stream is None:
+        return jsonify({'error': 'tenant_id and an NDJSON body or file are required'}), 400
+
+    job_id = uuid.uuid4().hex
+    index_jobs.create_job(job_id, tenant_id)
+    batch = []
+    batch_bytes = 0
+    # Only the errors the job keeps are held in memory; the rest are counted.
+    errors = []
+    error_count = 0
+    indexed_here = not shared_store()
+
+    def dispatch():
+        if indexed_here:
+            get_local_indexer().submit(job_id, tenant_id, batch)
+        else:
+            fair_share.submit(index_documents_task.s(job_id, tenant_id, batch), tenant_id)
+        index_jobs.record_dispatched(job_id, len(batch))
+
+    def error(line_number, message):
+        nonlocal error_count
+        error_count += 1
+        if len(errors) < index_jobs.MAX_ERRORS:
+            errors.append({"line": line_number, "error": message})
+
+    try:
+        for line_number, line in _iter_ndjson_lines(stream, config['INDEX_BULK_MAX_LINE_BYTES']):
+            if line is None:
+                error(line_number, "Document exceeds INDEX_BULK_MAX_LINE_BYTES")
+                continue
+            try:
+                document = json.loads(line)
+            except ValueError:
+                error(line_number, "Invalid JSON")
+                continue
+            if not isinstance(document, dict):
+                error(line_number, "Each line must be a JSON object")
+                continue
+            batch.append(document)
+            batch_bytes += len(line)
+            if len(batch) >= config['INDEX_BULK_BATCH_DOCUMENTS'] or batch_bytes >= config['INDEX_BULK_BATCH_BYTES']:
+                dispatch()
+                batch = []
+                batch_bytes = 0
+        if batch:
+            dispatch()
+    except offload.Overloaded as e:
+        # The batches already queued are still indexed; the job finishes with them.
+        index_jobs.add_errors(job_id, errors + [{"error": f"Upload stopped: {e}"}], total=error_count + 1)
+        index_jobs.mark_upload_complete(job_id)
+        return _overloaded(e)
+    index_jobs.add_errors(job_id, errors, total=error_count)
+    index_jobs.mark_upload_complete(job_id)
+
+    return jsonify({
+        'job_id': job_id,
+        'status_url': url_for('api.index_job_status', job_id=job_id)
+    }), 202
+
+@bp.route('/index_jobs/<job_id>', methods=['GET'])
+def index_job_status(job_id):
+    job = index_jobs.get_job(job_id)
+    if not job:
+        return jsonify({'error': 'Index job not found'}), 404
+    return jsonify(job)
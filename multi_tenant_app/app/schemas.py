@@ -1,5 +1,7 @@
-from pydantic import BaseModel, Field, constr
+from pydantic import BaseModel, Field, conint, constr, validator
 from typing import List, Optional, Literal, Dict, Any
+from app.conditions import compile_condition
+from app.chain_dag import plan_steps
 
 # Schemas for tenant setup
 
@@ -21,6 +23,7 @@ class TenantSetup(BaseModel):
     email_config: Optional[EmailConfig] = None
     doc_sum_config: Optional[DocSumConfig] = None
     sfdc_config: Optional[SFDCConfig] = None
+    chain_run_ttl_seconds: Optional[conint(gt=0)] = None  # chain run retention
 
 # Schemas for agent chain configuration
 
@@ -28,12 +31,26 @@ class AgentChainStep(BaseModel):
     step_order: int
     agent_name: Literal['doc_sum', 'sfdc', 'email']
     condition: Optional[str] = None  # Optional condition as a string expression
+    depends_on: Optional[List[int]] = None  # step_orders this step waits for; None = previous step
+
+    @validator('condition')
+    def validate_condition(cls, value):
+        # Rejects conditions outside the sandboxed expression language at save time
+        if value is not None:
+            compile_condition(value)
+        return value
 
 class AgentChain(BaseModel):
     tenant_id: int
     name: str
     steps: List[AgentChainStep]
 
+    @validator('steps')
+    def validate_dependencies(cls, steps):
+        # Rejects unknown dependencies and cycles at save time
+        plan_steps([{"step_order": s.step_order, "depends_on": s.depends_on} for s in steps])
+        return steps
+
 # Agent input/output schemas
 
 class DocumentSummarizerInput(BaseModel):
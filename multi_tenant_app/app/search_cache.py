@@ -0,0 +1,80 @@
+"""
+Redis cache for search_document results.
+
+Entries are keyed by (tenant_id, normalized query, n_results) and a per-tenant
+generation number. Indexing a tenant's documents bumps its generation, which
+invalidates all of its cached results at once without scanning keys; the old
+entries simply expire. Hits and misses are counted globally and per tenant.
+"""
+import hashlib
+import json
+import logging
+from flask import current_app
+from app.redis_client import get_redis
+
+logger = logging.getLogger(__name__)
+
+GENERATION_KEY = "search_cache:gen:{tenant_id}"
+RESULT_KEY_PREFIX = "search_cache:result:{tenant_id}:"
+STATS_KEY = "search_cache:stats"
+
+# Reads the tenant's generation, the cached result for that generation and
+# counts the hit or miss in a single round trip. Returns {generation, result}.
+_LOOKUP_SCRIPT = """
+local generation = redis.call('GET', KEYS[1]) or '0'
+local result = redis.call('GET', ARGV[1] .. generation .. ':' .. ARGV[2])
+local outcome = result and 'hits' or 'misses'
+redis.call('HINCRBY', KEYS[2], outcome, 1)
+redis.call('HINCRBY', KEYS[2], outcome .. ':' .. ARGV[3], 1)
+return {generation, result}
+"""
+
+_lookup = None
+
+def normalize_query(query_text):
+    return " ".join(query_text.lower().split())
+
+def _suffix(query_text, n_results):
+    digest = hashlib.sha256(normalize_query(query_text).encode("utf-8")).hexdigest()
+    return f"{n_results}:{digest}"
+
+def lookup(tenant_id, query_text, n_results):
+    """
+    Returns (generation, cached result or None). The generation must be passed
+    back to store() so a result computed before an invalidation is not cached
+    under the new generation.
+    """
+    global _lookup
+    redis_client = get_redis()
+    if _lookup is None:
+        _lookup = redis_client.register_script(_LOOKUP_SCRIPT)
+    generation, raw = _lookup(
+        keys=[GENERATION_KEY.format(tenant_id=tenant_id), STATS_KEY],
+        args=[RESULT_KEY_PREFIX.format(tenant_id=tenant_id), _suffix(query_text, n_results), tenant_id],
+        client=redis_client
+    )
+    return int(generation), (json.loads(raw) if raw else None)
+
+def store(tenant_id, generation, query_text, n_results, result):
+    key = RESULT_KEY_PREFIX.format(tenant_id=tenant_id) + f"{generation}:{_suffix(query_text, n_results)}"
+    get_redis().set(key, json.dumps(result), ex=current_app.config['SEARCH_CACHE_TTL'])
+
+def invalidate_tenant(tenant_id):
+    """Invalidates every cached search result of the tenant."""
+    try:
+        get_redis().incr(GENERATION_KEY.format(tenant_id=tenant_id))
+    except Exception:
+        logger.exception("Failed to invalidate search cache for tenant %s", tenant_id)
+
+def get_stats(tenant_id=None):
+    stats = {key.decode(): int(value) for key, value in get_redis().hgetall(STATS_KEY).items()}
+    suffix = f":{tenant_id}" if tenant_id is not None else ""
+    hits = stats.get(f"hits{suffix}", 0)
+    misses = stats.get(f"misses{suffix}", 0)
+    total = hits + misses
+    return {
+        "tenant_id": tenant_id,
+        "hits": hits,
+        "misses": misses,
+        "hit_ratio": round(hits / total, 4) if total else None
+    }
@@ -0,0 +1,252 @@
+"""
+Salesforce REST client used by the SFDC agent.
+
+Requests go through a pooled requests.Session per tenant so the TLS connection
+to the instance is reused. Batches of leads are sent through the Composite
+sObject Collections API (up to 200 records per request) or, above
+SFDC_BULK_THRESHOLD records, as a Bulk API 2.0 ingest job. Both paths report
+the outcome of every record: created, failed, or unknown when the request
+reached Salesforce but its answer did not (a read timeout, a 5xx other than
+503, a bulk job still running at SFDC_BULK_TIMEOUT). An unknown record may
+have been created, so resubmitting it risks a duplicate lead.
+
+Every request has connect and read timeouts (SFDC_CONNECT_TIMEOUT,
+SFDC_READ_TIMEOUT) and goes through the tenant's "salesforce" circuit breaker
+(app/circuit_breaker.py): connection errors, timeouts and 5xx responses count
+as failures, and while the breaker is open requests fail with CircuitOpen
+without being sent.
+"""
+import csv
+import hashlib
+import io
+import json
+import os
+import threading
+import time
+import requests
+from requests.adapters import HTTPAdapter
+from flask import current_app
+from app import circuit_breaker
+from app.circuit_breaker import CircuitOpen
+from app.idempotency import OutcomeUnknown
+
+COMPOSITE_MAX_RECORDS = 200
+BULK_TERMINAL_STATES = ("JobComplete", "Failed", "Aborted")
+
+class SFDCError(Exception):
+    """Raised when Salesforce rejects a request."""
+
+_sessions = {}
+_sessions_pid = None
+_sessions_lock = threading.Lock()
+
+def get_session(tenant_id):
+    """
+    Returns the pooled HTTP session for a tenant. Sessions are not shared across
+    a fork, so a forked worker child builds its own.
+    """
+    global _sessions, _sessions_pid
+    with _sessions_lock:
+        if _sessions_pid != os.getpid():
+            _sessions, _sessions_pid = {}, os.getpid()
+        session = _sessions.get(tenant_id)
+        if session is None:
+            session = requests.Session()
+            adapter = HTTPAdapter(
+                pool_connections=1,
+                pool_maxsize=current_app.config['SFDC_POOL_MAXSIZE']
+            )
+            session.mount("https://", adapter)
+            session.mount("http://", adapter)
+            _sessions[tenant_id] = session
+        return session
+
+def _request(tenant_id, method, url, **kwargs):
+    config = current_app.config
+    circuit_breaker.acquire(tenant_id, "salesforce")
+    try:
+        response = get_session(tenant_id).request(
+            method, url, timeout=(config['SFDC_CONNECT_TIMEOUT'], config['SFDC_READ_TIMEOUT']), **kwargs
+        )
+    except requests.RequestException:
+        circuit_breaker.record(tenant_id, "salesforce", ok=False)
+        raise
+    circuit_breaker.record(tenant_id, "salesforce", ok=response.status_code < 500)
+    return response
+
+def _url(config, path):
+    api_version = current_app.config['SFDC_API_VERSION']
+    return f"{config.sfdc_instance_url}/services/data/{api_version}/{path}"
+
+def _headers(config, content_type="application/json"):
+    return {
+        'Authorization': f"Bearer {config.sfdc_access_token}",
+        'Content-Type': content_type
+    }
+
+def create_lead(tenant_id, config, lead_data):
+    try:
+        response = _request(tenant_id, "POST", _url(config, "sobjects/Lead/"), json=lead_data, headers=_headers(config))
+    except requests.ReadTimeout as exc:
+        # The request was sent; Salesforce may have created the lead.
+        raise OutcomeUnknown(f"Timed out waiting for Salesforce: {exc}") from exc
+    if response.status_code in (200, 201):
+        return response.json().get("id")
+    if response.status_code >= 500 and response.status_code != 503:
+        # The server failed while handling the request, maybe after creating the lead.
+        raise OutcomeUnknown(f"Salesforce failed to answer the lead creation ({response.status_code}): {response.text}")
+    raise SFDCError(f"Failed to create lead: {response.text}")
+
+def _record_result(index, success, record_id=None, errors=None, job_id=None):
+    """A record's outcome; success is None when it is unknown whether the record was created."""
+    result = {"index": index, "success": success, "unknown": success is None, "id": record_id, "errors": errors or []}
+    if job_id:
+        result["job_id"] = job_id
+    return result
+
+def create_leads_composite(tenant_id, config, leads):
+    """
+    Creates leads in chunks of up to 200 records per Composite request with
+    allOrNone disabled. A chunk that fails as a whole marks its records as
+    failed, or as unknown if Salesforce may have handled it (read timeout, 5xx
+    other than 503), rather than aborting the batch, so chunks that already
+    succeeded are never resent. Once the circuit breaker opens, the remaining
+    chunks fail without being sent.
+    """
+    url = _url(config, "composite/sobjects")
+    results = []
+    for start in range(0, len(leads), COMPOSITE_MAX_RECORDS):
+        chunk = leads[start:start + COMPOSITE_MAX_RECORDS]
+        payload = {
+            "allOrNone": False,
+            "records": [dict(lead, attributes={"type": "Lead"}) for lead in chunk]
+        }
+        try:
+            response = _request(tenant_id, "POST", url, json=payload, headers=_headers(config))
+        except requests.ReadTimeout as exc:
+            # The request was sent; Salesforce may have created the leads.
+            results.extend(_record_result(start + i, None, errors=[{"message": str(exc)}]) for i in range(len(chunk)))
+            continue
+        except (requests.RequestException, CircuitOpen) as exc:
+            results.extend(_record_result(start + i, False, errors=[{"message": str(exc)}]) for i in range(len(chunk)))
+            continue
+        if response.status_code != 200:
+            error = {"statusCode": response.status_code, "message": response.text}
+            # As for a single lead, a 5xx other than 503 may come after the records were created.
+            success = None if response.status_code >= 500 and response.status_code != 503 else False
+            results.extend(_record_result(start + i, success, errors=[error]) for i in range(len(chunk)))
+            continue
+        for i, record in enumerate(response.json()):
+            results.append(_record_result(start + i, record.get("success", False), record.get("id"), record.get("errors")))
+    return results
+
+def _row_key(row, fields):
+    return hashlib.sha1(json.dumps([row.get(field, "") for field in fields]).encode()).hexdigest()
+
+def create_leads_bulk(tenant_id, config, leads):
+    """
+    Creates leads through a Bulk API 2.0 ingest job and waits for it to finish.
+    Bulk results do not preserve input order, so records are matched back to
+    their input index by their field values. Until the job is closed nothing
+    is inserted, so errors up to then raise SFDCError and the batch can be
+    retried as a whole.
+    """
+    fields = sorted({field for lead in leads for field in lead})
+
+    try:
+        response = _request(tenant_id, "POST", _url(config, "jobs/ingest/"), headers=_headers(config), json={
+            "object": "Lead",
+            "operation": "insert",
+            "contentType": "CSV",
+            "lineEnding": "LF"
+        })
+        if response.status_code not in (200, 201):
+            raise SFDCError(f"Failed to create bulk job: {response.text}")
+        job_id = response.json()['id']
+        job_url = _url(config, f"jobs/ingest/{job_id}")
+
+        buffer = io.StringIO()
+        writer = csv.DictWriter(buffer, fieldnames=fields, lineterminator="\n")
+        writer.writeheader()
+        writer.writerows(leads)
+        response = _request(
+            tenant_id, "PUT", f"{job_url}/batches", data=buffer.getvalue().encode("utf-8"), headers=_headers(config, "text/csv")
+        )
+        if response.status_code not in (200, 201):
+            raise SFDCError(f"Failed to upload bulk data: {response.text}")
+    except (requests.RequestException, ValueError) as exc:
+        raise SFDCError(f"Failed to set up bulk job: {exc}") from exc
+    try:
+        response = _request(tenant_id, "PATCH", job_url, json={"state": "UploadComplete"}, headers=_headers(config))
+    except requests.ReadTimeout:
+        # The job may have been closed and be running: find out by polling it.
+        response = None
+    except requests.RequestException as exc:
+        raise SFDCError(f"Failed to close bulk job: {exc}") from exc
+    if response is not None and response.status_code != 200:
+        raise SFDCError(f"Failed to close bulk job: {response.text}")
+
+    # Past this point Salesforce owns the records, so nothing below raises: a task
+    # retry would insert them twice.
+    deadline = time.monotonic() + current_app.config['SFDC_BULK_TIMEOUT']
+    poll_interval = current_app.config['SFDC_BULK_POLL_INTERVAL']
+    state = None
+    while time.monotonic() < deadline:
+        try:
+            state = _request(tenant_id, "GET", job_url, headers=_headers(config)).json().get("state")
+        except (requests.RequestException, ValueError, CircuitOpen):
+            state = None
+        if state in BULK_TERMINAL_STATES:
+            break
+        time.sleep(poll_interval)
+
+    # Input rows are matched to result rows by their field values.
+    pending = {}
+    for index, lead in enumerate(leads):
+        row = {field: "" if lead.get(field) is None else str(lead.get(field)) for field in fields}
+        pending.setdefault(_row_key(row, fields), []).append(index)
+
+    results = []
+    for kind in ("successfulResults", "failedResults"):
+        if state not in BULK_TERMINAL_STATES:
+            break
+        try:
+            response = _request(tenant_id, "GET", f"{job_url}/{kind}/", headers=_headers(config))
+        except (requests.RequestException, CircuitOpen):
+            continue
+        for row in csv.DictReader(io.StringIO(response.text)):
+            indexes = pending.get(_row_key(row, fields))
+            if not indexes:
+                continue
+            index = indexes.pop(0)
+            if kind == "successfulResults":
+                results.append(_record_result(index, True, row.get("sf__Id")))
+            else:
+                results.append(_record_result(index, False, errors=[{"message": row.get("sf__Error")}]))
+    # Records without a result, e.g. the job is still running or its results
+    # could not be read: Salesforce may still insert them.
+    error = {"message": f"No result for record (bulk job {job_id}, state: {state})"}
+    for indexes in pending.values():
+        results.extend(_record_result(index, None, errors=[error], job_id=job_id) for index in indexes)
+    return sorted(results, key=lambda result: result["index"])
+
+def create_leads(tenant_id, config, leads):
+    """
+    Creates a batch of leads, choosing the Bulk API for large batches.
+    Returns a summary with one result per input record. Records whose outcome
+    is unknown are counted apart from the failed ones, which alone are safe to
+    resubmit.
+    """
+    if len(leads) > current_app.config['SFDC_BULK_THRESHOLD']:
+        results = create_leads_bulk(tenant_id, config, leads)
+    else:
+        results = create_leads_composite(tenant_id, config, leads)
+    succeeded = sum(1 for result in results if result["success"])
+    unknown = sum(1 for result in results if result["unknown"])
+    return {
+        "total": len(leads),
+        "succeeded": succeeded,
+        "failed": len(results) - succeeded - unknown,
+        "unknown": unknown,
+        "results": results
+    }
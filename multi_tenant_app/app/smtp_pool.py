@@ -0,0 +1,186 @@
+"""
+Per-process pool of authenticated SMTP sessions.
+
+Opening an SMTP session (TCP connect, STARTTLS handshake, AUTH) costs far more
+than sending a message over it, so sessions are kept per (server, port,
+username) and reused. A session is checked with NOOP before reuse, closed after
+SMTP_POOL_IDLE_TIMEOUT seconds of inactivity, and retired after
+SMTP_POOL_MAX_MESSAGES messages.
+
+A session that drops once a message's DATA command was sent may have delivered
+the message, so sending it raises OutcomeUnknown rather than inviting a resend.
+"""
+import logging
+import os
+import smtplib
+import threading
+import time
+from contextlib import contextmanager
+from flask import current_app
+from app.idempotency import OutcomeUnknown
+
+logger = logging.getLogger(__name__)
+
+class _SMTP(smtplib.SMTP):
+    """Records whether the DATA command of the current message was sent."""
+
+    data_sent = False
+
+    def data(self, msg):
+        self.data_sent = True
+        return super().data(msg)
+
+class PooledSMTPConnection:
+    def __init__(self, key, server):
+        self.key = key
+        self.server = server
+        self.created_at = time.monotonic()
+        self.last_used = self.created_at
+        self.messages_sent = 0
+        self.closed = False
+
+    def send_message(self, msg):
+        self.server.data_sent = False
+        try:
+            self.server.send_message(msg)
+        except smtplib.SMTPResponseException:
+            raise  # The server replied, so the outcome is known
+        except (smtplib.SMTPServerDisconnected, OSError) as exc:
+            if self.server.data_sent:
+                # Never reuse the session: a reply may still be in flight.
+                self.server.close()
+                self.closed = True
+                raise OutcomeUnknown(f"SMTP session dropped after the message data was sent: {exc}") from exc
+            raise
+        self.messages_sent += 1
+        self.last_used = time.monotonic()
+
+    def reset(self):
+        """Aborts the current message with RSET; returns False if the session is broken."""
+        try:
+            return self.server.rset()[0] == 250
+        except (smtplib.SMTPException, OSError):
+            return False
+
+    def is_alive(self):
+        try:
+            return self.server.noop()[0] == 250
+        except smtplib.SMTPException:
+            return False
+        except OSError:
+            return False
+
+    def close(self):
+        try:
+            self.server.quit()
+        except Exception:
+            try:
+                self.server.close()
+            except Exception:
+                pass
+
+class SMTPConnectionPool:
+    def __init__(self, idle_timeout=60, max_messages=100, max_idle=4, timeout=30, starttls=True, connect_timeout=None):
+        self.idle_timeout = idle_timeout
+        self.max_messages = max_messages
+        self.max_idle = max_idle
+        self.timeout = timeout
+        self.connect_timeout = connect_timeout or timeout
+        self.starttls = starttls
+        self._idle = {}
+        self._lock = threading.Lock()
+
+    def _connect(self, key, config):
+        # Connecting in the constructor also records the host STARTTLS verifies.
+        server = _SMTP(config.smtp_server, config.smtp_port, timeout=self.connect_timeout)
+        # Once connected, wait up to `timeout` for each reply.
+        server.timeout = self.timeout
+        server.sock.settimeout(self.timeout)
+        try:
+            if self.starttls:
+                server.starttls()
+            server.login(config.smtp_username, config.smtp_password)
+        except Exception:
+            # E.g. a failed TLS handshake or refused credentials: do not leak the socket.
+            server.close()
+            raise
+        return PooledSMTPConnection(key, server)
+
+    def acquire(self, config):
+        """
+        Returns a live connection for the config, reusing an idle one if possible.
+        """
+        key = (config.smtp_server, config.smtp_port, config.smtp_username)
+        while True:
+            with self._lock:
+                idle = self._idle.get(key)
+                conn = idle.pop() if idle else None
+            if conn is None:
+                return self._connect(key, config)
+            if time.monotonic() - conn.last_used > self.idle_timeout or not conn.is_alive():
+                conn.close()
+                continue
+            return conn
+
+    def release(self, conn, discard=False):
+        """
+        Returns a connection to the pool, or closes it if it is broken or closed,
+        has sent max_messages, or the pool already holds max_idle connections for
+        its key.
+        """
+        if discard or conn.closed or conn.messages_sent >= self.max_messages:
+            conn.close()
+            return
+        with self._lock:
+            idle = self._idle.setdefault(conn.key, [])
+            if len(idle) < self.max_idle:
+                idle.append(conn)
+                return
+        conn.close()
+
+    @contextmanager
+    def connection(self, config):
+        conn = self.acquire(config)
+        try:
+            yield conn
+        except (smtplib.SMTPRecipientsRefused, smtplib.SMTPSenderRefused, smtplib.SMTPDataError):
+            # The server refused the message, not the session: reuse it once reset.
+            self.release(conn, discard=not conn.reset())
+            raise
+        except (smtplib.SMTPServerDisconnected, smtplib.SMTPResponseException, OSError, OutcomeUnknown):
+            self.release(conn, discard=True)
+            raise
+        except Exception:
+            # Errors outside the SMTP conversation leave the session usable.
+            self.release(conn)
+            raise
+        else:
+            self.release(conn)
+
+    def close_all(self):
+        with self._lock:
+            idle, self._idle = self._idle, {}
+        for conns in idle.values():
+            for conn in conns:
+                conn.close()
+
+_pool = None
+_pool_pid = None
+
+def get_smtp_pool():
+    """
+    Returns this process's SMTP pool. Sockets must not be shared across a fork,
+    so a forked worker child gets a fresh pool.
+    """
+    global _pool, _pool_pid
+    if _pool is None or _pool_pid != os.getpid():
+        _pool = SMTPConnectionPool(
+            idle_timeout=current_app.config['SMTP_POOL_IDLE_TIMEOUT'],
+            max_messages=current_app.config['SMTP_POOL_MAX_MESSAGES'],
+            max_idle=current_app.config['SMTP_POOL_MAX_IDLE'],
+            timeout=current_app.config['SMTP_TIMEOUT'],
+            starttls=current_app.config['SMTP_STARTTLS'],
+            connect_timeout=current_app.config['SMTP_CONNECT_TIMEOUT']
+        )
+        _pool_pid = os.getpid()
+    return _pool
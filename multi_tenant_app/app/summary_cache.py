@@ -0,0 +1,73 @@
+"""
+Persistent memo of document summaries, stored in Redis.
+
+A summary is keyed by the hash of the document text plus everything that
+changes the output: the tenant's summarizer_setting, the model parameters and
+the way it was produced. A single-prompt summary (/summarize_document and the
+doc_sum chain step) and a map-reduce summary of the same document are built
+with different prompts and token limits, so they are kept apart.
+The cache holds at most SUMMARY_CACHE_MAX_ENTRIES summaries; a sorted set of
+last-access times drives least-recently-used eviction.
+"""
+import hashlib
+import json
+import time
+from flask import current_app
+from app.config_cache import get_tenant_config
+from app.redis_client import get_redis
+
+ENTRY_KEY = "summary_cache:entry:{digest}"
+LRU_KEY = "summary_cache:lru"
+
+SINGLE = "single"
+MAP_REDUCE = "map_reduce"
+
+def _mode_params(mode):
+    config = current_app.config
+    if mode == SINGLE:
+        return [config['SUMMARIZER_MAX_TOKENS']]
+    if mode == MAP_REDUCE:
+        return [
+            config['SUMMARY_CHUNK_SIZE'],
+            config['SUMMARY_CHUNK_OVERLAP'],
+            config['SUMMARY_PARTIAL_MAX_TOKENS'],
+            config['SUMMARY_REDUCE_MAX_CHARS'],
+            config['SUMMARY_REDUCE_MAX_LEVELS'],
+            config['SUMMARY_FINAL_MAX_TOKENS']
+        ]
+    raise ValueError(f"Unknown summary mode: {mode}")
+
+def cache_key(tenant_id, document_text, mode=SINGLE):
+    config = current_app.config
+    doc_sum_config = get_tenant_config("doc_sum", tenant_id)
+    params = json.dumps([
+        mode,
+        doc_sum_config.summarizer_setting if doc_sum_config else None,
+        config['SUMMARIZER_MODEL'],
+        config['SUMMARIZER_TEMPERATURE'],
+        *_mode_params(mode)
+    ])
+    document_hash = hashlib.sha256(document_text.encode("utf-8")).hexdigest()
+    return hashlib.sha256(f"{document_hash}:{params}".encode("utf-8")).hexdigest()
+
+def get(digest):
+    """Returns the cached summary or None, refreshing its LRU position on a hit."""
+    pipe = get_redis().pipeline()
+    pipe.get(ENTRY_KEY.format(digest=digest))
+    # XX only updates existing members, so a miss leaves the sorted set alone.
+    pipe.zadd(LRU_KEY, {digest: time.time()}, xx=True)
+    summary, _ = pipe.execute()
+    return summary.decode("utf-8") if summary is not None else None
+
+def put(digest, summary):
+    """Stores a summary and evicts the least recently used entries over the limit."""
+    redis_client = get_redis()
+    pipe = redis_client.pipeline()
+    pipe.set(ENTRY_KEY.format(digest=digest), summary)
+    pipe.zadd(LRU_KEY, {digest: time.time()})
+    pipe.zcard(LRU_KEY)
+    size = pipe.execute()[-1]
+    overflow = size - current_app.config['SUMMARY_CACHE_MAX_ENTRIES']
+    if overflow > 0:
+        evicted = [member.decode() for member, _ in redis_client.zpopmin(LRU_KEY, overflow)]
+        redis_client.delete(*[ENTRY_KEY.format(digest=member) for member in evicted])
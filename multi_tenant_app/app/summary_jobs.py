@@ -0,0 +1,135 @@
+"""
+Map-reduce summarization jobs for long documents.
+
+The document is split into chunks that are summarized in parallel by a Celery
+group; a chord callback then reduces the partial summaries, recursively
+summarizing them in batches while they are still too long for one prompt.
+Every partial and the final summary is appended to a Redis stream that the
+SSE endpoint relays to the client. Final summaries are kept in the summary
+cache (see app/summary_cache.py), so a document summarized before completes
+without running the canvas.
+"""
+import json
+import time
+import uuid
+from celery import chord, group
+from flask import current_app
+from app import summary_cache
+from app.queues import PRIORITY_LOW
+from app.redis_client import get_redis
+from app.text_chunks import chunk_text
+
+JOB_KEY = "summary_job:{job_id}"
+EVENTS_KEY = "summary_job:{job_id}:events"
+TERMINAL_EVENTS = ("final", "error")
+
+def _ttl():
+    return current_app.config['SUMMARY_JOB_TTL_SECONDS']
+
+def publish_event(job_id, event_type, data):
+    """Appends an event to the job's stream and mirrors terminal events in the job hash."""
+    redis_client = get_redis()
+    pipe = redis_client.pipeline()
+    events_key = EVENTS_KEY.format(job_id=job_id)
+    pipe.xadd(events_key, {"type": event_type, "data": json.dumps(data)})
+    pipe.expire(events_key, _ttl())
+    if event_type in TERMINAL_EVENTS:
+        pipe.hset(JOB_KEY.format(job_id=job_id), mapping={
+            "status": "completed" if event_type == "final" else "failed",
+            "finished_at": time.time(),
+            "result": json.dumps(data)
+        })
+    pipe.execute()
+
+def read_events(job_id, last_event_id="0", block_ms=None):
+    """
+    Returns [(event_id, event_type, data)] published after last_event_id,
+    waiting up to block_ms for the first one.
+    """
+    response = get_redis().xread({EVENTS_KEY.format(job_id=job_id): last_event_id}, block=block_ms)
+    events = []
+    for _, entries in response or []:
+        for event_id, fields in entries:
+            events.append((event_id.decode(), fields[b"type"].decode(), json.loads(fields[b"data"])))
+    return events
+
+def get_job(job_id):
+    raw = get_redis().hgetall(JOB_KEY.format(job_id=job_id))
+    if not raw:
+        return None
+    job = {key.decode(): value.decode() for key, value in raw.items()}
+    job["tenant_id"] = int(job["tenant_id"])
+    job["chunks"] = int(job["chunks"])
+    job["created_at"] = float(job["created_at"])
+    if "finished_at" in job:
+        job["finished_at"] = float(job["finished_at"])
+    job["result"] = json.loads(job["result"]) if "result" in job else None
+    return job
+
+def batch_partials(partials, max_chars):
+    """
+    Groups partial summaries into batches whose combined length fits max_chars.
+    A batch always takes at least two partials, even if they do not fit, so
+    every reduction level at least halves the number of partials.
+    """
+    batches = [[]]
+    size = 0
+    for partial in partials:
+        if len(batches[-1]) >= 2 and size + len(partial) > max_chars:
+            batches.append([])
+            size = 0
+        batches[-1].append(partial)
+        size += len(partial)
+    if len(batches) > 1 and len(batches[-1]) == 1:
+        batches[-2].extend(batches.pop())
+    return batches
+
+def truncate_partials(partials, max_chars):
+    """Cuts each partial summary to an equal share of max_chars."""
+    share = max(1, max_chars // len(partials))
+    return [partial[:share] for partial in partials]
+
+def cache_summary(job_id, summary):
+    """
+    Stores a job's final summary in the summary cache, under the map-reduce key
+    of its document that start_summary_job recorded.
+    """
+    digest = get_redis().hget(JOB_KEY.format(job_id=job_id), "summary_key")
+    if digest is not None:
+        summary_cache.put(digest.decode(), summary)
+
+def start_summary_job(tenant_id, document_text):
+    """
+    Splits the document and dispatches the map-reduce canvas, or publishes the
+    cached summary if the document was summarized before. Returns the job id.
+    """
+    from app import fair_share  # Avoid circular import
+    from app.tasks import summarize_chunk_task, reduce_summaries_task  # Avoid circular import
+
+    config = current_app.config
+    job_id = uuid.uuid4().hex
+    digest = summary_cache.cache_key(tenant_id, document_text, summary_cache.MAP_REDUCE)
+    summary = summary_cache.get(digest)
+    chunks = [] if summary is not None else chunk_text(document_text, config['SUMMARY_CHUNK_SIZE'], config['SUMMARY_CHUNK_OVERLAP'])
+    key = JOB_KEY.format(job_id=job_id)
+    pipe = get_redis().pipeline()
+    pipe.hset(key, mapping={
+        "job_id": job_id,
+        "tenant_id": tenant_id,
+        "status": "running",
+        "chunks": len(chunks),
+        "summary_key": digest,
+        "created_at": time.time()
+    })
+    pipe.expire(key, _ttl())
+    pipe.execute()
+    publish_event(job_id, "started", {"chunks": len(chunks)})
+    if summary is not None:
+        publish_event(job_id, "final", {"summary": summary, "cached": True})
+        return job_id
+
+    header = group([summarize_chunk_task.s(job_id, tenant_id, index, chunk, 0) for index, chunk in enumerate(chunks)])
+    # The chord's own options would override the routed priority of its members.
+    canvas = chord(header, reduce_summaries_task.s(job_id, tenant_id, 1)).set(priority=PRIORITY_LOW)
+    fair_share.submit(canvas, tenant_id)
+    return job_id
@@ -0,0 +1,106 @@
+"""
+Batch lookups of Celery task states.
+
+With the Redis result backend, the states of many tasks are read with a single
+MGET of their result keys, and watchers wait on the pub/sub channels the
+backend publishes every state change to (each channel is named after the
+task's result key). Other result backends fall back to one AsyncResult per
+task and polling.
+"""
+import time
+from celery import states
+from celery.backends.redis import RedisBackend
+from celery.result import AsyncResult
+from app import celery
+
+POLL_INTERVAL = 0.5
+
+def _describe(task_id, status, result):
+    if status not in states.READY_STATES:
+        result = None
+    elif status in states.EXCEPTION_STATES:
+        # Exceptions are not JSON serializable.
+        result = str(result)
+    return {"task_id": task_id, "status": status, "result": result}
+
+def _redis_backend():
+    backend = celery.backend
+    return backend if isinstance(backend, RedisBackend) else None
+
+def get_statuses(task_ids):
+    """Returns {task_id: {task_id, status, result}} for the given tasks."""
+    backend = _redis_backend()
+    if backend is None:
+        statuses = {}
+        for task_id in task_ids:
+            result = AsyncResult(task_id, app=celery)
+            statuses[task_id] = _describe(task_id, result.status, result.result)
+        return statuses
+
+    keys = [backend.get_key_for_task(task_id) for task_id in task_ids]
+    statuses = {}
+    for task_id, raw in zip(task_ids, backend.client.mget(keys)):
+        if raw is None:
+            statuses[task_id] = _describe(task_id, states.PENDING, None)
+        else:
+            meta = backend.decode_result(raw)
+            statuses[task_id] = _describe(task_id, meta["status"], meta["result"])
+    return statuses
+
+def _wait_for_publish(pubsub, timeout):
+    deadline = time.monotonic() + timeout
+    while True:
+        remaining = deadline - time.monotonic()
+        if remaining <= 0:
+            return False
+        message = pubsub.get_message(timeout=remaining)
+        if message and message["type"] == "message":
+            return True
+
+def _subscribe(pubsub, channels, timeout):
+    """
+    Subscribes and waits for the server to confirm. SUBSCRIBE is not acknowledged
+    synchronously, so without waiting, a change published before the server
+    handles it would be missed.
+    """
+    pubsub.subscribe(*channels)
+    deadline = time.monotonic() + timeout
+    confirmed = 0
+    while confirmed < len(channels):
+        remaining = deadline - time.monotonic()
+        if remaining <= 0:
+            return
+        message = pubsub.get_message(timeout=remaining)
+        if message and message["type"] == "subscribe":
+            confirmed += 1
+
+def watch(task_ids, known, timeout):
+    """
+    Waits until the state of a watched task differs from `known` (task_id ->
+    state the caller last saw) and returns the statuses of the tasks that
+    changed, or {} after `timeout` seconds.
+    """
+    # One deadline for subscribing and waiting, so together they take at most `timeout`.
+    deadline = time.monotonic() + timeout
+    backend = _redis_backend()
+    pubsub = None
+    if backend is not None:
+        pubsub = backend.client.pubsub()
+        # Subscribe before reading so a change between the read and the wait is not lost.
+        _subscribe(pubsub, [backend.get_key_for_task(task_id) for task_id in task_ids], deadline - time.monotonic())
+    try:
+        while True:
+            changed = {
+                task_id: status for task_id, status in get_statuses(task_ids).items()
+                if status["status"] != known.get(task_id)
+            }
+            remaining = deadline - time.monotonic()
+            if changed or remaining <= 0:
+                return changed
+            if pubsub is not None:
+                _wait_for_publish(pubsub, remaining)
+            else:
+                time.sleep(min(POLL_INTERVAL, remaining))
+    finally:
+        if pubsub is not None:
+            pubsub.close()
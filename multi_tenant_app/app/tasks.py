@@ -1,66 +1,334 @@
+import random
 import smtplib
 from email.mime.text import MIMEText
-import requests
-import openai
+from celery import chord, group
 from app import celery, db
-from app.models import EmailAgentConfig, SFDCConfig
+from app.config_cache import get_tenant_config
+from app.smtp_pool import get_smtp_pool
+from app import circuit_breaker, index_jobs, summary_jobs, summary_cache, idempotency
+from app.circuit_breaker import CircuitOpen
+from app.conditions import ConditionError
+from app.tracing import dependency_call
+from app.idempotency import OutcomeUnknown
 from flask import current_app
 
-# Set the OpenAI API key from the app configuration
-openai.api_key = current_app.config.get('OPENAI_API_KEY')
+def _build_message(config, recipient, subject, body):
+    msg = MIMEText(body)
+    msg['Subject'] = subject
+    msg['From'] = config.smtp_username
+    msg['To'] = recipient
+    return msg
 
-@celery.task(bind=True, max_retries=3, default_retry_delay=10)
-def send_email_task(self, tenant_id, recipient, subject, body):
+def _smtp_failure(exc):
+    """Whether an error sending mail means the SMTP server is failing (see app/circuit_breaker.py)."""
+    # A refused recipient or a permanent (5xx) reply to a message means the server is up.
+    if isinstance(exc, smtplib.SMTPRecipientsRefused):
+        return False
+    if isinstance(exc, smtplib.SMTPResponseException):
+        return exc.smtp_code < 500
+    return isinstance(exc, (OSError, OutcomeUnknown))
+
+def _session_dropped(exc):
+    """Whether an error means the SMTP session dropped, rather than the server refusing it."""
+    # SMTPException is an OSError too; of those, only a disconnect is a drop.
+    if isinstance(exc, smtplib.SMTPException):
+        return isinstance(exc, smtplib.SMTPServerDisconnected)
+    return isinstance(exc, OSError)
+
+def send_email(tenant_id, recipient, subject, body):
+    config = get_tenant_config("email", tenant_id)
+    if not config:
+        raise Exception("Email configuration not found for tenant")
+
+    msg = _build_message(config, recipient, subject, body)
+    with circuit_breaker.guard(tenant_id, "smtp", is_failure=_smtp_failure), \
+            dependency_call("smtp", "send"), get_smtp_pool().connection(config) as conn:
+        # Raises OutcomeUnknown if the server may have accepted the message.
+        conn.send_message(msg)
+    return "Email sent successfully"
+
+def send_email_batch(tenant_id, messages):
+    """
+    Sends many messages over pooled SMTP sessions, switching sessions only when
+    one is retired or drops. Returns per-message results. Raises (e.g. CircuitOpen,
+    or a refused connection or login) only before any message was handed to the
+    server; after that, errors are recorded against the messages not sent.
+    """
+    config = get_tenant_config("email", tenant_id)
+    if not config:
+        raise Exception("Email configuration not found for tenant")
+
+    pool = get_smtp_pool()
+    results = []
+    pending = list(enumerate(messages))
+    reconnects = 0
+    while pending:
+        try:
+            with circuit_breaker.guard(tenant_id, "smtp", is_failure=_smtp_failure), pool.connection(config) as conn:
+                while pending and conn.messages_sent < pool.max_messages:
+                    index, message = pending[0]
+                    if not isinstance(message, dict):
+                        results.append({"index": index, "status": "error", "message": "Message must be an object"})
+                        pending.pop(0)
+                        continue
+                    msg = _build_message(config, message.get("recipient"), message.get("subject"), message.get("body"))
+                    try:
+                        with dependency_call("smtp", "send"):
+                            conn.send_message(msg)
+                        results.append({"index": index, "status": "success"})
+                    except (smtplib.SMTPRecipientsRefused, smtplib.SMTPResponseException) as exc:
+                        results.append({"index": index, "status": "error", "message": str(exc)})
+                    except OutcomeUnknown as exc:
+                        # The message may have been delivered, so it is not resent. The
+                        # session was closed: leave it to the pool to discard and carry
+                        # on with a new one, which is neither a reconnect nor a failure.
+                        results.append({"index": index, "status": "error", "message": str(exc)})
+                        pending.pop(0)
+                        break
+                    pending.pop(0)
+        except Exception as exc:
+            if _session_dropped(exc):
+                # The session dropped mid-batch; retry the current message on a new one.
+                # Never raise here: a task retry would resend the messages already sent.
+                reconnects += 1
+                if reconnects <= 3:
+                    continue
+            elif not results:
+                # E.g. an open breaker, or a connection or login that was refused:
+                # nothing was sent yet, so the task can retry safely.
+                raise
+            results.extend({"index": index, "status": "error", "message": str(exc)} for index, _ in pending)
+            break
+    sent = sum(1 for result in results if result["status"] == "success")
+    return {"sent": sent, "failed": len(results) - sent, "results": results}
+
+def complete(tenant_id, prompt, max_tokens=None):
+    from app import llm_client  # Avoid loading aiohttp at import time
+    config = current_app.config
+    with dependency_call("openai", "completion"):
+        return llm_client.complete(
+            tenant_id,
+            prompt,
+            model=config['SUMMARIZER_MODEL'],
+            max_tokens=max_tokens or config['SUMMARIZER_MAX_TOKENS'],
+            temperature=config['SUMMARIZER_TEMPERATURE']
+        )
+
+def summarize_document(tenant_id, document_text):
+    digest = summary_cache.cache_key(tenant_id, document_text, summary_cache.SINGLE)
+    summary = summary_cache.get(digest)
+    if summary is None:
+        summary = complete(tenant_id, f"Summarize the following document:\n\n{document_text}")
+        summary_cache.put(digest, summary)
+    return summary
+
+def create_lead(tenant_id, lead_data):
+    from app import sfdc  # Avoid loading requests at import time
+    config = get_tenant_config("sfdc", tenant_id)
+    if not config:
+        raise Exception("SFDC configuration not found for tenant")
+
+    with dependency_call("salesforce", "create_lead"):
+        sfdc.create_lead(tenant_id, config, lead_data)
+    return "Lead created successfully"
+
+def create_leads_batch(tenant_id, leads):
+    from app import sfdc  # Avoid loading requests at import time
+    config = get_tenant_config("sfdc", tenant_id)
+    if not config:
+        raise Exception("SFDC configuration not found for tenant")
+
+    # Fail (and be retried) as a whole rather than record by record.
+    circuit_breaker.check(tenant_id, "salesforce")
+    with dependency_call("salesforce", "create_leads"):
+        return sfdc.create_leads(tenant_id, config, leads)
+
+def backoff(retries):
+    """
+    Seconds to wait before the next retry: exponential in the number of retries
+    so far, capped, with full jitter so tasks that failed together (e.g. during
+    an outage) do not retry in lockstep.
+    """
+    config = current_app.config
+    return random.uniform(0, min(config['RETRY_BACKOFF_MAX'], config['RETRY_BACKOFF_BASE'] * 2 ** retries))
+
+def circuit_backoff(exc):
+    """
+    Seconds to wait before retrying a task that found a circuit breaker open:
+    until the breaker lets a probe through, with a little jitter.
+    """
+    return exc.retry_after + backoff(0)
+
+# Tasks with side effects run through app/idempotency.py: a retry or a duplicate
+# submission with the same idempotency key returns the recorded result.
+# A task that finds its dependency's circuit breaker open does not call it; it is
+# retried once the breaker is due to let a probe through.
+
+@celery.task(bind=True, max_retries=3)
+def send_email_task(self, tenant_id, recipient, subject, body, idempotency_key=None):
+    key = idempotency_key or idempotency.derive_key([recipient, subject, body])
     try:
-        config = EmailAgentConfig.query.filter_by(tenant_id=tenant_id).first()
-        if not config:
-            raise Exception("Email configuration not found for tenant")
-        
-        msg = MIMEText(body)
-        msg['Subject'] = subject
-        msg['From'] = config.smtp_username
-        msg['To'] = recipient
-
-        server = smtplib.SMTP(config.smtp_server, config.smtp_port)
-        server.starttls()
-        server.login(config.smtp_username, config.smtp_password)
-        server.send_message(msg)
-        server.quit()
-        return "Email sent successfully"
+        return idempotency.execute(tenant_id, self.name, key, lambda: send_email(tenant_id, recipient, subject, body))
+    except OutcomeUnknown:
+        raise
+    except CircuitOpen as exc:
+        self.retry(exc=exc, countdown=circuit_backoff(exc))
     except Exception as exc:
-        self.retry(exc=exc)
+        self.retry(exc=exc, countdown=backoff(self.request.retries))
 
-@celery.task(bind=True, max_retries=3, default_retry_delay=10)
-def summarize_document_task(self, tenant_id, document_text):
+@celery.task(bind=True, max_retries=3)
+def send_email_batch_task(self, tenant_id, messages, idempotency_key=None):
+    key = idempotency_key or idempotency.derive_key(messages)
     try:
-        response = openai.Completion.create(
-            engine="text-davinci-003",
-            prompt=f"Summarize the following document:\n\n{document_text}",
-            max_tokens=150,
-            temperature=0.5,
-        )
-        summary = response.choices[0].text.strip()
-        return summary
+        return idempotency.execute(tenant_id, self.name, key, lambda: send_email_batch(tenant_id, messages))
+    except OutcomeUnknown:
+        raise
+    except CircuitOpen as exc:
+        self.retry(exc=exc, countdown=circuit_backoff(exc))
     except Exception as exc:
-        self.retry(exc=exc)
+        self.retry(exc=exc, countdown=backoff(self.request.retries))
 
-@celery.task(bind=True, max_retries=3, default_retry_delay=10)
-def create_lead_task(self, tenant_id, lead_data):
+@celery.task(bind=True, max_retries=3)
+def summarize_document_task(self, tenant_id, document_text, idempotency_key=None):
+    key = idempotency_key or idempotency.derive_key(document_text)
     try:
-        from app.models import SFDCConfig  # Avoid circular import
-        config = SFDCConfig.query.filter_by(tenant_id=tenant_id).first()
-        if not config:
-            raise Exception("SFDC configuration not found for tenant")
-        
-        url = f"{config.sfdc_instance_url}/services/data/vXX.X/sobjects/Lead/"
-        headers = {
-            'Authorization': f"Bearer {config.sfdc_access_token}",
-            'Content-Type': 'application/json'
-        }
-        response = requests.post(url, json=lead_data, headers=headers)
-        if response.status_code in (200, 201):
-            return "Lead created successfully"
+        return idempotency.execute(tenant_id, self.name, key, lambda: summarize_document(tenant_id, document_text))
+    except OutcomeUnknown:
+        raise
+    except Exception as exc:
+        self.retry(exc=exc, countdown=backoff(self.request.retries))
+
+@celery.task(bind=True, max_retries=3)
+def create_lead_task(self, tenant_id, lead_data, idempotency_key=None):
+    key = idempotency_key or idempotency.derive_key(lead_data)
+    try:
+        return idempotency.execute(tenant_id, self.name, key, lambda: create_lead(tenant_id, lead_data))
+    except OutcomeUnknown:
+        raise
+    except CircuitOpen as exc:
+        self.retry(exc=exc, countdown=circuit_backoff(exc))
+    except Exception as exc:
+        self.retry(exc=exc, countdown=backoff(self.request.retries))
+
+@celery.task(bind=True, max_retries=3)
+def create_leads_batch_task(self, tenant_id, leads, idempotency_key=None):
+    from app import sfdc  # Avoid loading requests at import time
+    key = idempotency_key or idempotency.derive_key(leads)
+    try:
+        return idempotency.execute(tenant_id, self.name, key, lambda: create_leads_batch(tenant_id, leads))
+    except (sfdc.SFDCError, idempotency.DuplicateInFlight) as exc:
+        # Bulk job setup failed before any record was accepted, or a duplicate
+        # submission is still running; safe to retry.
+        self.retry(exc=exc, countdown=backoff(self.request.retries))
+    except CircuitOpen as exc:
+        self.retry(exc=exc, countdown=circuit_backoff(exc))
+
+def index_batch(job_id, tenant_id, documents):
+    """Indexes one batch of a bulk indexing job and records its progress."""
+    from app.chroma import index_documents  # Avoid loading Chroma at import time
+    result = index_documents(tenant_id, documents)
+    index_jobs.add_errors(job_id, result["errors"])
+    index_jobs.record_batch(job_id, result["documents_indexed"], result["chunks_indexed"])
+    return {"documents_indexed": result["documents_indexed"], "chunks_indexed": result["chunks_indexed"]}
+
+def fail_index_batch(job_id, exc):
+    """Counts a batch that ran out of retries as done, so its job can still finish."""
+    index_jobs.add_errors(job_id, [{"error": f"Batch failed: {exc}"}])
+    index_jobs.record_batch(job_id, 0, 0)
+
+# Progress is recorded in the index job (app/index_jobs.py), not the result backend.
+# With the embedded vector store the batches are indexed by app/local_indexer.py instead.
+@celery.task(bind=True, max_retries=3, ignore_result=True)
+def index_documents_task(self, job_id, tenant_id, documents):
+    try:
+        return index_batch(job_id, tenant_id, documents)
+    except Exception as exc:
+        if self.request.retries >= self.max_retries:
+            fail_index_batch(job_id, exc)
+            raise
+        self.retry(exc=exc, countdown=backoff(self.request.retries))
+
+# Map-reduce summarization tasks (see app/summary_jobs.py). Level 0 summarizes
+# document chunks; higher levels summarize batches of partial summaries.
+
+@celery.task(bind=True, max_retries=3)
+def summarize_chunk_task(self, job_id, tenant_id, index, text, level):
+    if level == 0:
+        prompt = f"Summarize the following part of a longer document:\n\n{text}"
+    else:
+        prompt = f"Combine the following partial summaries of one document into a single summary:\n\n{text}"
+    try:
+        summary = complete(tenant_id, prompt, max_tokens=current_app.config['SUMMARY_PARTIAL_MAX_TOKENS'])
+    except Exception as exc:
+        if self.request.retries >= self.max_retries:
+            summary_jobs.publish_event(job_id, "error", {"message": str(exc), "index": index, "level": level})
+            raise
+        self.retry(exc=exc, countdown=backoff(self.request.retries))
+    summary_jobs.publish_event(job_id, "partial", {"index": index, "level": level, "summary": summary})
+    return summary
+
+# The final summary is published to the job's event stream instead of the result backend.
+@celery.task(bind=True, max_retries=3, ignore_result=True)
+def reduce_summaries_task(self, partials, job_id, tenant_id, level):
+    config = current_app.config
+    batches = summary_jobs.batch_partials(partials, config['SUMMARY_REDUCE_MAX_CHARS'])
+    if len(batches) > 1 and level >= config['SUMMARY_REDUCE_MAX_LEVELS']:
+        # Out of levels: fit the partials into the final prompt by cutting them short.
+        partials = summary_jobs.truncate_partials(partials, config['SUMMARY_REDUCE_MAX_CHARS'])
+    elif len(batches) > 1:
+        # Still too long for one prompt: reduce each batch in parallel, then recurse.
+        header = group([
+            summarize_chunk_task.s(job_id, tenant_id, index, "\n\n".join(batch), level)
+            for index, batch in enumerate(batches)
+        ])
+        return self.replace(chord(header, reduce_summaries_task.s(job_id, tenant_id, level + 1)))
+
+    try:
+        if len(partials) == 1:
+            summary = partials[0]
         else:
-            raise Exception(f"Failed to create lead: {response.text}")
+            summary = complete(
+                tenant_id,
+                "Combine the following partial summaries of one document into a single summary:\n\n" + "\n\n".join(partials),
+                max_tokens=config['SUMMARY_FINAL_MAX_TOKENS']
+            )
+    except Exception as exc:
+        if self.request.retries >= self.max_retries:
+            summary_jobs.publish_event(job_id, "error", {"message": str(exc), "level": level})
+            raise
+        self.retry(exc=exc, countdown=backoff(self.request.retries))
+    summary_jobs.cache_summary(job_id, summary)
+    summary_jobs.publish_event(job_id, "final", {"summary": summary})
+    return summary
+
+# Agent chain tasks. Each step of a chain run is a task of its own (see
+# app/chain_engine.py); it runs in the context produced by the steps it depends
+# on and dispatches the dependents that were waiting only for it.
+
+@celery.task(bind=True, max_retries=3)
+def run_chain_step_task(self, run_id, tenant_id, plan, step, result_id=None):
+    from app.chain_engine import ChainInputError, advance_run, execute_step, fail_step  # Avoid circular import
+    try:
+        changes = execute_step(run_id, tenant_id, step)
+    except (ChainInputError, ConditionError, OutcomeUnknown) as exc:
+        # Retrying would fail the same way (or repeat a side effect).
+        fail_step(run_id, step, exc, result_id)
+        raise
+    except CircuitOpen as exc:
+        if self.request.retries >= self.max_retries:
+            fail_step(run_id, step, exc, result_id)
+            raise
+        self.retry(exc=exc, countdown=circuit_backoff(exc))
+    except Exception as exc:
+        if self.request.retries >= self.max_retries:
+            fail_step(run_id, step, exc, result_id)
+            raise
+        self.retry(exc=exc, countdown=backoff(self.request.retries))
+    try:
+        advance_run(run_id, tenant_id, plan, step, changes, result_id)
     except Exception as exc:
-        self.retry(exc=exc)
+        # Not retried: the step may already be recorded as completed, and a
+        # repeated completion starts no dependents. Fail the run instead of
+        # leaving it running until it expires.
+        fail_step(run_id, step, exc, result_id)
+        raise
@@ -0,0 +1,26 @@
+def chunk_text(text, chunk_size=2000, overlap=200):
+    """
+    Splits text into chunks of at most chunk_size characters, each overlapping
+    the previous one by about `overlap` characters. Chunks end on whitespace
+    when possible so words are not cut in half.
+    """
+    if overlap >= chunk_size:
+        raise ValueError("overlap must be smaller than chunk_size")
+    text = text.strip()
+    if len(text) <= chunk_size:
+        return [text] if text else []
+
+    chunks = []
+    start = 0
+    while start < len(text):
+        end = min(start + chunk_size, len(text))
+        if end < len(text):
+            # Prefer to break on the last whitespace in the second half of the chunk.
+            boundary = text.rfind(" ", start + chunk_size // 2, end)
+            if boundary != -1:
+                end = boundary
+        chunks.append(text[start:end].strip())
+        if end >= len(text):
+            break
+        start = max(end - overlap, start + 1)
+    return [chunk for chunk in chunks if chunk]
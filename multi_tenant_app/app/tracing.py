@@ -0,0 +1,222 @@
+"""
+Spans for HTTP requests, Celery tasks and calls to external dependencies.
+
+Every request and task runs in a span, and spans opened while it runs (e.g.
+an OpenAI call inside a task) become its children. The trace context crosses
+from the web process into tasks, and from tasks into the tasks they publish,
+in a W3C `traceparent` message header, so a chain execution, its step tasks
+and their Salesforce and SMTP calls share one trace id. Clients may send a
+traceparent header to join their own trace; responses carry X-Trace-Id.
+
+Finished spans are logged by the "app.tracing" logger at DEBUG level and
+their durations are observed in the histograms of app/metrics.py, labelled by
+tenant and agent (the agent queue of the task, see app/queues.py). Spans
+inherit those labels from their parent. Requests are only labelled with ids of
+existing tenants, so made-up ids in requests cannot create new series.
+"""
+import contextvars
+import inspect
+import logging
+import os
+import re
+import time
+from contextlib import contextmanager
+from flask import g, request
+from celery.signals import before_task_publish, task_prerun, task_postrun
+from app.metrics import REQUEST_DURATION, TASK_DURATION, TASK_QUEUE_WAIT, DEPENDENCY_DURATION
+from app.queues import route_task
+
+logger = logging.getLogger(__name__)
+
+TRACEPARENT_RE = re.compile(r"^00-([0-9a-f]{32})-([0-9a-f]{16})-[0-9a-f]{2}$")
+
+_current = contextvars.ContextVar("current_span", default=None)
+
+class Span:
+    def __init__(self, name, trace_id, parent_id, attributes):
+        self.name = name
+        self.trace_id = trace_id
+        self.span_id = os.urandom(8).hex()
+        self.parent_id = parent_id
+        self.attributes = attributes
+        self.status = "ok"
+        self.start = time.perf_counter()
+        self.duration = None
+
+    @property
+    def traceparent(self):
+        return f"00-{self.trace_id}-{self.span_id}-01"
+
+    def end(self):
+        self.duration = time.perf_counter() - self.start
+        logger.debug(
+            "span %s trace_id=%s span_id=%s parent_id=%s status=%s duration_ms=%.2f %s",
+            self.name, self.trace_id, self.span_id, self.parent_id, self.status,
+            self.duration * 1000, self.attributes
+        )
+        return self.duration
+
+def _start_span(name, traceparent=None, **attributes):
+    """Starts a span as the child of the current span, or of a remote `traceparent`."""
+    parent = _current.get()
+    match = TRACEPARENT_RE.match(traceparent or "")
+    if match:
+        trace_id, parent_id = match.groups()
+    elif parent is not None:
+        trace_id, parent_id = parent.trace_id, parent.span_id
+        # Tenant and agent labels carry over to child spans.
+        attributes = {"tenant": parent.attributes.get("tenant", ""), "agent": parent.attributes.get("agent", ""), **attributes}
+    else:
+        trace_id, parent_id = os.urandom(16).hex(), None
+    return Span(name, trace_id, parent_id, attributes)
+
+@contextmanager
+def span(name, **attributes):
+    current = _start_span(name, **attributes)
+    token = _current.set(current)
+    try:
+        yield current
+    except BaseException:
+        current.status = "error"
+        raise
+    finally:
+        _current.reset(token)
+        current.end()
+
+@contextmanager
+def dependency_call(dependency, operation):
+    """A span around a call to an external dependency, observed in DEPENDENCY_DURATION."""
+    with span(f"{dependency}.{operation}", dependency=dependency) as current:
+        outcome = "error"
+        try:
+            yield current
+            outcome = "ok"
+        finally:
+            DEPENDENCY_DURATION.labels(
+                dependency, operation,
+                current.attributes.get("agent", ""), current.attributes.get("tenant", ""), outcome
+            ).observe(time.perf_counter() - current.start)
+
+# Flask
+
+def request_tenant():
+    """
+    The tenant a request is for ("" if none), read where the views read it: the
+    URL, else the JSON body, else (for uploads such as the NDJSON bulk index)
+    the query string or form.
+    """
+    tenant_id = (request.view_args or {}).get("tenant_id")
+    if tenant_id is None and request.is_json:
+        data = request.get_json(silent=True)
+        if isinstance(data, dict):
+            tenant_id = data.get("tenant_id")
+    elif tenant_id is None:
+        tenant_id = request.args.get("tenant_id") or request.form.get("tenant_id")
+    return "" if tenant_id is None else str(tenant_id)
+
+def request_tenant_id():
+    """
+    The id of the existing tenant the request is for (see request_tenant), or
+    None if it names no tenant or one that does not exist. Looked up once per
+    request.
+    """
+    if "request_tenant_id" not in g:
+        from app.config_cache import tenant_exists  # Avoid circular import
+        tenant = request_tenant()
+        g.request_tenant_id = int(tenant) if tenant.isdigit() and tenant_exists(int(tenant)) else None
+    return g.request_tenant_id
+
+def _tenant_label():
+    try:
+        tenant_id = request_tenant_id()
+    except Exception:
+        logger.exception("Tenant lookup failed")
+        return ""
+    return "" if tenant_id is None else str(tenant_id)
+
+def _before_request():
+    endpoint = request.url_rule.rule if request.url_rule else "unmatched"
+    current = _start_span(
+        f"{request.method} {endpoint}", request.headers.get("traceparent"),
+        endpoint=endpoint, tenant=_tenant_label(), agent=""
+    )
+    g.trace_span = current
+    g.trace_token = _current.set(current)
+
+def _after_request(response):
+    current = g.get("trace_span")
+    if current is not None:
+        g.trace_status = response.status_code
+        response.headers["X-Trace-Id"] = current.trace_id
+    return response
+
+def _teardown_request(exc):
+    g.pop("request_tenant_id", None)
+    current = g.pop("trace_span", None)
+    if current is None:
+        return
+    status = g.pop("trace_status", 500)
+    if exc is not None or status >= 500:
+        current.status = "error"
+    try:
+        _current.reset(g.pop("trace_token"))
+    except ValueError:
+        # Torn down in a different context (e.g. after a streamed response).
+        _current.set(None)
+    duration = current.end()
+    REQUEST_DURATION.labels(
+        current.attributes["endpoint"], request.method, str(status), current.attributes["tenant"]
+    ).observe(duration)
+
+def init_app(app):
+    app.before_request(_before_request)
+    app.after_request(_after_request)
+    app.teardown_request(_teardown_request)
+
+# Celery
+
+_task_spans = {}
+_tenant_params = {}
+
+def _task_labels(task, args, kwargs):
+    """(tenant, agent) of a task invocation."""
+    if task.name not in _tenant_params:
+        _tenant_params[task.name] = inspect.signature(task.run)
+    try:
+        tenant_id = _tenant_params[task.name].bind_partial(*args, **kwargs).arguments.get("tenant_id")
+    except TypeError:
+        tenant_id = None
+    route = route_task(task.name, args, kwargs, {})
+    return "" if tenant_id is None else str(tenant_id), route["queue"] if route else ""
+
+@before_task_publish.connect(weak=False)
+def _inject_trace_context(headers=None, **kwargs):
+    current = _current.get()
+    if current is not None:
+        headers["traceparent"] = current.traceparent
+    headers["published_at"] = time.time()
+
+@task_prerun.connect(weak=False)
+def _start_task_span(task_id=None, task=None, args=None, kwargs=None, **extra):
+    tenant, agent = _task_labels(task, args or (), kwargs or {})
+    published_at = task.request.get("published_at")
+    # Tasks with an ETA (retry countdowns) waited on purpose.
+    if published_at and not task.request.eta and not task.request.is_eager:
+        TASK_QUEUE_WAIT.labels(task.name, agent).observe(max(time.time() - published_at, 0))
+    current = _start_span(task.name, task.request.get("traceparent"), task_id=task_id, tenant=tenant, agent=agent)
+    _task_spans[task_id] = (current, _current.set(current))
+
+@task_postrun.connect(weak=False)
+def _end_task_span(task_id=None, task=None, state=None, **extra):
+    entry = _task_spans.pop(task_id, None)
+    if entry is None:
+        return
+    current, token = entry
+    try:
+        _current.reset(token)
+    except ValueError:
+        _current.set(None)
+    if state not in ("SUCCESS", "RETRY"):
+        current.status = "error"
+    duration = current.end()
+    TASK_DURATION.labels(task.name, current.attributes["agent"], current.attributes["tenant"], state or "").observe(duration)
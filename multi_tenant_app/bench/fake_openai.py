@@ -0,0 +1,66 @@
+"""
+Local OpenAI-compatible server for tests and benchmarks.
+
+Serves /v1/completions and /v1/embeddings with deterministic responses after a
+configurable latency, and reports request counts and peak concurrency at
+/stats. Point the app at it with OPENAI_API_BASE=http://127.0.0.1:8081/v1.
+
+    python bench/fake_openai.py --port 8081 --latency 0.2
+"""
+import argparse
+import asyncio
+import hashlib
+from aiohttp import web
+
+def make_app(latency=0.0, dimensions=1536):
+    stats = {"requests": 0, "in_flight": 0, "peak_in_flight": 0}
+
+    async def handle(request, respond):
+        stats["requests"] += 1
+        stats["in_flight"] += 1
+        stats["peak_in_flight"] = max(stats["peak_in_flight"], stats["in_flight"])
+        try:
+            payload = await request.json()
+            if latency:
+                await asyncio.sleep(latency)
+            return web.json_response(respond(payload))
+        finally:
+            stats["in_flight"] -= 1
+
+    def completion(payload):
+        prompt = payload.get("prompt", "")
+        digest = hashlib.sha256(prompt.encode("utf-8")).hexdigest()[:12]
+        return {
+            "object": "text_completion",
+            "model": payload.get("model"),
+            "choices": [{"index": 0, "text": f" Summary {digest}: {prompt[-80:]}", "finish_reason": "stop"}]
+        }
+
+    def embedding(payload):
+        texts = payload.get("input", [])
+        if isinstance(texts, str):
+            texts = [texts]
+        data = []
+        for index, text in enumerate(texts):
+            seed = hashlib.sha256(text.encode("utf-8")).digest()
+            vector = [(seed[i % len(seed)] - 127.5) / 127.5 for i in range(dimensions)]
+            data.append({"object": "embedding", "index": index, "embedding": vector})
+        return {"object": "list", "model": payload.get("model"), "data": data}
+
+    async def get_stats(request):
+        return web.json_response(stats)
+
+    app = web.Application()
+    app.router.add_post("/v1/completions", lambda request: handle(request, completion))
+    app.router.add_post("/v1/embeddings", lambda request: handle(request, embedding))
+    app.router.add_get("/stats", get_stats)
+    return app
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8081)
+    parser.add_argument("--latency", type=float, default=0.0, help="seconds to wait before each response")
+    parser.add_argument("--dimensions", type=int, default=1536)
+    args = parser.parse_args()
+    web.run_app(make_app(args.latency, args.dimensions), host=args.host, port=args.port)
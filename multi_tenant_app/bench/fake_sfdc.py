@@ -0,0 +1,113 @@
+"""
+Local Salesforce REST stand-in for tests and benchmarks.
+
+Accepts single lead inserts (sobjects/Lead), Composite sObject Collections
+and Bulk API 2.0 ingest jobs, which complete as soon as they are closed.
+Every request waits a configurable latency first; request counts and peak
+concurrency are reported at /stats. Point a tenant's SFDC config at it with
+sfdc_instance_url=http://127.0.0.1:8082.
+
+    python bench/fake_sfdc.py --port 8082 --latency 0.1
+"""
+import argparse
+import asyncio
+import csv
+import io
+import itertools
+from aiohttp import web
+
+def make_app(latency=0.0):
+    stats = {"requests": 0, "in_flight": 0, "peak_in_flight": 0, "leads": 0}
+    ids = itertools.count(1)
+    jobs = {}
+
+    def record_id():
+        return f"00Q{next(ids):015d}"
+
+    @web.middleware
+    async def track(request, handler):
+        if request.path == "/stats":
+            return await handler(request)
+        stats["requests"] += 1
+        stats["in_flight"] += 1
+        stats["peak_in_flight"] = max(stats["peak_in_flight"], stats["in_flight"])
+        try:
+            if latency:
+                await asyncio.sleep(latency)
+            return await handler(request)
+        finally:
+            stats["in_flight"] -= 1
+
+    async def create_lead(request):
+        await request.json()
+        stats["leads"] += 1
+        return web.json_response({"id": record_id(), "success": True, "errors": []}, status=201)
+
+    async def create_collection(request):
+        payload = await request.json()
+        records = payload.get("records", [])
+        stats["leads"] += len(records)
+        return web.json_response([{"id": record_id(), "success": True, "errors": []} for _ in records])
+
+    async def create_job(request):
+        job_id = f"750{len(jobs) + 1:015d}"
+        jobs[job_id] = {"id": job_id, "state": "Open", "rows": []}
+        return web.json_response({"id": job_id, "state": "Open"}, status=201)
+
+    async def upload_job_data(request):
+        job = jobs.get(request.match_info["job_id"])
+        if job is None:
+            raise web.HTTPNotFound()
+        job["rows"].extend(csv.DictReader(io.StringIO(await request.text())))
+        return web.Response(status=201)
+
+    async def close_job(request):
+        job = jobs.get(request.match_info["job_id"])
+        if job is None:
+            raise web.HTTPNotFound()
+        await request.json()
+        job["state"] = "JobComplete"
+        stats["leads"] += len(job["rows"])
+        return web.json_response({"id": job["id"], "state": job["state"]})
+
+    async def get_job(request):
+        job = jobs.get(request.match_info["job_id"])
+        if job is None:
+            raise web.HTTPNotFound()
+        return web.json_response({"id": job["id"], "state": job["state"]})
+
+    async def job_results(request):
+        job = jobs.get(request.match_info["job_id"])
+        if job is None:
+            raise web.HTTPNotFound()
+        buffer = io.StringIO()
+        if request.match_info["kind"] == "successfulResults" and job["rows"]:
+            fields = list(job["rows"][0])
+            writer = csv.DictWriter(buffer, fieldnames=["sf__Id", "sf__Created"] + fields, lineterminator="\n")
+            writer.writeheader()
+            for row in job["rows"]:
+                writer.writerow(dict(row, sf__Id=record_id(), sf__Created="true"))
+        return web.Response(text=buffer.getvalue(), content_type="text/csv")
+
+    async def get_stats(request):
+        return web.json_response(stats)
+
+    app = web.Application(middlewares=[track])
+    prefix = "/services/data/{version}"
+    app.router.add_post(prefix + "/sobjects/Lead/", create_lead)
+    app.router.add_post(prefix + "/composite/sobjects", create_collection)
+    app.router.add_post(prefix + "/jobs/ingest/", create_job)
+    app.router.add_put(prefix + "/jobs/ingest/{job_id}/batches", upload_job_data)
+    app.router.add_patch(prefix + "/jobs/ingest/{job_id}", close_job)
+    app.router.add_get(prefix + "/jobs/ingest/{job_id}", get_job)
+    app.router.add_get(prefix + "/jobs/ingest/{job_id}/{kind}/", job_results)
+    app.router.add_get("/stats", get_stats)
+    return app
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8082)
+    parser.add_argument("--latency", type=float, default=0.0, help="seconds to wait before each response")
+    args = parser.parse_args()
+    web.run_app(make_app(args.latency), host=args.host, port=args.port)
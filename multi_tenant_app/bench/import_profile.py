@@ -0,0 +1,131 @@
+"""
+Cold-start report: import time of the web app and of each Celery worker profile.
+
+Each target starts a fresh interpreter with `python -X importtime`, builds the
+app the way its entry point does (run.py, or celery_worker.py with that
+WORKER_PROFILE) and reports the total import time, the time create_app()
+itself took, and the modules with the largest cumulative import times.
+
+    python bench/import_profile.py
+    python bench/import_profile.py --targets web,worker:email --top 15
+    python bench/import_profile.py --json startup.json
+    python bench/import_profile.py --baseline startup.json --max-regression 0.25
+
+With --baseline, the run fails (exit status 1) when a target's total import
+time or its set of loaded heavy modules (--heavy) grew.
+"""
+import argparse
+import json
+import os
+import subprocess
+import sys
+
+APP_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+WEB = """
+import time
+start = time.perf_counter()
+from app import create_app
+create_app()
+print(time.perf_counter() - start)
+"""
+
+WORKER = """
+import importlib, os, time
+os.environ["DB_POOL_PROFILE"] = "worker"
+start = time.perf_counter()
+from app import create_app
+from app.queues import WORKER_PROFILES
+app = create_app(web=False)
+for module in WORKER_PROFILES[{profile!r}][1]:
+    importlib.import_module(module)
+print(time.perf_counter() - start)
+"""
+
+HEAVY_MODULES = "chromadb,duckdb,aiohttp,requests,pydantic,prometheus_client"
+
+def default_targets():
+    from app.queues import WORKER_PROFILES
+    return ["web"] + [f"worker:{profile}" for profile in WORKER_PROFILES]
+
+def profile(target):
+    if target == "web":
+        code = WEB
+    else:
+        code = WORKER.format(profile=target.split(":", 1)[1])
+    proc = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", code],
+        cwd=APP_DIR, capture_output=True, text=True
+    )
+    if proc.returncode != 0:
+        raise RuntimeError(f"{target} failed:\n{proc.stderr[-2000:]}")
+    modules = {}
+    total_us = 0
+    for line in proc.stderr.splitlines():
+        if not line.startswith("import time:"):
+            continue
+        self_us, cumulative_us, name = line[len("import time:"):].split("|")
+        if not self_us.strip().isdigit():
+            continue  # column headers
+        # Nested imports are indented by two spaces per level; top-level ones add up to the total.
+        if not name[1:].startswith(" "):
+            total_us += int(cumulative_us)
+        modules[name.strip()] = {"self_ms": int(self_us) / 1000, "cumulative_ms": int(cumulative_us) / 1000}
+    return {
+        "create_app_s": float(proc.stdout.strip().splitlines()[-1]),
+        "import_ms": total_us / 1000,
+        "modules": modules,
+    }
+
+def heavy_loaded(result, heavy):
+    return sorted(name for name in heavy if name in result["modules"])
+
+def compare(results, baseline, max_regression, heavy):
+    regressions = []
+    for target, result in results.items():
+        before = baseline.get("results", {}).get(target)
+        if before is None:
+            continue
+        if result["import_ms"] > before["import_ms"] * (1 + max_regression):
+            regressions.append(f"{target}: import time {before['import_ms']:.0f}ms -> {result['import_ms']:.0f}ms")
+        added = set(heavy_loaded(result, heavy)) - set(heavy_loaded(before, heavy))
+        if added:
+            regressions.append(f"{target}: now loads {', '.join(sorted(added))}")
+    return regressions
+
+def print_report(results, top, heavy):
+    for target, result in results.items():
+        print(f"{target}: imports {result['import_ms']:.0f}ms, startup {result['create_app_s'] * 1000:.0f}ms, "
+              f"heavy modules: {', '.join(heavy_loaded(result, heavy)) or '-'}")
+        ranked = sorted(result["modules"].items(), key=lambda item: item[1]["cumulative_ms"], reverse=True)
+        for name, times in ranked[:top]:
+            print(f"  {times['cumulative_ms']:9.1f}ms  {times['self_ms']:8.1f}ms  {name}")
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--targets", help="comma-separated, from: web, worker:<profile> (default: all)")
+    parser.add_argument("--top", type=int, default=10, help="modules listed per target (cumulative, self)")
+    parser.add_argument("--heavy", default=HEAVY_MODULES, help="comma-separated modules tracked for regressions")
+    parser.add_argument("--json", help="write the results to this file")
+    parser.add_argument("--baseline", help="results file of an earlier run to compare against")
+    parser.add_argument("--max-regression", type=float, default=0.25, help="tolerated fraction of regression")
+    args = parser.parse_args()
+
+    sys.path.insert(0, APP_DIR)
+    targets = args.targets.split(",") if args.targets else default_targets()
+    heavy = args.heavy.split(",")
+    results = {target: profile(target) for target in targets}
+    print_report(results, args.top, heavy)
+    if args.json:
+        with open(args.json, "w") as fh:
+            json.dump({"results": results}, fh, indent=2)
+    if args.baseline:
+        with open(args.baseline) as fh:
+            regressions = compare(results, json.load(fh), args.max_regression, heavy)
+        for regression in regressions:
+            print("REGRESSION", regression)
+        if regressions:
+            sys.exit(1)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,340 @@
+"""
+Offline load test of the API.
+
+Runs everything in this process, with no network access: the local stand-ins
+(fake OpenAI from bench/fake_openai.py, fake Salesforce from bench/fake_sfdc.py,
+the SMTP sink from bench/smtp_sink.py), a fakeredis TCP server used as result
+backend and app Redis, the Flask app on a threaded WSGI server and a Celery
+worker with a thread pool consuming from the in-memory broker transport. It then drives the /api/v1 endpoints and
+/chain/execute at each concurrency level and reports latency percentiles and
+throughput.
+
+    python bench/loadtest.py --concurrency 1,8,32 --requests 200 --latency 0.05
+    python bench/loadtest.py --json results.json
+    python bench/loadtest.py --baseline results.json --max-regression 0.25
+
+Asynchronous endpoints are measured twice: the POST that queues the task, and
+end to end until the task is ready (waited for with POST /task_status/watch).
+Payloads are unique per request, so the summary cache and idempotency records
+never short-circuit the work. Throughput and latency count successful requests
+only. With --baseline, the run fails (exit status 1) when a scenario's p95
+latency or throughput is worse than the baseline by more than --max-regression,
+or its error rate exceeds the baseline's by more than --max-error-increase.
+
+Requires the packages in bench/requirements.txt.
+"""
+import argparse
+import asyncio
+import itertools
+import json
+import math
+import os
+import socket
+import sys
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path[:0] = [os.path.dirname(BENCH_DIR), BENCH_DIR]
+
+import requests
+from aiohttp import web
+import fake_openai
+import fake_sfdc
+import smtp_sink
+
+SCENARIOS = ("send_email", "create_lead", "summarize_document", "chain_execute", "search_document")
+READY_STATES = ("SUCCESS", "FAILURE", "REVOKED")
+
+def free_port():
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+class StandIns:
+    """The fake dependencies, served from one event loop in a background thread."""
+
+    def __init__(self, latency, llm_latency):
+        self.openai_port, self.sfdc_port, self.smtp_port = free_port(), free_port(), free_port()
+        self.openai_app = fake_openai.make_app(llm_latency)
+        self.sfdc_app = fake_sfdc.make_app(latency)
+        self.smtp = smtp_sink.SMTPSink(latency)
+        self.loop = asyncio.new_event_loop()
+        threading.Thread(target=self.loop.run_forever, name="bench-stand-ins", daemon=True).start()
+        asyncio.run_coroutine_threadsafe(self._start(), self.loop).result()
+
+    async def _start(self):
+        for app, port in ((self.openai_app, self.openai_port), (self.sfdc_app, self.sfdc_port)):
+            runner = web.AppRunner(app, access_log=None)
+            await runner.setup()
+            await web.TCPSite(runner, "127.0.0.1", port).start()
+        await self.smtp.start("127.0.0.1", self.smtp_port)
+
+    def stats(self):
+        def fetch(port):
+            return requests.get(f"http://127.0.0.1:{port}/stats").json()
+        return {"openai": fetch(self.openai_port), "sfdc": fetch(self.sfdc_port), "smtp": dict(self.smtp.stats)}
+
+def start_fake_redis():
+    from fakeredis import TcpFakeServer
+
+    class Server(TcpFakeServer):
+        # The socketserver default backlog of 5 drops connection bursts, adding 1s SYN retries.
+        request_queue_size = 128
+
+    port = free_port()
+    server = Server(("127.0.0.1", port), server_type="redis")
+    # Connection handler threads must not keep the process alive at exit.
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, name="bench-redis", daemon=True).start()
+    return f"redis://127.0.0.1:{port}/0"
+
+def configure_environment(args, stand_ins, workdir):
+    redis_url = args.redis_url or start_fake_redis()
+    os.environ.update({
+        "REDIS_URL": redis_url,
+        "CELERY_BROKER_URL": args.broker_url or "memory://",
+        "CELERY_RESULT_BACKEND": redis_url,
+        "DATABASE_URL": args.database_url or f"sqlite:///{os.path.join(workdir, 'bench.db')}",
+        "OPENAI_API_BASE": f"http://127.0.0.1:{stand_ins.openai_port}/v1",
+        "OPENAI_API_KEY": "bench",
+        "EMBEDDING_PROVIDER": "openai",
+        "EMBEDDING_CACHE_PATH": os.path.join(workdir, "embedding_cache.sqlite3"),
+        "SMTP_STARTTLS": "false",
+        # One tenant sends everything: keep the limiter in the path but out of the way.
+        "RATE_LIMITS": os.environ.get("RATE_LIMITS", "requests=100000000/60,llm_tokens=100000000000/60"),
+        "LOG_LEVEL": os.environ.get("LOG_LEVEL", "WARNING"),
+    })
+
+def percentiles(samples):
+    if not samples:
+        return None
+    ordered = sorted(samples)
+    def rank(q):
+        return round(ordered[min(len(ordered) - 1, math.ceil(q * len(ordered)) - 1)] * 1000, 2)
+    return {"p50": rank(0.50), "p95": rank(0.95), "p99": rank(0.99), "max": round(ordered[-1] * 1000, 2)}
+
+class LoadTest:
+    def __init__(self, base_url, headers, tenant_id, chain_id):
+        self.base_url = base_url
+        self.headers = headers
+        self.tenant_id = tenant_id
+        self.chain_id = chain_id
+        self.counter = itertools.count()
+        self.local = threading.local()
+
+    def session(self):
+        if not hasattr(self.local, "session"):
+            self.local.session = requests.Session()
+            self.local.session.headers.update(self.headers)
+        return self.local.session
+
+    def post(self, path, payload):
+        response = self.session().post(self.base_url + path, json=payload)
+        return response.status_code, response.json()
+
+    def wait_for_task(self, task_id):
+        known = {task_id: "PENDING"}
+        while True:
+            _, body = self.post("/api/v1/task_status/watch", {"task_ids": [task_id], "known": known, "timeout": 30})
+            for status in body["tasks"].values():
+                known[task_id] = status["status"]
+            if known[task_id] in READY_STATES:
+                return known[task_id] == "SUCCESS"
+
+    def payload(self, scenario, n):
+        tenant_id = self.tenant_id
+        document = f"Benchmark document {n}. " + "The quarterly report covers revenue, churn and hiring. " * 40
+        if scenario == "send_email":
+            return "/api/v1/send_email", {"tenant_id": tenant_id, "recipient": f"user{n}@example.com", "subject": "Benchmark", "body": f"Message {n}"}
+        if scenario == "create_lead":
+            return "/api/v1/create_lead", {"tenant_id": tenant_id, "lead_data": {"LastName": f"Lead {n}", "Company": "Bench Inc."}}
+        if scenario == "summarize_document":
+            return "/api/v1/summarize_document", {"tenant_id": tenant_id, "document_text": document}
+        if scenario == "chain_execute":
+            return "/api/v1/chain/execute", {"tenant_id": tenant_id, "chain_id": self.chain_id, "input": {
+                "document_text": document,
+                "lead_data": {"LastName": f"Lead {n}", "Company": "Bench Inc."},
+                "email_params": {"recipient": f"user{n}@example.com", "subject": "Benchmark", "body": f"Message {n}"}
+            }}
+        if scenario == "search_document":
+            return "/api/v1/search_document", {"tenant_id": tenant_id, "query_text": f"revenue question {n}", "n_results": 3}
+        raise ValueError(f"Unknown scenario: {scenario}")
+
+    def one(self, scenario):
+        """Runs one request; returns (ok, latency, end-to-end latency or None)."""
+        path, payload = self.payload(scenario, next(self.counter))
+        start = time.perf_counter()
+        status, body = self.post(path, payload)
+        latency = time.perf_counter() - start
+        if status == 202 and "task_id" in body:
+            ok = self.wait_for_task(body["task_id"])
+            return ok, latency, time.perf_counter() - start
+        ok = status < 400 and body.get("status", "success") == "success"
+        return ok, latency, None
+
+    def run(self, scenario, concurrency, total):
+        remaining = itertools.count()
+        samples = []
+
+        def worker():
+            while next(remaining) < total:
+                try:
+                    samples.append(self.one(scenario))
+                except Exception:
+                    samples.append((False, None, None))
+
+        start = time.perf_counter()
+        with ThreadPoolExecutor(concurrency) as executor:
+            for _ in range(concurrency):
+                executor.submit(worker)
+        elapsed = time.perf_counter() - start
+        end_to_end = [sample[2] for sample in samples if sample[0] and sample[2] is not None]
+        return {
+            "scenario": scenario,
+            "concurrency": concurrency,
+            "requests": len(samples),
+            "errors": sum(1 for sample in samples if not sample[0]),
+            "throughput": round(sum(1 for sample in samples if sample[0]) / elapsed, 2),
+            "latency_ms": percentiles([sample[1] for sample in samples if sample[0]]),
+            "end_to_end_ms": percentiles(end_to_end),
+        }
+
+def setup_tenant(client, headers, stand_ins, index_documents):
+    response = client.post("/api/v1/admin/setup_tenant", headers=headers, json={
+        "tenant_name": f"bench-{os.getpid()}-{int(time.time())}",
+        "email_config": {"smtp_server": "127.0.0.1", "smtp_port": stand_ins.smtp_port, "smtp_username": "bench", "smtp_password": "bench"},
+        "doc_sum_config": {"summarizer_setting": "default"},
+        "sfdc_config": {"sfdc_instance_url": f"http://127.0.0.1:{stand_ins.sfdc_port}", "sfdc_access_token": "bench"},
+    })
+    assert response.status_code == 201, response.get_data(as_text=True)
+    tenant_id = response.get_json()["tenant_id"]
+    response = client.post("/api/v1/chain/create", headers=headers, json={"tenant_id": tenant_id, "name": "bench", "steps": [
+        {"step_order": 1, "agent_name": "doc_sum"},
+        {"step_order": 2, "agent_name": "sfdc", "condition": "input_data.get('summary') is not None"},
+        {"step_order": 3, "agent_name": "email", "depends_on": [1]},
+    ]})
+    assert response.status_code == 201, response.get_data(as_text=True)
+    chain_id = response.get_json()["chain_id"]
+    for n in range(index_documents):
+        client.post("/api/v1/index_document", headers=headers, json={
+            "tenant_id": tenant_id, "document_id": f"doc{n}",
+            "document_text": f"Document {n} about revenue, churn and hiring in region {n % 7}."
+        })
+    return tenant_id, chain_id
+
+def error_rate(result):
+    return result["errors"] / result["requests"] if result["requests"] else 0.0
+
+def compare(results, baseline, max_regression, max_error_increase=0.01):
+    """Returns the regressions of results against a baseline run."""
+    previous = {(result["scenario"], result["concurrency"]): result for result in baseline["results"]}
+    regressions = []
+    for result in results:
+        base = previous.get((result["scenario"], result["concurrency"]))
+        if base is None:
+            continue
+        key = "end_to_end_ms" if result["end_to_end_ms"] else "latency_ms"
+        if result[key] and base[key] and result[key]["p95"] > base[key]["p95"] * (1 + max_regression):
+            regressions.append(f"{result['scenario']} x{result['concurrency']}: p95 {base[key]['p95']} -> {result[key]['p95']} ms")
+        if result["throughput"] < base["throughput"] * (1 - max_regression):
+            regressions.append(f"{result['scenario']} x{result['concurrency']}: throughput {base['throughput']} -> {result['throughput']} req/s")
+        # Failing fast would otherwise pass as lower latency.
+        if error_rate(result) > error_rate(base) + max_error_increase:
+            regressions.append(f"{result['scenario']} x{result['concurrency']}: errors {base['errors']}/{base['requests']} -> {result['errors']}/{result['requests']}")
+    return regressions
+
+def print_report(results):
+    print(f"{'scenario':<20}{'conc':>5}{'reqs':>6}{'errs':>6}{'req/s':>9}  {'p50':>8}{'p95':>8}{'p99':>8}  {'e2e p50':>8}{'e2e p95':>8}{'e2e p99':>8}")
+    for result in results:
+        latency = result["latency_ms"] or {}
+        end_to_end = result["end_to_end_ms"] or {}
+        print(
+            f"{result['scenario']:<20}{result['concurrency']:>5}{result['requests']:>6}{result['errors']:>6}{result['throughput']:>9}  "
+            + "".join(f"{latency.get(q, '-'):>8}" for q in ("p50", "p95", "p99")) + "  "
+            + "".join(f"{end_to_end.get(q, '-'):>8}" for q in ("p50", "p95", "p99"))
+        )
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--scenarios", default=",".join(SCENARIOS), help="comma-separated, from: " + ", ".join(SCENARIOS))
+    parser.add_argument("--concurrency", default="1,8,32", help="comma-separated concurrency levels")
+    parser.add_argument("--requests", type=int, default=200, help="requests per scenario and concurrency level")
+    parser.add_argument("--warmup", type=int, default=5, help="unmeasured requests per scenario")
+    parser.add_argument("--latency", type=float, default=0.02, help="Salesforce and SMTP stand-in latency (s)")
+    parser.add_argument("--llm-latency", type=float, default=0.2, help="OpenAI stand-in latency (s)")
+    parser.add_argument("--worker-concurrency", type=int, default=32, help="Celery worker threads")
+    parser.add_argument("--index-documents", type=int, default=200, help="documents indexed before search_document")
+    parser.add_argument("--redis-url", help="use this Redis instead of an in-process fakeredis server")
+    parser.add_argument("--broker-url", help="use this Celery broker instead of the in-process memory transport")
+    parser.add_argument("--database-url", help="use this database instead of a temporary SQLite file")
+    parser.add_argument("--json", help="write the results to this file")
+    parser.add_argument("--baseline", help="results file of an earlier run to compare against")
+    parser.add_argument("--max-regression", type=float, default=0.25, help="tolerated fraction of regression")
+    parser.add_argument("--max-error-increase", type=float, default=0.01, help="tolerated increase of the error rate")
+    args = parser.parse_args()
+    scenarios = [scenario for scenario in args.scenarios.split(",") if scenario]
+    levels = [int(level) for level in args.concurrency.split(",")]
+
+    output = os.path.abspath(args.json) if args.json else None
+    baseline = os.path.abspath(args.baseline) if args.baseline else None
+    workdir = tempfile.mkdtemp(prefix="bench-")
+    stand_ins = StandIns(args.latency, args.llm_latency)
+    configure_environment(args, stand_ins, workdir)
+    # Chroma persists to the working directory.
+    os.chdir(workdir)
+
+    from celery.contrib.testing.worker import start_worker
+    from flask_jwt_extended import create_access_token
+    from werkzeug.serving import make_server
+    from app import celery, create_app, db
+
+    app = create_app()
+    if not args.broker_url:
+        # The memory transport polls its queues; the default interval of one second would dominate every task.
+        celery.conf.broker_transport_options = dict(celery.conf.broker_transport_options, polling_interval=0.005)
+    with app.app_context():
+        db.create_all()
+        headers = {"Authorization": "Bearer " + create_access_token(identity="bench")}
+    tenant_id, chain_id = setup_tenant(app.test_client(), headers, stand_ins, args.index_documents if "search_document" in scenarios else 0)
+
+    port = free_port()
+    server = make_server("127.0.0.1", port, app, threaded=True)
+    threading.Thread(target=server.serve_forever, name="bench-http", daemon=True).start()
+    load_test = LoadTest(f"http://127.0.0.1:{port}", headers, tenant_id, chain_id)
+
+    results = []
+    with start_worker(celery, pool="threads", concurrency=args.worker_concurrency, perform_ping_check=False, loglevel="WARNING"):
+        for scenario in scenarios:
+            for _ in range(args.warmup):
+                load_test.one(scenario)
+            for concurrency in levels:
+                results.append(load_test.run(scenario, concurrency, args.requests))
+    server.shutdown()
+    with app.app_context():
+        from app import llm_client
+        client, loop = llm_client.get_llm_client()
+        loop.run(client.close())
+
+    print_report(results)
+    report = {
+        "settings": {key: value for key, value in vars(args).items() if key not in ("json", "baseline")},
+        "results": results,
+        "dependencies": stand_ins.stats(),
+    }
+    print(json.dumps(report["dependencies"]))
+    if output:
+        with open(output, "w") as fh:
+            json.dump(report, fh, indent=2)
+    if baseline:
+        with open(baseline) as fh:
+            regressions = compare(results, json.load(fh), args.max_regression, args.max_error_increase)
+        for regression in regressions:
+            print("REGRESSION", regression)
+        if regressions:
+            sys.exit(1)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,86 @@
+"""
+Local SMTP sink for tests and benchmarks.
+
+Speaks enough SMTP for smtplib (EHLO, AUTH PLAIN/LOGIN with any credentials,
+MAIL, RCPT, DATA, RSET, NOOP, QUIT), accepts every message after a
+configurable latency and discards it. STARTTLS is not offered, so run the
+app with SMTP_STARTTLS=false and point a tenant's email config at it with
+smtp_server=127.0.0.1, smtp_port=8025.
+
+    python bench/smtp_sink.py --port 8025 --latency 0.05
+"""
+import argparse
+import asyncio
+
+class SMTPSink:
+    def __init__(self, latency=0.0):
+        self.latency = latency
+        self.stats = {"connections": 0, "messages": 0, "recipients": 0}
+
+    async def handle(self, reader, writer):
+        self.stats["connections"] += 1
+
+        async def reply(line):
+            writer.write(line.encode("ascii") + b"\r\n")
+            await writer.drain()
+
+        try:
+            await reply("220 localhost SMTP sink ready")
+            while True:
+                line = await reader.readline()
+                if not line:
+                    break
+                command = line.decode("utf-8", "replace").strip()
+                verb = command.split(" ", 1)[0].upper()
+                if verb == "EHLO":
+                    await reply("250-localhost")
+                    await reply("250-AUTH PLAIN LOGIN")
+                    await reply("250 8BITMIME")
+                elif verb == "HELO":
+                    await reply("250 localhost")
+                elif verb == "AUTH":
+                    if command.upper().startswith("AUTH LOGIN"):
+                        # Prompt for the username (unless sent with the command) and
+                        # password; any credentials are accepted.
+                        for prompt in ["334 VXNlcm5hbWU6", "334 UGFzc3dvcmQ6"][len(command.split()) - 2:]:
+                            await reply(prompt)
+                            await reader.readline()
+                    await reply("235 Authentication successful")
+                elif verb == "RCPT":
+                    self.stats["recipients"] += 1
+                    await reply("250 OK")
+                elif verb == "DATA":
+                    await reply("354 End data with <CR><LF>.<CR><LF>")
+                    while (await reader.readline()) not in (b".\r\n", b".\n", b""):
+                        pass
+                    if self.latency:
+                        await asyncio.sleep(self.latency)
+                    self.stats["messages"] += 1
+                    await reply("250 OK: queued")
+                elif verb == "QUIT":
+                    await reply("221 Bye")
+                    break
+                elif verb in ("MAIL", "RSET", "NOOP"):
+                    await reply("250 OK")
+                else:
+                    await reply("502 Command not implemented")
+        except ConnectionError:
+            pass
+        finally:
+            writer.close()
+
+    async def start(self, host, port):
+        return await asyncio.start_server(self.handle, host, port)
+
+async def main(host, port, latency):
+    server = await SMTPSink(latency).start(host, port)
+    async with server:
+        await server.serve_forever()
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8025)
+    parser.add_argument("--latency", type=float, default=0.0, help="seconds to wait before accepting each message")
+    args = parser.parse_args()
+    asyncio.run(main(args.host, args.port, args.latency))
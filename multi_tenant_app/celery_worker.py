@@ -1,4 +1,26 @@
-from app import celery, app
+import importlib
+import os
+
+# Workers use the worker connection pool profile (see app/config.py).
+os.environ.setdefault('DB_POOL_PROFILE', 'worker')
+
+from celery.signals import celeryd_init
+from app import celery, create_app
+from app.queues import WORKER_PROFILES
+
+app = create_app(web=False)
+
+@celeryd_init.connect
+def apply_worker_profile(sender=None, instance=None, options=None, **kwargs):
+    """
+    Consumes the queues of WORKER_PROFILE (unless -Q was given) and imports its
+    modules in the parent, so that forked pool children share them.
+    """
+    queues, modules = WORKER_PROFILES[app.config['WORKER_PROFILE']]
+    if queues and not (options or {}).get('queues'):
+        instance.app.amqp.queues.select(queues)
+    for module in modules:
+        importlib.import_module(module)
 
 if __name__ == '__main__':
     with app.app_context():
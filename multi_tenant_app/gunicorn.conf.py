@@ -0,0 +1,48 @@
+"""
+Production serving configuration:
+
+    gunicorn -c gunicorn.conf.py run:app
+
+Workers use gevent by default, so each process holds up to
+GUNICORN_WORKER_CONNECTIONS concurrent requests: long polls, SSE streams and
+searches waiting on the embedding API or Redis cost a greenlet rather than a
+thread. Chroma calls, which block in C code, run on the bounded native thread
+pool of app/offload.py. GUNICORN_WORKER_CLASS=gthread falls back to
+GUNICORN_THREADS threads per worker.
+
+The embedded Chroma store (no CHROMA_SERVER_HOST) belongs to the process that
+opened it: other workers would not see its documents, and each would persist
+its own copy over the others'. Without a Chroma server there is one worker by
+default; set CHROMA_SERVER_HOST to scale out.
+"""
+import multiprocessing
+import os
+
+bind = os.environ.get('GUNICORN_BIND', '0.0.0.0:5000')
+worker_class = os.environ.get('GUNICORN_WORKER_CLASS', 'gevent')
+default_workers = multiprocessing.cpu_count() * 2 + 1 if os.environ.get('CHROMA_SERVER_HOST') else 1
+workers = int(os.environ.get('GUNICORN_WORKERS', default_workers))
+worker_connections = int(os.environ.get('GUNICORN_WORKER_CONNECTIONS', 1000))
+threads = int(os.environ.get('GUNICORN_THREADS', 32))
+backlog = int(os.environ.get('GUNICORN_BACKLOG', 2048))
+keepalive = int(os.environ.get('GUNICORN_KEEPALIVE', 5))
+# Sync workers are killed after `timeout` seconds on one request; keep it above
+# CHAIN_SYNC_TIMEOUT and the SSE timeouts if you switch to them.
+timeout = int(os.environ.get('GUNICORN_TIMEOUT', 60))
+graceful_timeout = int(os.environ.get('GUNICORN_GRACEFUL_TIMEOUT', 30))
+# Recycle workers periodically; the jitter keeps them from restarting together.
+max_requests = int(os.environ.get('GUNICORN_MAX_REQUESTS', 10000))
+max_requests_jitter = int(os.environ.get('GUNICORN_MAX_REQUESTS_JITTER', 1000))
+accesslog = os.environ.get('GUNICORN_ACCESS_LOG', '-')
+
+def post_worker_init(worker):
+    # psycopg2 waits in C code; make it yield to the gevent hub instead.
+    from app.offload import gevent_active
+    if gevent_active():
+        from psycogreen.gevent import patch_psycopg
+        patch_psycopg()
+
+def child_exit(server, worker):
+    if 'PROMETHEUS_MULTIPROC_DIR' in os.environ:
+        from prometheus_client import multiprocess
+        multiprocess.mark_process_dead(worker.pid)
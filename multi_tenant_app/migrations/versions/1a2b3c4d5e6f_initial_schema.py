@@ -0,0 +1,83 @@
+"""initial schema
+
+Databases created earlier by db.create_all() already have these tables; mark
+them as migrated with `flask db stamp 1a2b3c4d5e6f` before upgrading. Such a
+database may also have columns and indexes of later revisions, depending on
+the release that created it; those revisions skip what already exists.
+
+Revision ID: 1a2b3c4d5e6f
+Revises: 
+Create Date: 2026-10-18 15:00:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '1a2b3c4d5e6f'
+down_revision = None
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table('tenants',
+    sa.Column('id', sa.Integer(), nullable=False),
+    sa.Column('name', sa.String(length=100), nullable=False),
+    sa.PrimaryKeyConstraint('id'),
+    sa.UniqueConstraint('name')
+    )
+    op.create_table('agent_chain',
+    sa.Column('id', sa.Integer(), nullable=False),
+    sa.Column('tenant_id', sa.Integer(), nullable=False),
+    sa.Column('name', sa.String(length=100), nullable=False),
+    sa.ForeignKeyConstraint(['tenant_id'], ['tenants.id'], ),
+    sa.PrimaryKeyConstraint('id')
+    )
+    op.create_table('document_summarizer_config',
+    sa.Column('id', sa.Integer(), nullable=False),
+    sa.Column('tenant_id', sa.Integer(), nullable=True),
+    sa.Column('summarizer_setting', sa.String(length=255), nullable=False),
+    sa.Column('is_global', sa.Boolean(), nullable=True),
+    sa.ForeignKeyConstraint(['tenant_id'], ['tenants.id'], ),
+    sa.PrimaryKeyConstraint('id')
+    )
+    op.create_table('email_agent_config',
+    sa.Column('id', sa.Integer(), nullable=False),
+    sa.Column('tenant_id', sa.Integer(), nullable=True),
+    sa.Column('smtp_server', sa.String(length=255), nullable=False),
+    sa.Column('smtp_port', sa.Integer(), nullable=False),
+    sa.Column('smtp_username', sa.String(length=255), nullable=False),
+    sa.Column('smtp_password', sa.String(length=255), nullable=False),
+    sa.Column('is_global', sa.Boolean(), nullable=True),
+    sa.ForeignKeyConstraint(['tenant_id'], ['tenants.id'], ),
+    sa.PrimaryKeyConstraint('id')
+    )
+    op.create_table('sfdc_config',
+    sa.Column('id', sa.Integer(), nullable=False),
+    sa.Column('tenant_id', sa.Integer(), nullable=True),
+    sa.Column('sfdc_instance_url', sa.String(length=255), nullable=False),
+    sa.Column('sfdc_access_token', sa.String(length=255), nullable=False),
+    sa.Column('is_global', sa.Boolean(), nullable=True),
+    sa.ForeignKeyConstraint(['tenant_id'], ['tenants.id'], ),
+    sa.PrimaryKeyConstraint('id')
+    )
+    op.create_table('agent_chain_step',
+    sa.Column('id', sa.Integer(), nullable=False),
+    sa.Column('agent_chain_id', sa.Integer(), nullable=False),
+    sa.Column('step_order', sa.Integer(), nullable=False),
+    sa.Column('agent_name', sa.String(length=50), nullable=False),
+    sa.Column('condition', sa.String(length=255), nullable=True),
+    sa.ForeignKeyConstraint(['agent_chain_id'], ['agent_chain.id'], ),
+    sa.PrimaryKeyConstraint('id')
+    )
+
+
+def downgrade():
+    op.drop_table('agent_chain_step')
+    op.drop_table('sfdc_config')
+    op.drop_table('email_agent_config')
+    op.drop_table('document_summarizer_config')
+    op.drop_table('agent_chain')
+    op.drop_table('tenants')
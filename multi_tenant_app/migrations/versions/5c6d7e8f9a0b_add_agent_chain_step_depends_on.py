@@ -0,0 +1,29 @@
+"""add agent_chain_step.depends_on
+
+Revision ID: 5c6d7e8f9a0b
+Revises: 1a2b3c4d5e6f
+Create Date: 2026-10-18 15:00:01.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '5c6d7e8f9a0b'
+down_revision = '1a2b3c4d5e6f'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    # Databases made by db.create_all() since the column was added already have it.
+    if 'depends_on' in {column['name'] for column in sa.inspect(op.get_bind()).get_columns('agent_chain_step')}:
+        return
+    with op.batch_alter_table('agent_chain_step', schema=None) as batch_op:
+        batch_op.add_column(sa.Column('depends_on', sa.String(length=255), nullable=True))
+
+
+def downgrade():
+    with op.batch_alter_table('agent_chain_step', schema=None) as batch_op:
+        batch_op.drop_column('depends_on')
@@ -0,0 +1,52 @@
+"""add tenant lookup indexes
+
+Revision ID: 9d0e1f2a3b4c
+Revises: 5c6d7e8f9a0b
+Create Date: 2026-10-18 15:00:02.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '9d0e1f2a3b4c'
+down_revision = '5c6d7e8f9a0b'
+branch_labels = None
+depends_on = None
+
+
+INDEXES = [
+    ('agent_chain', 'ix_agent_chain_tenant_id', ['tenant_id']),
+    ('agent_chain_step', 'ix_agent_chain_step_agent_chain_id_step_order', ['agent_chain_id', 'step_order']),
+    ('document_summarizer_config', 'ix_document_summarizer_config_tenant_id_is_global', ['tenant_id', 'is_global']),
+    ('email_agent_config', 'ix_email_agent_config_tenant_id_is_global', ['tenant_id', 'is_global']),
+    ('sfdc_config', 'ix_sfdc_config_tenant_id_is_global', ['tenant_id', 'is_global']),
+]
+
+
+def upgrade():
+    inspector = sa.inspect(op.get_bind())
+    for table, name, columns in INDEXES:
+        # Databases made by db.create_all() since the indexes were added already have them.
+        if name in {index['name'] for index in inspector.get_indexes(table)}:
+            continue
+        with op.batch_alter_table(table, schema=None) as batch_op:
+            batch_op.create_index(name, columns, unique=False)
+
+
+def downgrade():
+    with op.batch_alter_table('sfdc_config', schema=None) as batch_op:
+        batch_op.drop_index('ix_sfdc_config_tenant_id_is_global')
+
+    with op.batch_alter_table('email_agent_config', schema=None) as batch_op:
+        batch_op.drop_index('ix_email_agent_config_tenant_id_is_global')
+
+    with op.batch_alter_table('document_summarizer_config', schema=None) as batch_op:
+        batch_op.drop_index('ix_document_summarizer_config_tenant_id_is_global')
+
+    with op.batch_alter_table('agent_chain_step', schema=None) as batch_op:
+        batch_op.drop_index('ix_agent_chain_step_agent_chain_id_step_order')
+
+    with op.batch_alter_table('agent_chain', schema=None) as batch_op:
+        batch_op.drop_index(batch_op.f('ix_agent_chain_tenant_id'))
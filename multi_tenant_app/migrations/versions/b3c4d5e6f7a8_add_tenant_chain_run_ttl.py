@@ -0,0 +1,29 @@
+"""add tenants.chain_run_ttl_seconds
+
+Revision ID: b3c4d5e6f7a8
+Revises: 9d0e1f2a3b4c
+Create Date: 2026-10-18 16:00:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'b3c4d5e6f7a8'
+down_revision = '9d0e1f2a3b4c'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    # Databases made by db.create_all() since the column was added already have it.
+    if 'chain_run_ttl_seconds' in {column['name'] for column in sa.inspect(op.get_bind()).get_columns('tenants')}:
+        return
+    with op.batch_alter_table('tenants', schema=None) as batch_op:
+        batch_op.add_column(sa.Column('chain_run_ttl_seconds', sa.Integer(), nullable=True))
+
+
+def downgrade():
+    with op.batch_alter_table('tenants', schema=None) as batch_op:
+        batch_op.drop_column('chain_run_ttl_seconds')
@@ -1,4 +1,7 @@
-from app import app
+from app import create_app
 
+app = create_app()
+
+# Development server; in production run `gunicorn -c gunicorn.conf.py run:app`.
 if __name__ == '__main__':
     app.run(debug=True)
@@ -0,0 +1,59 @@
+"""
+Shared fixtures: the app on an in-memory SQLite database, an in-process Redis
+(fakeredis, with Lua support for the rate limiter, caches and breakers) and
+Celery tasks run eagerly in the calling thread.
+
+    pip install -r requirements.txt -r tests/requirements.txt
+    python -m pytest tests
+"""
+import fakeredis
+import pytest
+from flask_jwt_extended import create_access_token
+from app import celery, chain_definitions, config_cache, create_app, db, redis_client
+from app.config import Config
+
+class TestConfig(Config):
+    TESTING = True
+    SQLALCHEMY_DATABASE_URI = 'sqlite://'
+    SQLALCHEMY_ENGINE_OPTIONS = {}
+    CELERY_BROKER_URL = 'memory://'
+    CELERY_RESULT_BACKEND = 'cache+memory://'
+    REDIS_URL = 'redis://tests/0'
+
+# One client for the whole run: modules register their Lua scripts on the
+# first client they see.
+_redis = fakeredis.FakeRedis(server=fakeredis.FakeServer())
+
+@pytest.fixture
+def redis():
+    _redis.flushall()
+    return _redis
+
+@pytest.fixture
+def app(redis):
+    app = create_app(TestConfig)
+    redis_client._clients[app.config['REDIS_URL']] = redis
+    celery.conf.task_always_eager = True
+    celery.conf.task_eager_propagates = True
+    with app.app_context():
+        db.create_all()
+        # Process-wide caches outlive the database of the previous test.
+        config_cache._get_cache().clear()
+        chain_definitions._get_cache().clear()
+        yield app
+        db.session.remove()
+        db.drop_all()
+
+@pytest.fixture
+def client(app):
+    return app.test_client()
+
+@pytest.fixture
+def auth_headers(app):
+    return {"Authorization": "Bearer " + create_access_token(identity="admin")}
+
+@pytest.fixture
+def tenant(client, auth_headers):
+    response = client.post("/api/v1/admin/setup_tenant", json={"tenant_name": "Acme"}, headers=auth_headers)
+    assert response.status_code == 201, response.json
+    return response.json["tenant_id"]
@@ -0,0 +1,134 @@
+import pytest
+from app import chain_engine, chain_runs, tasks
+from app.chain_dag import ChainGraphError, plan_steps
+
+def steps(*dependencies):
+    return [{"step_order": order, "depends_on": depends_on} for order, depends_on in enumerate(dependencies, 1)]
+
+def test_plan_resolves_dependents_and_ancestors():
+    # 1 and 2 are roots; 3 waits for 1, 4 for 2, and 5 for 3 and 4.
+    plan = plan_steps(steps([], [], [1], [2], [3, 4]))
+
+    by_order = {step["step_order"]: step for step in plan}
+    assert [step["step_order"] for step in plan] == [1, 2, 3, 4, 5]
+    assert by_order[2]["dependents"] == [4]
+    assert by_order[5]["ancestors"] == [1, 2, 3, 4]
+    assert by_order[4]["ancestors"] == [2]
+
+def test_plan_keeps_sequential_default_and_rejects_cycles():
+    plan = plan_steps(steps(None, None, []))
+    assert [(step["step_order"], step["depends_on"]) for step in plan] == [(1, []), (3, []), (2, [1])]
+    with pytest.raises(ChainGraphError):
+        plan_steps(steps([2], [1]))
+
+def test_step_is_dispatched_when_its_own_dependencies_finish(app, monkeypatch):
+    # 3 waits for 1 and 4 for 2. Finishing 2 starts 4 while 1 is still running.
+    plan = [dict(step, id=step["step_order"], agent_name="email", condition=None)
+            for step in plan_steps(steps([], [], [1], [2]))]
+    chain_runs.create_run("run", 1, 1, plan, input_data={})
+    dispatched = []
+    monkeypatch.setattr(chain_engine, "dispatch_step", lambda run_id, tenant_id, plan, step, result_id: dispatched.append(step["step_order"]))
+
+    chain_engine.advance_run("run", 1, plan, plan[1], {"input": {}, "result": {}})
+    assert dispatched == [4]
+
+    # A repeated completion of the same step dispatches nothing.
+    chain_engine.advance_run("run", 1, plan, plan[1], {"input": {}, "result": {}})
+    assert dispatched == [4]
+
+@pytest.fixture
+def agents(monkeypatch):
+    calls = []
+    monkeypatch.setattr(tasks, "summarize_document", lambda tenant_id, text: calls.append("doc_sum") or "the summary")
+    monkeypatch.setattr(tasks, "create_lead", lambda tenant_id, lead: calls.append(("sfdc", dict(lead))) or "Lead created")
+    monkeypatch.setattr(tasks, "send_email", lambda tenant_id, *args: calls.append("email") or "Email sent")
+    return calls
+
+def create_chain(client, auth_headers, tenant, chain_steps):
+    response = client.post(
+        "/api/v1/chain/create", headers=auth_headers, json={"tenant_id": tenant, "name": "c", "steps": chain_steps}
+    )
+    assert response.status_code == 201, response.json
+    return response.json["chain_id"]
+
+def test_steps_see_only_their_dependencies_changes(client, auth_headers, tenant, agents):
+    chain_id = create_chain(client, auth_headers, tenant, [
+        {"step_order": 1, "agent_name": "doc_sum", "depends_on": []},
+        {"step_order": 2, "agent_name": "sfdc", "depends_on": [1]},
+        # Runs alongside the summary, so it never sees one.
+        {"step_order": 3, "agent_name": "email", "depends_on": [], "condition": "input_data.get('summary') is None"},
+        # Step 3 passes lead_data on unchanged; that must not undo step 2's Description.
+        {"step_order": 4, "agent_name": "email", "depends_on": [2, 3],
+         "condition": "input_data.get('lead_data').get('Description') == 'the summary'"},
+    ])
+
+    response = client.post("/api/v1/chain/execute", headers=auth_headers, json={
+        "tenant_id": tenant, "chain_id": chain_id,
+        "input": {"document_text": "text", "lead_data": {"LastName": "Doe"}, "email_params": {"recipient": "a@b.c"}}
+    })
+
+    assert response.status_code == 200, response.json
+    assert response.json["result"] == {"doc_sum": "the summary", "sfdc": "Lead created", "email": "Email sent"}
+    assert agents.count("email") == 2
+    assert ("sfdc", {"LastName": "Doe", "Description": "the summary"}) in agents
+    run = client.get(f"/api/v1/chain/runs/{response.json['run_id']}?tenant_id={tenant}", headers=auth_headers).json
+    assert run["status"] == "succeeded"
+    assert [step["status"] for step in run["steps"]] == ["succeeded"] * 4
+
+def test_run_is_reported_to_the_tenant_that_started_it_only(client, auth_headers, tenant):
+    other = client.post("/api/v1/admin/setup_tenant", json={"tenant_name": "Other"}, headers=auth_headers).json["tenant_id"]
+    plan = [dict(step, id=1, agent_name="doc_sum", condition=None) for step in plan_steps(steps([]))]
+    chain_runs.create_run("run", str(tenant), 1, plan, input_data={"document_text": "text"})
+
+    assert client.get(f"/api/v1/chain/runs/run?tenant_id={tenant}", headers=auth_headers).status_code == 200
+    response = client.get(f"/api/v1/chain/runs/run?tenant_id={other}", headers=auth_headers)
+    assert response.status_code == 404
+    assert response.json == {"error": "Chain run not found"}
+    assert client.get("/api/v1/chain/runs/run", headers=auth_headers).status_code == 400
+
+def test_dependent_doc_sum_step_is_completed_from_the_summary_cache(app, monkeypatch):
+    from app import summary_cache
+
+    # 2 summarizes the document once 1 has run; 3 waits for the summary.
+    plan = [dict(step, id=step["step_order"], agent_name=agent, condition=None)
+            for step, agent in zip(plan_steps(steps([], [1], [2])), ["email", "doc_sum", "email"])]
+    chain_runs.create_run("run", 1, 1, plan, input_data={"document_text": "text"})
+    summary_cache.put(summary_cache.cache_key(1, "text"), "cached summary")
+    dispatched = []
+    monkeypatch.setattr(chain_engine, "dispatch_step", lambda run_id, tenant_id, plan, step, result_id: dispatched.append(step["step_order"]))
+
+    chain_engine.advance_run("run", 1, plan, plan[0], {"input": {}, "result": {}})
+
+    assert dispatched == [3]
+    assert chain_engine.step_context("run", plan[2])["input"]["summary"] == "cached summary"
+
+def test_run_fails_when_its_steps_cannot_be_advanced(app, monkeypatch):
+    plan = [dict(step, id=step["step_order"], agent_name="doc_sum", condition=None)
+            for step in plan_steps(steps([], [1]))]
+    chain_runs.create_run("run", 1, 1, plan, input_data={"document_text": "text"})
+    monkeypatch.setattr(tasks, "summarize_document", lambda tenant_id, text: "the summary")
+
+    def unavailable(*args):
+        raise ConnectionError("Redis is unavailable")
+    monkeypatch.setattr(chain_runs, "complete_step", unavailable)
+
+    with pytest.raises(ConnectionError):
+        tasks.run_chain_step_task.run("run", 1, plan, plan[0])
+
+    run = chain_runs.get_run("run")
+    assert run["status"] == "failed"
+    assert run["steps"][0]["status"] == "failed"
+
+def test_replayed_side_effect_step_returns_its_input_changes(app, agents):
+    plan = [dict(step, id=step["step_order"], agent_name=agent, condition=None)
+            for step, agent in zip(plan_steps(steps([], [1])), ["doc_sum", "sfdc"])]
+    chain_runs.create_run("run", 1, 1, plan, input_data={"document_text": "text", "lead_data": {"LastName": "Doe"}})
+    chain_engine.advance_run("run", 1, plan, plan[0], chain_engine.execute_step("run", 1, plan[0]))
+
+    first = chain_engine.execute_step("run", 1, plan[1])
+    # A retry of the step after the lead was created.
+    replayed = chain_engine.execute_step("run", 1, plan[1])
+
+    assert agents.count(("sfdc", {"LastName": "Doe", "Description": "the summary"})) == 1
+    assert replayed == first
+    assert replayed["input"]["lead_data"]["Description"] == "the summary"
@@ -0,0 +1,79 @@
+import threading
+import time
+import pytest
+from app import chroma, offload
+
+def max_concurrency(app, calls=8):
+    running = []
+    peak = []
+    lock = threading.Lock()
+
+    def call():
+        with lock:
+            running.append(1)
+            peak.append(len(running))
+        time.sleep(0.02)
+        with lock:
+            running.pop()
+
+    def worker():
+        with app.app_context():
+            chroma._store_call(call)
+
+    threads = [threading.Thread(target=worker) for _ in range(calls)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return max(peak)
+
+@pytest.fixture(autouse=True)
+def store_lock(monkeypatch):
+    monkeypatch.setattr(chroma, "_store_lock", offload.native_lock())
+
+def test_embedded_store_calls_run_one_at_a_time(app):
+    app.config['CHROMA_SERVER_HOST'] = ''
+    assert max_concurrency(app) == 1
+
+def test_chroma_server_calls_run_concurrently(app):
+    app.config['CHROMA_SERVER_HOST'] = 'chroma'
+    assert max_concurrency(app) > 1
+
+class FakeCollection:
+    def __init__(self, records=()):
+        self.records = {record[0]: record[1:] for record in records}
+
+    def get(self, ids=None, limit=None, offset=0, include=None):
+        selected = [record_id for record_id in self.records if ids is None or record_id in ids]
+        selected = selected[offset:offset + limit] if limit else selected
+        columns = list(zip(*(self.records[record_id] for record_id in selected))) or [(), (), ()]
+        return {"ids": selected, "embeddings": list(columns[0]), "documents": list(columns[1]), "metadatas": list(columns[2])}
+
+    def add(self, ids, embeddings, documents, metadatas):
+        assert not set(ids) & set(self.records), "duplicate ids"
+        self.records.update(zip(ids, zip(embeddings, documents, metadatas)))
+
+    def delete(self, ids):
+        for record_id in ids:
+            del self.records[record_id]
+
+def test_migration_moves_records_and_can_be_rerun(app, monkeypatch):
+    app.config['CHROMA_SERVER_HOST'] = ''
+    shared = FakeCollection([
+        ("a", [0.1], "a", {"tenant_id": 1}),
+        ("orphan", [0.2], "o", {}),
+        ("b", [0.3], "b", {"tenant_id": 2}),
+        ("c", [0.4], "c", {"tenant_id": 1}),
+        ("d", [0.5], "d", {"tenant_id": 2}),
+    ])
+    # An interrupted run already copied "a" but did not delete it.
+    tenants = {1: FakeCollection([("a", [0.1], "a", {"tenant_id": 1})]), 2: FakeCollection()}
+    monkeypatch.setattr(chroma, "get_client", lambda: type("Client", (), {"get_or_create_collection": lambda self, name: shared})())
+    monkeypatch.setattr(chroma, "get_tenant_collection", tenants.get)
+
+    result = chroma.migrate_shared_collection(batch_size=2)
+
+    assert result == {"migrated": {1: 1, 2: 2}, "skipped": 1}
+    assert list(shared.records) == ["orphan"]
+    assert sorted(tenants[1].records) == ["a", "c"] and sorted(tenants[2].records) == ["b", "d"]
+    assert chroma.migrate_shared_collection(batch_size=2) == {"migrated": {}, "skipped": 1}
@@ -0,0 +1,73 @@
+from types import SimpleNamespace
+import pytest
+from app import circuit_breaker, sfdc
+
+@pytest.fixture
+def end_open_period(app, redis):
+    app.config.update(
+        CIRCUIT_BREAKER_ENABLED=True, CIRCUIT_FAILURE_THRESHOLD=3, CIRCUIT_FAILURE_RATIO=0.5,
+        CIRCUIT_FAILURE_WINDOW=60, CIRCUIT_OPEN_SECONDS=10, CIRCUIT_OPEN_MAX_SECONDS=25
+    )
+
+    def end():
+        # Stands in for waiting out the open period.
+        redis.hset(circuit_breaker.BREAKER_KEY.format(tenant_id=1, dependency="salesforce"), "until", "0")
+    return end
+
+def fail(times):
+    for _ in range(times):
+        circuit_breaker.record(1, "salesforce", ok=False)
+
+def state():
+    return circuit_breaker.get_states(1)["salesforce"]["state"]
+
+def open_for():
+    with pytest.raises(circuit_breaker.CircuitOpen) as excinfo:
+        circuit_breaker.acquire(1, "salesforce")
+    return excinfo.value.retry_after
+
+def test_breaker_opens_once_failures_reach_the_threshold_and_ratio(end_open_period):
+    for _ in range(4):
+        circuit_breaker.record(1, "salesforce", ok=True)
+    fail(3)
+    assert state() == "closed"  # 3 failures out of 7 calls
+
+    fail(1)
+
+    assert state() == "open"
+    assert circuit_breaker.get_states(1)["smtp"]["state"] == "closed"
+    assert circuit_breaker.get_states(2)["salesforce"]["state"] == "closed"
+
+def test_open_breaker_lets_a_single_probe_through_once_due(end_open_period):
+    fail(3)
+    end_open_period()
+
+    circuit_breaker.acquire(1, "salesforce")
+
+    assert state() == "half_open"
+    with pytest.raises(circuit_breaker.CircuitOpen):
+        circuit_breaker.acquire(1, "salesforce")
+    with pytest.raises(circuit_breaker.CircuitOpen):
+        circuit_breaker.check(1, "salesforce")
+
+def test_failed_probes_double_the_open_time_up_to_the_maximum(end_open_period):
+    fail(3)
+    open_times = [open_for()]
+    for _ in range(2):
+        end_open_period()
+        circuit_breaker.acquire(1, "salesforce")
+        fail(1)
+        open_times.append(open_for())
+
+    assert open_times == pytest.approx([10, 20, 25], abs=1)
+
+def test_probe_rejected_with_a_4xx_closes_the_breaker(end_open_period, monkeypatch):
+    session = SimpleNamespace(request=lambda method, url, **kwargs: SimpleNamespace(status_code=400))
+    monkeypatch.setattr(sfdc, "get_session", lambda tenant_id: session)
+    fail(3)
+    end_open_period()
+
+    assert sfdc._request(1, "POST", "https://example.my.salesforce.com/").status_code == 400
+
+    assert state() == "closed"
+    circuit_breaker.acquire(1, "salesforce")
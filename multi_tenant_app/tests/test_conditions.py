@@ -0,0 +1,68 @@
+import pytest
+from app.conditions import ConditionError, compile_condition, get_predicate
+
+INPUT = {"summary": "short", "lead_data": {"Company": "Acme", "Employees": 50}, "tags": ["a"], "flag": True}
+
+@pytest.mark.parametrize("expression", [
+    "__import__('os').system('id')",
+    "input_data.__class__",
+    "input_data.get('lead_data').__class__.__bases__",
+    "input_data.get.__self__",
+    "input_data.keys()",
+    "input_data.pop('summary')",
+    "input_data['summary']",
+    "len(input_data)",
+    "open('/etc/passwd')",
+    "(lambda: True)()",
+    "lambda: True",
+    "[x for x in input_data]",
+    "{k: 1 for k in input_data}",
+    "(x for x in input_data)",
+    "input_data.get('summary') + 'x'",
+    "'a' * 10",
+    "input_data if True else None",
+    "(summary := input_data)",
+    "input_data.get(key='summary')",
+    "input_data.get('a', 'b', 'c')",
+    "input_data.get('summary') is 'short'",
+    "f'{input_data}'",
+    "os",
+    "True; import os",
+    "input_data.get((1, [2]))",
+])
+def test_rejects_expressions_outside_the_language(expression):
+    with pytest.raises(ConditionError):
+        compile_condition(expression)
+
+@pytest.mark.parametrize("expression, expected", [
+    ("True", True),
+    ("input_data.get('summary') is not None", True),
+    ("input_data.get('missing') is None", True),
+    ("input_data.get('lead_data').get('Company') == 'Acme'", True),
+    ("input_data.get('missing').get('Company') is None", True),  # Chained lookups on missing keys
+    ("input_data.get('lead_data').get('Employees') >= 100", False),
+    ("10 < input_data.get('lead_data').get('Employees') <= 50", True),
+    ("input_data.get('lead_data').get('Company') in ('Acme', 'Initech')", True),
+    ("'b' not in input_data.get('tags')", True),
+    ("input_data.get('missing', 'default') == 'default'", True),
+    ("input_data.get('flag') and not input_data.get('missing')", True),
+    ("input_data.get('missing') or input_data.get('summary') == 'long'", False),
+    # Operands that cannot be compared make the comparison false rather than raise.
+    ("input_data.get('lead_data').get('missing') > 5", False),
+    ("'a' in input_data.get('missing')", False),
+    ("input_data.get('summary') < 5", False),
+])
+def test_evaluates_allowed_expressions(expression, expected):
+    assert compile_condition(expression)(INPUT) is expected
+
+def test_predicates_are_recompiled_when_the_condition_changes():
+    assert get_predicate(9001, "input_data.get('flag') == True")(INPUT) is True
+    assert get_predicate(9001, "input_data.get('flag') == False")(INPUT) is False
+
+def test_chain_with_a_disallowed_condition_is_rejected(client, auth_headers, tenant):
+    response = client.post("/api/v1/chain/create", headers=auth_headers, json={
+        "tenant_id": tenant, "name": "c",
+        "steps": [{"step_order": 1, "agent_name": "email", "condition": "__import__('os').system('id')"}]
+    })
+
+    assert response.status_code == 400
@@ -0,0 +1,57 @@
+import array
+import threading
+import pytest
+from app.embeddings import EmbeddingBatcher, EmbeddingCache
+
+class ShortProvider:
+    """Returns one vector too few for the first request, then behaves."""
+
+    def __init__(self):
+        self.calls = 0
+
+    def embed(self, texts, tenant_id=None):
+        self.calls += 1
+        vectors = [[float(len(text))] for text in texts]
+        return vectors[:-1] if self.calls == 1 else vectors
+
+def test_short_provider_response_fails_the_batch_and_the_batcher_keeps_going():
+    batcher = EmbeddingBatcher(ShortProvider(), max_wait=0.01, timeout=5)
+
+    with pytest.raises(ValueError, match="1 vectors for 2 texts"):
+        batcher.embed(["a", "bb"])
+
+    assert batcher.embed(["a", "bb"]) == [[1.0], [2.0]]
+
+def test_cache_holds_float32_arrays_and_returns_lists(tmp_path):
+    cache = EmbeddingCache(str(tmp_path / "embeddings.sqlite3"), memory_size=10)
+
+    cache.set_many({"k": [0.5, -1.0]})
+
+    assert isinstance(cache.memory.get("k"), array.array)
+    assert cache.get_many(["k"]) == {"k": [0.5, -1.0]}
+    # And from SQLite, as another process would see it
+    assert EmbeddingCache(cache.path).get_many(["k"]) == {"k": [0.5, -1.0]}
+
+class RecordingProvider:
+    def __init__(self):
+        self.requests = []
+
+    def embed(self, texts, tenant_id=None):
+        self.requests.append((tenant_id, sorted(texts)))
+        return [[float(len(text))] for text in texts]
+
+def test_batched_texts_are_embedded_in_one_request_per_tenant():
+    provider = RecordingProvider()
+    batcher = EmbeddingBatcher(provider, max_wait=0.05, timeout=5)
+    results = {}
+    threads = [
+        threading.Thread(target=lambda tenant_id, texts: results.update({tenant_id: batcher.embed(texts, tenant_id)}), args=args)
+        for args in [(1, ["a", "bb"]), (2, ["ccc"])]
+    ]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert results == {1: [[1.0], [2.0]], 2: [[3.0]]}
+    assert sorted(provider.requests) == [(1, ["a", "bb"]), (2, ["ccc"])]
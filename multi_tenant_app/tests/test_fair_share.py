@@ -0,0 +1,63 @@
+import json
+import pytest
+from app import fair_share
+from app.queues import QUEUES
+from app.tasks import send_email_batch_task, send_email_task
+
+@pytest.fixture
+def dispatcher(app, monkeypatch):
+    app.config.update(FAIR_SHARE_ENABLED=True)
+    monkeypatch.setattr(fair_share, "broker_depths", lambda: dict.fromkeys(QUEUES, 0))
+    dispatcher = fair_share.FairShareDispatcher(max_queue_depth=6)
+    dispatcher.published = []
+
+    def publish(raw):
+        dispatcher.published.append(json.loads(raw))
+        return True
+    monkeypatch.setattr(dispatcher, "_publish", publish)
+    return dispatcher
+
+def submit_emails(tenant_id, count):
+    for n in range(count):
+        fair_share.submit(send_email_task.s(tenant_id, f"{n}@example.com", "hi", "body"), tenant_id)
+
+def tenants(published):
+    return [sig["args"][0] for sig in published]
+
+def test_interactive_tasks_are_dispatched_before_earlier_bulk_tasks(dispatcher):
+    fair_share.submit(send_email_batch_task.s(1, []), 1)
+    submit_emails(1, 1)
+
+    assert fair_share._pop_backlog("email", 1, 1)[0][0] == 0
+    assert fair_share.backlog_depths() == {("email", "1", 6): 1}
+
+def test_tenants_are_dispatched_in_proportion_to_their_weights(dispatcher):
+    fair_share.set_weight(1, 2)
+    submit_emails(1, 10)
+    submit_emails(2, 10)
+
+    assert dispatcher.dispatch_once() == 6
+
+    assert sorted(tenants(dispatcher.published)) == [1, 1, 1, 1, 2, 2]
+
+def test_idle_tenant_banks_no_credit(dispatcher):
+    fair_share.set_weight(1, 5)
+    submit_emails(1, 1)
+    submit_emails(2, 10)
+
+    dispatcher.dispatch_once()
+
+    assert tenants(dispatcher.published).count(1) == 1
+    assert ("email", "1") not in dispatcher.deficits
+    assert b"1" not in fair_share.get_redis().smembers(fair_share.ACTIVE_KEY.format(queue="email"))
+
+def test_failed_publish_returns_the_rest_to_the_backlog_in_order(dispatcher, monkeypatch):
+    submit_emails(1, 3)
+    outcomes = iter([True, False])
+    monkeypatch.setattr(dispatcher, "_publish", lambda raw: next(outcomes))
+
+    assert dispatcher.dispatch_once() == 1
+
+    remaining = [json.loads(raw)["args"][1] for _, raw in fair_share._pop_backlog("email", 1, 10)]
+    assert remaining == ["1@example.com", "2@example.com"]
+    assert int(fair_share.get_redis().hget(fair_share.DISPATCHED_KEY, "email:1")) == 1
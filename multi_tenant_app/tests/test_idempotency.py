@@ -0,0 +1,41 @@
+from types import SimpleNamespace
+import pytest
+from app import idempotency, sfdc
+from app.idempotency import OutcomeUnknown
+
+CONFIG = SimpleNamespace(sfdc_instance_url="https://example.my.salesforce.com", sfdc_access_token="token")
+
+def create_lead_replying(monkeypatch, status_code):
+    calls = []
+    response = SimpleNamespace(status_code=status_code, text="error", json=lambda: {"id": "00Q1"})
+    monkeypatch.setattr(sfdc, "_request", lambda *args, **kwargs: calls.append(args) or response)
+    return calls, lambda: sfdc.create_lead(1, CONFIG, {"LastName": "Doe"})
+
+def test_server_error_after_the_request_keeps_the_claim(app, monkeypatch):
+    calls, create_lead = create_lead_replying(monkeypatch, 500)
+
+    for _ in range(2):
+        with pytest.raises(OutcomeUnknown):
+            idempotency.execute(1, "create_lead", "key", create_lead)
+
+    assert len(calls) == 1  # The retry did not create the lead again
+
+@pytest.mark.parametrize("status_code", [400, 503])
+def test_rejected_request_releases_the_claim(app, monkeypatch, status_code):
+    calls, create_lead = create_lead_replying(monkeypatch, status_code)
+
+    for _ in range(2):
+        with pytest.raises(sfdc.SFDCError):
+            idempotency.execute(1, "create_lead", "key", create_lead)
+
+    assert len(calls) == 2
+
+def test_interrupted_execution_keeps_the_claim(app):
+    def interrupted():
+        raise KeyboardInterrupt
+
+    with pytest.raises(KeyboardInterrupt):
+        idempotency.execute(1, "send_email", "key", interrupted)
+
+    with pytest.raises(idempotency.DuplicateInFlight):
+        idempotency.execute(1, "send_email", "key", lambda: "sent")
@@ -0,0 +1,113 @@
+import json
+import pytest
+from app import chroma, index_jobs, offload
+from app.local_indexer import get_local_indexer
+
+class FakeCollection:
+    def __init__(self):
+        self.records = {}
+        self.added = []
+
+    def delete(self, where):
+        for record_id, (document, metadata) in list(self.records.items()):
+            if all(metadata.get(key) == value for key, value in where.items()):
+                del self.records[record_id]
+
+    def add(self, ids, embeddings, documents, metadatas):
+        assert not set(ids) & set(self.records), "duplicate ids"
+        self.added.extend(ids)
+        self.records.update(zip(ids, zip(documents, metadatas)))
+
+    def documents(self):
+        return {record_id: document for record_id, (document, metadata) in self.records.items()}
+
+@pytest.fixture
+def collection(app, monkeypatch):
+    collection = FakeCollection()
+    embedded = []
+    monkeypatch.setattr(chroma, "get_tenant_collection", lambda tenant_id: collection)
+    monkeypatch.setattr(chroma, "_store_lock", offload.native_lock())
+    monkeypatch.setattr(chroma, "get_embeddings", lambda texts, tenant_id: embedded.extend(texts) or [[0.0] for _ in texts])
+    app.config.update(INDEX_CHUNK_SIZE=10, INDEX_CHUNK_OVERLAP=0, INDEX_ADD_BATCH_SIZE=2)
+    collection.embedded = embedded
+    return collection
+
+def test_retried_batch_replaces_the_chunks_of_the_failed_attempt(app, collection):
+    documents = [{"document_id": "a", "document_text": "x" * 30}, {"document_id": "b", "document_text": "y" * 10}]
+    # The second flush fails, as a task's first attempt would.
+    original_add = collection.add
+    calls = []
+    def add(**kwargs):
+        calls.append(kwargs["ids"])
+        if len(calls) == 2:
+            raise RuntimeError("vector store unavailable")
+        return original_add(**kwargs)
+    collection.add = add
+    with pytest.raises(RuntimeError):
+        chroma.index_documents(1, documents)
+
+    result = chroma.index_documents(1, documents)
+
+    assert result == {"documents_indexed": 2, "chunks_indexed": 4, "errors": []}
+    assert collection.documents() == {"a#0": "x" * 10, "a#1": "x" * 10, "a#2": "x" * 10, "b#0": "y" * 10}
+
+def test_reindexed_document_keeps_only_its_new_chunks(app, collection):
+    chroma.index_documents(1, [{"document_id": "a", "document_text": "0123456789" * 3}, {"document_id": "b", "document_text": "b" * 10}])
+
+    # Edited and shortened from three chunks to two
+    result = chroma.index_documents(1, [{"document_id": "a", "document_text": "abcdefghij" + "0123456789"}])
+
+    assert result["chunks_indexed"] == 2
+    assert collection.documents() == {"a#0": "abcdefghij", "a#1": "0123456789", "b#0": "b" * 10}
+
+def test_bulk_upload_keeps_a_bounded_number_of_errors(client, tenant, collection):
+    lines = ["not json"] * (index_jobs.MAX_ERRORS + 50)
+    lines += [json.dumps({"document_id": f"d{n}", "document_text": "text"}) for n in range(3)]
+
+    response = client.post(
+        f"/api/v1/index_documents_bulk?tenant_id={tenant}",
+        data="\n".join(lines), content_type="application/x-ndjson"
+    )
+
+    assert response.status_code == 202
+    # The embedded store is only visible to this process, so the batches are indexed here.
+    get_local_indexer().join()
+    job = index_jobs.get_job(response.json["job_id"])
+    assert job["errors_total"] == index_jobs.MAX_ERRORS + 50
+    assert len(job["errors"]) == index_jobs.MAX_ERRORS
+    assert job["documents_indexed"] == 3
+    assert job["status"] == "completed_with_errors"
+    assert sorted(collection.added) == ["d0#0", "d1#0", "d2#0"]
+
+def test_bulk_upload_without_a_content_length_is_refused(client, tenant, collection):
+    # As gunicorn passes a chunked request on
+    response = client.post(
+        f"/api/v1/index_documents_bulk?tenant_id={tenant}",
+        data=json.dumps({"document_id": "d0", "document_text": "text"}), content_type="application/x-ndjson",
+        headers={"Transfer-Encoding": "chunked"}, environ_overrides={"wsgi.input_terminated": True}
+    )
+
+    assert response.status_code == 411
+    assert collection.added == []
+
+def test_bulk_upload_returns_before_its_batches_are_indexed(app, client, tenant, collection, monkeypatch):
+    import threading
+    from app import tasks
+    release = threading.Event()
+    original = tasks.index_batch
+    def index_batch(*args):
+        assert release.wait(5)
+        return original(*args)
+    monkeypatch.setattr(tasks, "index_batch", index_batch)
+
+    response = client.post(
+        f"/api/v1/index_documents_bulk?tenant_id={tenant}",
+        data=json.dumps({"document_id": "d0", "document_text": "text"}), content_type="application/x-ndjson"
+    )
+
+    assert response.status_code == 202
+    assert index_jobs.get_job(response.json["job_id"])["status"] == "indexing"
+    release.set()
+    get_local_indexer().join()
+    assert index_jobs.get_job(response.json["job_id"])["status"] == "completed"
+    assert collection.added == ["d0#0"]
@@ -0,0 +1,25 @@
+import os
+import sqlalchemy as sa
+from flask_migrate import stamp, upgrade
+from app import create_app, db
+from app.config import Config
+
+MIGRATIONS = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "migrations")
+
+def test_create_all_database_stamped_initial_upgrades(tmp_path):
+    class FileConfig(Config):
+        SQLALCHEMY_DATABASE_URI = f"sqlite:///{tmp_path / 'app.db'}"
+        SQLALCHEMY_ENGINE_OPTIONS = {}
+
+    app = create_app(FileConfig)
+    with app.app_context():
+        # A database made by db.create_all() already has the later columns and indexes.
+        db.create_all()
+        stamp(MIGRATIONS, revision="1a2b3c4d5e6f")
+
+        upgrade(MIGRATIONS)
+
+        inspector = sa.inspect(db.engine)
+        assert "depends_on" in {column["name"] for column in inspector.get_columns("agent_chain_step")}
+        assert "ix_agent_chain_tenant_id" in {index["name"] for index in inspector.get_indexes("agent_chain")}
+        db.session.remove()
@@ -0,0 +1,70 @@
+import pytest
+from app import rate_limit, routes
+
+@pytest.fixture(autouse=True)
+def fake_search(monkeypatch):
+    monkeypatch.setattr(routes, "search_document", lambda tenant_id, query_text, n_results: {"status": "success", "results": []})
+
+def search(client, body_tenant, query=""):
+    return client.post(f"/api/v1/search_document{query}", json={"tenant_id": body_tenant, "query_text": "hello"})
+
+def test_quota_is_charged_to_the_tenant_the_view_uses(client, tenant):
+    rate_limit.set_overrides(tenant, {"search_document": "2/60"})
+
+    # A made-up ?tenant_id= must not get the request a fresh bucket.
+    statuses = [search(client, tenant, f"?tenant_id={9000 + i}").status_code for i in range(3)]
+
+    assert statuses == [200, 200, 429]
+    assert rate_limit.get_usage(tenant)["search_document"]["remaining"] == 0
+
+def test_unknown_tenants_are_rejected_without_a_bucket(client, tenant, redis):
+    for unknown in (tenant + 1000, "abc", "-1", True):
+        response = search(client, unknown)
+        assert response.status_code == 404, unknown
+        assert "Unknown tenant" in response.json["error"]
+    assert not [key for key in redis.keys("ratelimit:*") if b"tenant:" in key]
+
+def test_equivalent_tenant_ids_share_a_bucket(client, tenant):
+    rate_limit.set_overrides(tenant, {"search_document": "2/60"})
+
+    statuses = [search(client, body).status_code for body in (tenant, str(tenant), f"0{tenant}")]
+
+    assert statuses == [200, 200, 429]
+
+def test_unauthenticated_chain_requests_use_no_quota(client, tenant):
+    before = rate_limit.get_usage(tenant)["requests"]["remaining"]
+
+    response = client.post("/api/v1/chain/execute", json={"tenant_id": tenant, "chain_id": 1, "input": {"x": 1}})
+
+    assert response.status_code == 401
+    assert rate_limit.get_usage(tenant)["requests"]["remaining"] == before
+
+def test_authenticated_chain_requests_are_charged(client, tenant, auth_headers):
+    before = rate_limit.get_usage(tenant)["requests"]["remaining"]
+
+    response = client.post(
+        "/api/v1/chain/execute", json={"tenant_id": tenant, "chain_id": 1, "input": {"x": 1}}, headers=auth_headers
+    )
+
+    assert response.status_code == 404  # No such chain
+    assert rate_limit.get_usage(tenant)["requests"]["remaining"] == before - 1
+
+def test_deleted_tenant_leaves_no_redis_state(app, client, tenant, auth_headers, redis, monkeypatch):
+    from app import admin, circuit_breaker, fair_share, idempotency
+    from app.tasks import send_email_task
+    monkeypatch.setattr(admin, "drop_tenant_collection", lambda tenant_id: True)
+    app.config.update(FAIR_SHARE_ENABLED=True)
+    rate_limit.set_overrides(tenant, {"search_document": "2/60"})
+    search(client, tenant)
+    fair_share.set_weight(tenant, 3)
+    fair_share.submit(send_email_task.s(tenant, "a@b.c", "hi", "body"), tenant)
+    circuit_breaker.record(tenant, "smtp", ok=False)
+    idempotency.execute(tenant, "send_email", "key", lambda: "sent")
+
+    response = client.delete(f"/api/v1/admin/tenants/{tenant}", headers=auth_headers)
+
+    assert response.status_code == 200
+    tenant_keys = [key for key in redis.keys() if f"tenant:{tenant}".encode() in key or key.startswith(f"idempotency:{tenant}:".encode())]
+    assert tenant_keys == []
+    assert redis.hget(fair_share.WEIGHTS_KEY, str(tenant)) is None
+    assert str(tenant).encode() not in redis.smembers(fair_share.ACTIVE_KEY.format(queue="email"))
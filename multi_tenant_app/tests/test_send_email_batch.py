@@ -0,0 +1,104 @@
+import smtplib
+from contextlib import contextmanager
+from types import SimpleNamespace
+import pytest
+from app import circuit_breaker, tasks
+from app.idempotency import OutcomeUnknown
+
+class FakePool:
+    """
+    Each session sends `sends` messages, then drops (after the message data if
+    `sends` is a float); sessions after the given ones fail to connect.
+    """
+
+    max_messages = 100
+
+    def __init__(self, sessions, connect_error):
+        self.sessions = list(sessions)
+        self.connect_error = connect_error
+        self.sent = []
+        self.connects = 0
+
+    @contextmanager
+    def connection(self, config):
+        self.connects += 1
+        if not self.sessions:
+            raise self.connect_error
+        yield FakeConnection(self, self.sessions.pop(0))
+
+class FakeConnection:
+    def __init__(self, pool, sends):
+        self.pool = pool
+        self.sends = sends
+        self.messages_sent = 0
+        self.closed = False
+
+    def send_message(self, msg):
+        if self.closed:
+            raise smtplib.SMTPServerDisconnected("please run connect() first")
+        if self.messages_sent == self.sends:
+            if isinstance(self.sends, float):
+                self.closed = True
+                raise OutcomeUnknown("SMTP session dropped after the message data was sent")
+            raise smtplib.SMTPServerDisconnected("Connection unexpectedly closed")
+        self.pool.sent.append(msg["To"])
+        self.messages_sent += 1
+
+@pytest.fixture
+def smtp(app, monkeypatch):
+    config = SimpleNamespace(smtp_server="smtp.example.com", smtp_port=587, smtp_username="u", smtp_password="p")
+    monkeypatch.setattr(tasks, "get_tenant_config", lambda kind, tenant_id: config)
+
+    def use(sessions, connect_error):
+        pool = FakePool(sessions, connect_error)
+        monkeypatch.setattr(tasks, "get_smtp_pool", lambda: pool)
+        return pool
+    return use
+
+def messages(count):
+    return [{"recipient": f"r{n}@example.com", "subject": "s", "body": "b"} for n in range(count)]
+
+@pytest.mark.parametrize("connect_error", [
+    smtplib.SMTPConnectError(421, b"Too many connections"),
+    smtplib.SMTPAuthenticationError(535, b"Authentication failed"),
+    smtplib.SMTPNotSupportedError("STARTTLS extension not supported by server."),
+])
+def test_failed_reconnect_after_a_send_is_recorded_not_raised(smtp, connect_error):
+    pool = smtp([1], connect_error)
+
+    result = tasks.send_email_batch(1, messages(3))
+
+    assert pool.sent == ["r0@example.com"]
+    assert pool.connects == 2  # A refused reconnect is not tried again
+    assert result["sent"] == 1 and result["failed"] == 2
+    assert [r["index"] for r in result["results"] if r["status"] == "error"] == [1, 2]
+
+def test_drop_after_message_data_moves_on_to_a_new_session(smtp):
+    pool = smtp([1.0, 5], OSError("unreachable"))
+
+    result = tasks.send_email_batch(1, messages(4))
+
+    # r1 may have been delivered, so it is not resent; r2 and r3 go over a new session.
+    assert pool.sent == ["r0@example.com", "r2@example.com", "r3@example.com"]
+    assert [r["status"] for r in result["results"]] == ["success", "error", "success", "success"]
+    assert pool.connects == 2
+    assert circuit_breaker.get_states(1)["smtp"]["failures"] == 0
+
+def test_failed_connect_before_any_send_raises(smtp):
+    smtp([], smtplib.SMTPAuthenticationError(535, b"Authentication failed"))
+
+    with pytest.raises(smtplib.SMTPAuthenticationError):
+        tasks.send_email_batch(1, messages(2))
+
+def test_malformed_message_is_a_per_message_error(smtp):
+    pool = smtp([5], OSError("unreachable"))
+
+    result = tasks.send_email_batch(1, [messages(1)[0], "not a message", None])
+
+    assert pool.sent == ["r0@example.com"]
+    assert [r["status"] for r in result["results"]] == ["success", "error", "error"]
+
+def test_route_rejects_messages_that_are_not_objects(client, tenant):
+    response = client.post("/api/v1/send_email_batch", json={"tenant_id": tenant, "messages": [messages(1)[0], "x"]})
+
+    assert response.status_code == 400
@@ -0,0 +1,146 @@
+import csv
+import io
+import json
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from types import SimpleNamespace
+import pytest
+from app import sfdc
+
+class StubSalesforce:
+    """
+    Local HTTP server answering each (method, path suffix) with the next of its
+    scripted responses: (status, content type, body).
+    """
+
+    def __init__(self, responses):
+        self.responses = {route: list(replies) for route, replies in responses.items()}
+        self.requests = []
+        stub = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def handle_one(self):
+                body = self.rfile.read(int(self.headers.get("Content-Length") or 0))
+                route = next(route for route in stub.responses if route[0] == self.command and self.path.endswith(route[1]))
+                stub.requests.append((self.command, self.path, body))
+                status, content_type, reply = stub.responses[route].pop(0)
+                reply = reply.encode() if isinstance(reply, str) else json.dumps(reply).encode()
+                self.send_response(status)
+                self.send_header("Content-Type", content_type)
+                self.send_header("Content-Length", str(len(reply)))
+                self.end_headers()
+                self.wfile.write(reply)
+
+            do_GET = do_POST = do_PUT = do_PATCH = handle_one
+
+            def log_message(self, *args):
+                pass
+
+        self.server = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+        self.config = SimpleNamespace(sfdc_instance_url=f"http://127.0.0.1:{self.server.server_port}", sfdc_access_token="t")
+
+    def close(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+@pytest.fixture
+def stub(app):
+    stubs = []
+
+    def start(responses):
+        stubs.append(StubSalesforce(responses))
+        return stubs[-1]
+    yield start
+    for started in stubs:
+        started.close()
+
+def csv_body(header, rows):
+    buffer = io.StringIO()
+    writer = csv.DictWriter(buffer, fieldnames=header, lineterminator="\n")
+    writer.writeheader()
+    writer.writerows(rows)
+    return buffer.getvalue()
+
+def test_composite_chunk_failure_fails_only_its_records(stub, monkeypatch):
+    monkeypatch.setattr(sfdc, "COMPOSITE_MAX_RECORDS", 2)
+    salesforce = stub({("POST", "/composite/sobjects"): [
+        (200, "application/json", [{"id": "00Q1", "success": True, "errors": []},
+                                   {"success": False, "errors": [{"message": "Missing Company"}]}]),
+        (500, "application/json", [{"message": "Internal error"}]),
+        (200, "application/json", [{"id": "00Q5", "success": True, "errors": []}]),
+    ]})
+    leads = [{"LastName": f"L{n}"} for n in range(5)]
+
+    results = sfdc.create_leads_composite(1, salesforce.config, leads)
+
+    # Salesforce may have created the records of the chunk it failed to answer.
+    assert [(r["index"], r["success"], r["id"]) for r in results] == [
+        (0, True, "00Q1"), (1, False, None), (2, None, None), (3, None, None), (4, True, "00Q5")
+    ]
+    assert [r["unknown"] for r in results] == [False, False, True, True, False]
+    assert results[1]["errors"] == [{"message": "Missing Company"}]
+    assert results[2]["errors"][0]["statusCode"] == 500
+    # Each chunk was sent once; the failed one did not abort the batch.
+    assert len(salesforce.requests) == 3
+    assert [record["LastName"] for record in json.loads(salesforce.requests[2][2])["records"]] == ["L4"]
+
+def test_bulk_results_are_matched_to_their_input_records(stub, app):
+    app.config.update(SFDC_BULK_POLL_INTERVAL=0.01)
+    leads = [
+        {"LastName": "Doe", "Company": "Acme"},
+        {"LastName": "Roe", "Company": "Acme", "NumberOfEmployees": 5},
+        {"LastName": "Doe", "Company": "Acme"},  # Same values as the first
+        {"LastName": "Poe", "Company": None},
+        {"LastName": "Zoe", "Company": "Acme"},  # No result at all
+    ]
+    fields = ["Company", "LastName", "NumberOfEmployees"]
+    # Result rows come back in another order, with the columns in another order too.
+    successful = csv_body(["sf__Id", "sf__Created", "NumberOfEmployees", "LastName", "Company"], [
+        {"sf__Id": "00QB", "sf__Created": "true", "NumberOfEmployees": "5", "LastName": "Roe", "Company": "Acme"},
+        {"sf__Id": "00QA", "sf__Created": "true", "NumberOfEmployees": "", "LastName": "Doe", "Company": "Acme"},
+        {"sf__Id": "00QC", "sf__Created": "true", "NumberOfEmployees": "", "LastName": "Doe", "Company": "Acme"},
+    ])
+    failed = csv_body(["sf__Id", "sf__Error"] + fields, [
+        {"sf__Id": "", "sf__Error": "REQUIRED_FIELD_MISSING:Company", "Company": "", "LastName": "Poe", "NumberOfEmployees": ""},
+    ])
+    salesforce = stub({
+        ("POST", "/jobs/ingest/"): [(200, "application/json", {"id": "750J"})],
+        ("PUT", "/jobs/ingest/750J/batches"): [(201, "text/plain", "")],
+        ("PATCH", "/jobs/ingest/750J"): [(200, "application/json", {"state": "UploadComplete"})],
+        ("GET", "/jobs/ingest/750J"): [(200, "application/json", {"state": "InProgress"}),
+                                       (200, "application/json", {"state": "JobComplete"})],
+        ("GET", "/successfulResults/"): [(200, "text/csv", successful)],
+        ("GET", "/failedResults/"): [(200, "text/csv", failed)],
+    })
+
+    results = sfdc.create_leads_bulk(1, salesforce.config, leads)
+
+    assert [(r["index"], r["success"], r["id"]) for r in results] == [
+        (0, True, "00QA"), (1, True, "00QB"), (2, True, "00QC"), (3, False, None), (4, None, None)
+    ]
+    assert results[3]["errors"] == [{"message": "REQUIRED_FIELD_MISSING:Company"}]
+    assert "No result for record" in results[4]["errors"][0]["message"]
+    assert results[4]["unknown"] and results[4]["job_id"] == "750J"
+    uploaded = list(csv.DictReader(io.StringIO(salesforce.requests[1][2].decode())))
+    assert [row["LastName"] for row in uploaded] == ["Doe", "Roe", "Doe", "Poe", "Zoe"]
+
+def test_records_of_a_bulk_job_still_running_are_unknown_not_failed(stub, app):
+    app.config.update(SFDC_BULK_POLL_INTERVAL=0.01, SFDC_BULK_TIMEOUT=0.05, SFDC_BULK_THRESHOLD=1)
+    salesforce = stub({
+        ("POST", "/jobs/ingest/"): [(200, "application/json", {"id": "750J"})],
+        ("PUT", "/jobs/ingest/750J/batches"): [(201, "text/plain", "")],
+        ("PATCH", "/jobs/ingest/750J"): [(200, "application/json", {"state": "UploadComplete"})],
+        ("GET", "/jobs/ingest/750J"): [(200, "application/json", {"state": "InProgress"})] * 100,
+    })
+
+    summary = sfdc.create_leads(1, salesforce.config, [{"LastName": "Doe"}, {"LastName": "Roe"}])
+
+    assert (summary["succeeded"], summary["failed"], summary["unknown"]) == (0, 0, 2)
+    assert {result["job_id"] for result in summary["results"]} == {"750J"}
+
+def test_transport_error_before_the_bulk_upload_is_retryable(app):
+    unreachable = SimpleNamespace(sfdc_instance_url="http://127.0.0.1:1", sfdc_access_token="t")
+
+    with pytest.raises(sfdc.SFDCError):
+        sfdc.create_leads_bulk(1, unreachable, [{"LastName": "Doe"}])
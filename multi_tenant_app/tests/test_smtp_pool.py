@@ -0,0 +1,138 @@
+import socket
+import ssl
+import threading
+from email.mime.text import MIMEText
+from types import SimpleNamespace
+import smtplib
+import pytest
+from app.idempotency import OutcomeUnknown
+from app.smtp_pool import SMTPConnectionPool
+
+class StartTLSServer:
+    """
+    Offers STARTTLS; after "220 Ready" the session simply continues in plain text.
+    With drop_at, the connection is closed instead of answering that command
+    (for DATA: once the message data was received). With refuse_recipients,
+    every RCPT is answered with 550.
+    """
+
+    def __init__(self, drop_at=None, refuse_recipients=False):
+        self.drop_at = drop_at
+        self.refuse_recipients = refuse_recipients
+        self.sock = socket.socket()
+        self.sock.bind(("127.0.0.1", 0))
+        self.sock.listen()
+        self.port = self.sock.getsockname()[1]
+        self.commands = []
+        threading.Thread(target=self.serve, daemon=True).start()
+
+    def serve(self):
+        conn, _ = self.sock.accept()
+        reader = conn.makefile("rb")
+
+        def reply(line):
+            conn.sendall(line.encode() + b"\r\n")
+
+        reply("220 localhost ready")
+        for line in reader:
+            verb = line.decode().strip().split(" ", 1)[0].upper()
+            self.commands.append(verb)
+            if verb == self.drop_at and verb != "DATA":
+                break
+            if verb == "EHLO":
+                reply("250-localhost")
+                reply("250-STARTTLS")
+                reply("250 AUTH PLAIN")
+            elif verb == "STARTTLS":
+                reply("220 Ready to start TLS")
+            elif verb == "AUTH":
+                reply("235 Authentication successful")
+            elif verb == "RCPT" and self.refuse_recipients:
+                reply("550 No such user")
+            elif verb == "DATA":
+                reply("354 End data with <CR><LF>.<CR><LF>")
+                while reader.readline() not in (b".\r\n", b""):
+                    pass
+                if self.drop_at == "DATA":
+                    break
+                reply("250 OK: queued")
+            elif verb == "QUIT":
+                reply("221 Bye")
+                break
+            else:
+                reply("250 OK")
+        conn.close()
+
+class RecordingContext:
+    """Stands in for the TLS context; like SSLContext, it needs the server's host name."""
+
+    def __init__(self):
+        self.server_hostnames = []
+
+    def wrap_socket(self, sock, server_hostname=None):
+        if not server_hostname:
+            raise ValueError("server_hostname cannot be an empty string or start with a leading dot.")
+        self.server_hostnames.append(server_hostname)
+        return sock
+
+@pytest.fixture
+def tls_context(monkeypatch):
+    context = RecordingContext()
+    monkeypatch.setattr(ssl, "_create_stdlib_context", lambda *args, **kwargs: context)
+    return context
+
+def test_starttls_verifies_the_configured_host(tls_context):
+    server = StartTLSServer()
+    config = SimpleNamespace(smtp_server="127.0.0.1", smtp_port=server.port, smtp_username="u", smtp_password="p")
+    pool = SMTPConnectionPool(timeout=5, connect_timeout=2, starttls=True)
+
+    with pool.connection(config) as conn:
+        msg = MIMEText("body")
+        msg["From"], msg["To"], msg["Subject"] = "a@example.com", "b@example.com", "hi"
+        conn.send_message(msg)
+        assert conn.server.sock.gettimeout() == 5
+    pool.close_all()
+
+    assert tls_context.server_hostnames == ["127.0.0.1"]
+    assert "STARTTLS" in server.commands and "DATA" in server.commands
+
+def message():
+    msg = MIMEText("body")
+    msg["From"], msg["To"], msg["Subject"] = "a@example.com", "b@example.com", "hi"
+    return msg
+
+@pytest.mark.parametrize("drop_at, error", [("MAIL", smtplib.SMTPServerDisconnected), ("DATA", OutcomeUnknown)])
+def test_dropped_session_is_unknown_only_once_the_data_was_sent(tls_context, drop_at, error):
+    server = StartTLSServer(drop_at=drop_at)
+    config = SimpleNamespace(smtp_server="127.0.0.1", smtp_port=server.port, smtp_username="u", smtp_password="p")
+    pool = SMTPConnectionPool(timeout=5, connect_timeout=2, starttls=True)
+
+    with pytest.raises(error):
+        with pool.connection(config) as conn:
+            conn.send_message(message())
+
+    assert pool._idle == {}  # The broken session is not reused
+
+def test_session_closed_after_an_unknown_outcome_is_not_pooled_even_if_the_caller_moves_on(tls_context):
+    server = StartTLSServer(drop_at="DATA")
+    config = SimpleNamespace(smtp_server="127.0.0.1", smtp_port=server.port, smtp_username="u", smtp_password="p")
+    pool = SMTPConnectionPool(timeout=5, connect_timeout=2, starttls=True)
+
+    with pool.connection(config) as conn:
+        with pytest.raises(OutcomeUnknown):
+            conn.send_message(message())
+
+    assert pool._idle == {}
+
+def test_session_is_reset_and_reused_after_a_refused_recipient(tls_context):
+    server = StartTLSServer(refuse_recipients=True)
+    config = SimpleNamespace(smtp_server="127.0.0.1", smtp_port=server.port, smtp_username="u", smtp_password="p")
+    pool = SMTPConnectionPool(timeout=5, connect_timeout=2, starttls=True)
+
+    with pytest.raises(smtplib.SMTPRecipientsRefused):
+        with pool.connection(config) as conn:
+            conn.send_message(message())
+
+    assert pool._idle == {("127.0.0.1", server.port, "u"): [conn]}
+    assert server.commands[-1] == "RSET"
+    pool.close_all()
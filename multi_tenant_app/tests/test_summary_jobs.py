@@ -0,0 +1,52 @@
+from app import summary_jobs, tasks
+
+def test_every_reduction_level_at_least_halves_the_partials():
+    # Each partial alone exceeds max_chars, so none would fit a batch with another.
+    partials = ["x" * 100] * 9
+
+    batches = summary_jobs.batch_partials(partials, max_chars=50)
+
+    assert [len(batch) for batch in batches] == [2, 2, 2, 3]
+    assert summary_jobs.batch_partials(["short"] * 3, max_chars=50) == [["short"] * 3]
+
+def test_last_level_truncates_into_the_final_prompt(app, monkeypatch):
+    app.config.update(SUMMARY_REDUCE_MAX_CHARS=100, SUMMARY_REDUCE_MAX_LEVELS=3)
+    prompts = []
+    monkeypatch.setattr(tasks, "complete", lambda tenant_id, prompt, max_tokens=None: prompts.append(prompt) or "final")
+
+    summary = tasks.reduce_summaries_task.run(["x" * 80] * 10, "job", 1, 3)
+
+    assert summary == "final"
+    assert len(prompts) == 1
+    assert prompts[0].count("x") == 100
+
+def test_summary_of_a_finished_job_is_reused_without_a_canvas(app, monkeypatch):
+    from app import fair_share
+    submitted = []
+    monkeypatch.setattr(fair_share, "submit", lambda canvas, tenant_id: submitted.append(canvas))
+
+    first = summary_jobs.start_summary_job(1, "document")
+    tasks.reduce_summaries_task.run(["the summary"], first, 1, 1)
+    second = summary_jobs.start_summary_job(1, "document")
+
+    assert len(submitted) == 1
+    job = summary_jobs.get_job(second)
+    assert job["status"] == "completed"
+    assert job["result"] == {"summary": "the summary", "cached": True}
+    assert [event[1] for event in summary_jobs.read_events(second)] == ["started", "final"]
+
+def test_single_prompt_and_map_reduce_summaries_are_cached_apart(app, monkeypatch):
+    from app import fair_share
+    submitted = []
+    monkeypatch.setattr(fair_share, "submit", lambda canvas, tenant_id: submitted.append(canvas))
+    monkeypatch.setattr(tasks, "complete", lambda tenant_id, prompt, max_tokens=None: "single-prompt summary")
+
+    assert tasks.summarize_document(1, "document") == "single-prompt summary"
+    first = summary_jobs.start_summary_job(1, "document")
+    tasks.reduce_summaries_task.run(["map-reduce summary"], first, 1, 1)
+    monkeypatch.setattr(tasks, "complete", lambda tenant_id, prompt, max_tokens=None: "unexpected")
+
+    assert len(submitted) == 1
+    assert tasks.summarize_document(1, "document") == "single-prompt summary"
+    second = summary_jobs.start_summary_job(1, "document")
+    assert summary_jobs.get_job(second)["result"] == {"summary": "map-reduce summary", "cached": True}
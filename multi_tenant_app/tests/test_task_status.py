@@ -0,0 +1,56 @@
+import uuid
+
+def ids(count):
+    return [str(uuid.uuid4()) for _ in range(count)]
+
+def test_query_string_takes_only_as_many_ids_as_fit_a_request_line(client, app):
+    max_ids = app.config['TASK_STATUS_QUERY_MAX_IDS']
+    # Also what gunicorn accepts (limit_request_line 4094)
+    assert len(f"GET /api/v1/task_status/events?task_ids={','.join(ids(max_ids))} HTTP/1.1") <= 4094
+
+    response = client.get(f"/api/v1/task_status/events?task_ids={','.join(ids(max_ids + 1))}")
+
+    assert response.status_code == 400
+    assert f"At most {max_ids}" in response.json["error"]
+
+def test_more_ids_can_be_posted(client, app):
+    app.config.update(TASK_STATUS_SSE_TIMEOUT=1)
+    task_ids = ids(app.config['TASK_STATUS_QUERY_MAX_IDS'] * 5)
+
+    response = client.post("/api/v1/task_status/events", json={"task_ids": task_ids})
+
+    assert response.status_code == 200
+    assert response.mimetype == "text/event-stream"
+    body = response.get_data(as_text=True)
+    assert body.startswith("event: status\n")
+    assert all(task_id in body for task_id in task_ids)
+
+def test_posted_ids_are_validated(client):
+    assert client.post("/api/v1/task_status/events", json={"task_ids": "abc"}).status_code == 400
+
+def test_watch_spends_at_most_its_timeout_subscribing_and_waiting(app, monkeypatch):
+    import time
+    from types import SimpleNamespace
+    from app import task_status
+
+    class UnconfirmedPubSub:
+        # The server never confirms the subscription nor publishes.
+        def subscribe(self, *channels):
+            pass
+
+        def get_message(self, timeout):
+            time.sleep(timeout)
+
+        def close(self):
+            pass
+
+    backend = SimpleNamespace(client=SimpleNamespace(pubsub=UnconfirmedPubSub), get_key_for_task=lambda task_id: task_id)
+    monkeypatch.setattr(task_status, "_redis_backend", lambda: backend)
+    monkeypatch.setattr(task_status, "get_statuses", lambda task_ids: {
+        task_id: {"task_id": task_id, "status": "PENDING", "result": None} for task_id in task_ids
+    })
+    task_ids = ids(2)
+
+    started = time.monotonic()
+    assert task_status.watch(task_ids, {task_id: "PENDING" for task_id in task_ids}, 0.3) == {}
+    assert time.monotonic() - started < 0.5
@@ -0,0 +1,59 @@
+from app import routes
+from app.metrics import REQUEST_DURATION
+
+def labelled_tenants():
+    return {
+        sample.labels["tenant"]
+        for metric in REQUEST_DURATION.collect() for sample in metric.samples
+        if sample.labels.get("endpoint") == "/api/v1/search_document"
+    }
+
+def test_requests_are_labelled_with_existing_tenants_only(client, tenant, monkeypatch):
+    monkeypatch.setattr(routes, "search_document", lambda tenant_id, query_text, n_results: {"status": "success", "results": []})
+
+    for tenant_id in (tenant, f"0{tenant}", 424242, "x-made-up"):
+        client.post("/api/v1/search_document", json={"tenant_id": tenant_id, "query_text": "hello"})
+    client.post("/api/v1/search_document?tenant_id=31337", json={"tenant_id": tenant, "query_text": "hello"})
+
+    assert labelled_tenants() <= {str(tenant), ""}
+    assert str(tenant) in labelled_tenants()
+
+def test_invalidating_a_tenant_drops_its_configs_cached_under_any_spelling(app, tenant):
+    from app import db
+    from app.config_cache import invalidate_tenant_config, tenant_exists
+    from app.models import Tenant
+
+    with app.app_context():
+        for tenant_id in (str(tenant), f"0{tenant}"):
+            assert tenant_exists(tenant_id)
+        db.session.delete(db.session.get(Tenant, tenant))
+        db.session.commit()
+        invalidate_tenant_config(tenant)
+
+        assert not tenant_exists(str(tenant))
+        assert not tenant_exists(f"0{tenant}")
+
+def test_fair_share_backlog_is_exported_by_tenant_agent_and_priority(app, client, monkeypatch):
+    from app import fair_share
+    from prometheus_client.parser import text_string_to_metric_families
+    from app.metrics import QUEUE_REGISTRY
+    from app.tasks import send_email_batch_task, send_email_task
+    app.config.update(FAIR_SHARE_ENABLED=True)
+    monkeypatch.setattr(fair_share, "broker_depths", lambda: {"email": 4})
+
+    fair_share.submit(send_email_task.s(7, "a@b.c", "hi", "body"), 7)
+    fair_share.submit(send_email_task.s(7, "d@e.f", "hi", "body"), 7)
+    fair_share.submit(send_email_batch_task.s(7, []), 7)
+    fair_share._pop_backlog("email", 7, 1)
+
+    def depth(name, **labels):
+        return QUEUE_REGISTRY.get_sample_value(name, labels)
+    assert depth("agent_queue_depth", tenant="7", agent="email", priority="0") == 1
+    assert depth("agent_queue_depth", tenant="7", agent="email", priority="6") == 1
+    assert depth("agent_broker_queue_depth", agent="email") == 4
+    exported = {
+        tuple(sorted(sample.labels.items())): sample.value
+        for family in text_string_to_metric_families(client.get("/metrics").get_data(as_text=True))
+        if family.name == "agent_queue_depth" for sample in family.samples
+    }
+    assert exported[(("agent", "email"), ("priority", "0"), ("tenant", "7"))] == 1